@@ -0,0 +1,424 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Reproducible load and benchmark suite for the Repos application,
+seeds a dedicated data source with a realistic data set and drives
+concurrent workloads against an in-process ReposApp (WSGI).
+
+Usage: python bench/benchmark.py [--packages 10000] [--artifacts 1000000]
+[--concurrency 16] [--requests 2000] [--output bench.json] [--compare old.json]
+
+The data source is the one configured for appier, for MongoDB the
+database is always the one of --database, "repos_bench" by default
+(use MONGOHQ_URL to point to a local instance), with ADAPTER=tiny a
+file based stand-in is used (only suitable for smoke runs with
+--concurrency 1), the repository is always the one of --path.
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import multiprocessing.pool
+
+try: import resource
+except ImportError: resource = None
+
+try: import pymongo.monitoring
+except ImportError: pymongo = None
+
+WORKLOADS = ("publish", "retrieve", "info", "list", "compress")
+""" The complete set of workloads supported by the suite, in
+the order in which they are executed by default """
+
+BRANCHES = ("master", "master", "master", "develop", "stable")
+""" The branches used for the seeded artifacts, weighted so
+that most of the artifacts belong to the master branch """
+
+BASE_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+""" The base path of the repository, used to find the sources
+(in case they are not installed) and the current revision """
+
+class CommandCounter(pymongo.monitoring.CommandListener if pymongo else object):
+    """
+    Listener for the MongoDB command monitoring events that keeps
+    a count of the commands issued per command name.
+    """
+
+    def __init__(self):
+        self.counts = dict()
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        with self._lock:
+            name = event.command_name
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def snapshot(self):
+        with self._lock: return dict(self.counts)
+
+    def diff(self, snapshot):
+        counts = self.snapshot()
+        diff = dict(
+            (name, count - snapshot.get(name, 0)) for name, count in counts.items()
+            if count - snapshot.get(name, 0) > 0
+        )
+        diff["total"] = sum(diff.values())
+        return diff
+
+class Client(object):
+    """
+    Minimal WSGI client that runs requests directly against the
+    application, consuming the complete (possibly streamed) body
+    of each response as a real client would do.
+    """
+
+    def __init__(self, app, secret_key = None):
+        self.app = app
+        self.secret_key = secret_key
+
+    def request(self, method, path, query = "", body = b"", content_type = None, admin = False):
+        environ = {
+            "REQUEST_METHOD" : method,
+            "PATH_INFO" : path,
+            "QUERY_STRING" : query,
+            "SCRIPT_NAME" : "",
+            "CONTENT_LENGTH" : str(len(body)),
+            "REMOTE_ADDR" : "127.0.0.1",
+            "SERVER_NAME" : "localhost",
+            "SERVER_PORT" : "80",
+            "SERVER_PROTOCOL" : "HTTP/1.1",
+            "HTTP_HOST" : "localhost",
+            "wsgi.input" : io.BytesIO(body),
+            "wsgi.errors" : sys.stderr,
+            "wsgi.url_scheme" : "http"
+        }
+        if content_type: environ["CONTENT_TYPE"] = content_type
+        if admin and self.secret_key: environ["HTTP_X_SECRET_KEY"] = self.secret_key
+        status = dict()
+        def start_response(code, headers, exc_info = None):
+            status["code"] = int(code.split(" ", 1)[0])
+        size = 0
+        result = self.app.application(environ, start_response)
+        try:
+            for chunk in result:
+                if isinstance(chunk, bytes): size += len(chunk)
+        finally:
+            if hasattr(result, "close"): result.close()
+        return status.get("code", 500), size
+
+def main():
+    parser = argparse.ArgumentParser(description = "Repos benchmark suite")
+    parser.add_argument("--packages", type = int, default = 10000)
+    parser.add_argument("--artifacts", type = int, default = 1000000)
+    parser.add_argument("--files", type = int, default = 64)
+    parser.add_argument("--info-keys", type = int, default = 64)
+    parser.add_argument("--concurrency", type = int, default = 16)
+    parser.add_argument("--requests", type = int, default = 2000)
+    parser.add_argument("--compress-requests", type = int, default = 4)
+    parser.add_argument("--workloads", default = ",".join(WORKLOADS))
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--reset", action = "store_true")
+    parser.add_argument("--database", default = "repos_bench")
+    parser.add_argument("--path", default = os.path.join(tempfile.gettempdir(), "repos-bench"))
+    parser.add_argument("--output", default = "bench.json")
+    parser.add_argument("--compare", default = None)
+    options = parser.parse_args()
+    if not "bench" in options.database:
+        parser.error("the database name must contain 'bench', as it may be dropped")
+
+    # forces a dedicated database and repository (overriding the ones of
+    # the environment) so that no real data is touched, as the data source
+    # may be dropped and the root account key is replaced, the repository
+    # path is stable so that a seeded data source can be re-used across runs
+    os.environ["MONGO_DB"] = options.database
+    os.environ["REPO_PATH"] = options.path
+    os.environ["TINY_PATH"] = options.path + ".json"
+    os.environ.setdefault("REPO_CAS", "1")
+    os.environ.setdefault("LEVEL", "WARNING")
+    sys.path.insert(0, os.path.join(BASE_PATH, "src"))
+
+    # registers the command listener before any connection is created
+    # so that every command sent to MongoDB is counted
+    counter = CommandCounter()
+    if pymongo: pymongo.monitoring.register(counter)
+
+    import appier
+    import appier_extras
+    import repos
+
+    app = repos.ReposApp()
+    app.start()
+    try:
+        if options.reset: appier.get_adapter().drop_db()
+        random.seed(options.seed)
+        result = dict(
+            meta = meta(app, options),
+            seed = seed(repos, options),
+            workloads = dict()
+        )
+        secret_key = admin_key(appier_extras)
+        client = Client(app, secret_key = secret_key)
+        packages = [_package["name"] for _package in repos.Package.find(map = True, fields = ["name"])]
+        workloads = [name.strip() for name in options.workloads.split(",") if name.strip()]
+        for name in workloads:
+            if not name in WORKLOADS: raise ValueError("Invalid workload '%s'" % name)
+            result["workloads"][name] = run(name, client, packages, counter, options)
+        result["peak_rss"] = peak_rss()
+    finally:
+        app.stop()
+
+    file = open(options.output, "w")
+    try: json.dump(result, file, indent = 4, sort_keys = True)
+    finally: file.close()
+
+    report(result, compare = load(options.compare) if options.compare else None)
+
+def meta(app, options):
+    try:
+        revision = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            cwd = BASE_PATH,
+            stderr = subprocess.STDOUT
+        ).decode("utf-8").strip()
+    except Exception:
+        revision = None
+    return dict(
+        version = app._version(),
+        revision = revision,
+        timestamp = int(time.time()),
+        python = platform.python_version(),
+        platform = platform.platform(),
+        adapter = os.environ.get("ADAPTER", "mongo"),
+        options = vars(options)
+    )
+
+def seed(repos, options):
+    # in case the data source is already seeded (and no reset has been
+    # requested) the existing data set is re-used as is
+    existing = repos.Artifact.get(rules = False, map = True, fields = ["id"], raise_e = False)
+    if existing: return dict(reused = True, duration = 0.0)
+
+    # stores a set of distinct files (with varied sizes) that are shared
+    # by the artifacts, so that the repository size remains bounded
+    start = time.time()
+    files = []
+    for index in range(options.files):
+        size = int(1024 * (2 ** (index % 11)))
+        files.append(repos.Artifact.store_blob(os.urandom(size)))
+
+    # inserts the packages and then the artifacts directly in the data
+    # source using bulk operations, as going through the models for
+    # millions of entities would take longer than the benchmark itself
+    timestamp = int(time.time()) - options.artifacts
+    names = ["bench-%05d" % index for index in range(options.packages)]
+    insert(repos.Package, (dict(
+        id = index + 1,
+        enabled = True,
+        name = name,
+        identifier = name,
+        type = "package",
+        branches = [],
+        heads = dict(),
+        created = timestamp,
+        modified = timestamp
+    ) for index, name in enumerate(names)))
+    def artifacts():
+        for index in range(options.artifacts):
+            path, size, digest = files[index % len(files)]
+            keys = random.randint(0, options.info_keys)
+            info = dict(("key%d" % key, uuid.uuid4().hex) for key in range(keys))
+            info["timestamp"] = timestamp + index
+            yield dict(
+                id = index + 1,
+                enabled = True,
+                key = uuid.uuid4().hex,
+                package = names[index % len(names)],
+                version = "1.0.%d" % (index // len(names)),
+                branch = BRANCHES[index % len(BRANCHES)],
+                tags = ["stable"] if index % 10 == 0 else [],
+                timestamp = timestamp + index,
+                info = info,
+                path = path,
+                size = size,
+                digest = digest,
+                url_tags = dict(),
+                created = timestamp + index,
+                modified = timestamp + index
+            )
+    insert(repos.Artifact, artifacts())
+
+    # rebuilds the summaries of the packages (latest, branches, etc.)
+    # using the aggregation, which is also part of what is measured
+    summary_start = time.time()
+    repos.Package.summarize()
+    return dict(
+        reused = False,
+        packages = options.packages,
+        artifacts = options.artifacts,
+        duration = time.time() - start,
+        summarize = time.time() - summary_start
+    )
+
+def insert(model, items, batch = 10000):
+    collection = model._collection()
+    base = getattr(collection, "_base", None)
+    buffer = []
+    last = 0
+    for item in items:
+        last = item["id"]
+        buffer.append(item)
+        if len(buffer) < batch: continue
+        _insert(collection, base, buffer)
+        buffer = []
+    if buffer: _insert(collection, base, buffer)
+    if last: model._ensure_min("id", last)
+
+def _insert(collection, base, items):
+    if hasattr(base, "insert_many"): base.insert_many(items, ordered = False)
+    else:
+        for item in items: collection.insert(item)
+
+def admin_key(appier_extras):
+    # sets a random secret key in the root account so that the admin
+    # only routes (publish and compress) may be used by the workloads
+    account = appier_extras.admin.Account.get(sort = [("id", 1)], rules = False)
+    key = uuid.uuid4().hex
+    appier_extras.admin.Account._collection().update(
+        dict(id = account.id),
+        {"$set" : dict(key = key)}
+    )
+    return key
+
+def run(name, client, packages, counter, options):
+    count = options.compress_requests if name == "compress" else options.requests
+    rng = random.Random("%d:%s" % (options.seed, name))
+    requests = [globals()["request_" + name](rng, index, packages) for index in range(count)]
+
+    # runs the requests using a pool of threads, measuring the latency of
+    # each one of them (including the consumption of the response body)
+    def execute(request):
+        start = time.time()
+        try: code, _size = client.request(*request[:-1], **request[-1])
+        except Exception: code = 500
+        return time.time() - start, code
+    snapshot = counter.snapshot()
+    start = time.time()
+    if options.concurrency > 1:
+        pool = multiprocessing.pool.ThreadPool(options.concurrency)
+        try: results = pool.map(execute, requests)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [execute(request) for request in requests]
+    duration = time.time() - start
+
+    latencies = sorted(latency for latency, _code in results)
+    errors = len([code for _latency, code in results if code >= 400])
+    return dict(
+        requests = count,
+        errors = errors,
+        concurrency = options.concurrency,
+        duration = duration,
+        throughput = count / duration if duration else 0.0,
+        latency = dict(
+            mean = sum(latencies) / len(latencies) * 1000.0 if latencies else 0.0,
+            p50 = percentile(latencies, 50) * 1000.0,
+            p90 = percentile(latencies, 90) * 1000.0,
+            p99 = percentile(latencies, 99) * 1000.0,
+            max = latencies[-1] * 1000.0 if latencies else 0.0
+        ),
+        mongo = counter.diff(snapshot),
+        peak_rss = peak_rss()
+    )
+
+def request_publish(rng, index, packages):
+    boundary = uuid.uuid4().hex
+    fields = [
+        ("name", None, rng.choice(packages).encode("utf-8")),
+        ("version", None, ("bench-%d-%d" % (index, rng.randint(0, 1 << 30))).encode("utf-8")),
+        ("contents", "contents.bin", os.urandom(rng.randint(1024, 65536)))
+    ]
+    body = b""
+    for name, file_name, value in fields:
+        disposition = "form-data; name=\"%s\"" % name
+        if file_name: disposition += "; filename=\"%s\"" % file_name
+        body += ("--%s\r\nContent-Disposition: %s\r\n\r\n" % (boundary, disposition)).encode("utf-8")
+        body += value + b"\r\n"
+    body += ("--%s--\r\n" % boundary).encode("utf-8")
+    return (
+        "POST",
+        "/packages",
+        "",
+        body,
+        dict(content_type = "multipart/form-data; boundary=%s" % boundary, admin = True)
+    )
+
+def request_retrieve(rng, index, packages):
+    return ("GET", "/packages/%s" % rng.choice(packages), "", b"", dict())
+
+def request_info(rng, index, packages):
+    return ("GET", "/packages/%s/info" % rng.choice(packages), "", b"", dict())
+
+def request_list(rng, index, packages):
+    return ("GET", "/packages/%s/artifacts" % rng.choice(packages), "limit=20", b"", dict())
+
+def request_compress(rng, index, packages):
+    return ("GET", "/compress", "stored=1", b"", dict(admin = True))
+
+def percentile(values, percent):
+    if not values: return 0.0
+    index = int(round((len(values) - 1) * percent / 100.0))
+    return values[index]
+
+def peak_rss():
+    # the maximum resident set size is reported in kilobytes in Linux
+    # and in bytes in macOS, it's normalized into kilobytes
+    if not resource: return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+def load(path):
+    file = open(path, "r")
+    try: return json.load(file)
+    finally: file.close()
+
+def report(result, compare = None):
+    print("%-10s %10s %8s %10s %10s %10s %8s" % (
+        "workload", "req/s", "errors", "p50 (ms)", "p99 (ms)", "mongo/req", "delta"
+    ))
+    for name, workload in result["workloads"].items():
+        mongo = workload["mongo"].get("total", 0) / float(workload["requests"] or 1)
+        delta = ""
+        if compare and name in compare.get("workloads", {}):
+            previous = compare["workloads"][name]["throughput"]
+            if previous: delta = "%+.1f%%" % ((workload["throughput"] / previous - 1.0) * 100.0)
+        print("%-10s %10.1f %8d %10.2f %10.2f %10.2f %8s" % (
+            name,
+            workload["throughput"],
+            workload["errors"],
+            workload["latency"]["p50"],
+            workload["latency"]["p99"],
+            mongo,
+            delta
+        ))
+    print("peak rss: %s KB" % result.get("peak_rss"))
+
+if __name__ == "__main__":
+    main()
@@ -17,11 +17,14 @@ setuptools.setup(
     packages = [
         "repos",
         "repos.controllers",
-        "repos.models"
+        "repos.models",
+        "repos.test",
+        "repos.util"
     ],
     package_dir = {
         "" : os.path.normpath("src")
     },
+    test_suite = "repos.test",
     install_requires = [
         "appier",
         "appier-extras",
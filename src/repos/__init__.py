@@ -3,8 +3,10 @@
 
 from . import controllers
 from . import models
+from . import util
 from . import main
 
 from .controllers import *
 from .models import *
+from .util import *
 from .main import ReposApp
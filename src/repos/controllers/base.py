@@ -1,6 +1,9 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
+import time
+import zipfile
+
 import appier
 
 import repos
@@ -10,5 +13,52 @@ class BaseController(appier.Controller):
     @appier.route("/compress", "GET", json = True)
     @appier.ensure(token = "admin")
     def compress(self):
-        path = repos.Artifact.compress()
-        return self.send_path(path, cache = True)
+        # retrieves the optional since timestamp that turns the backup
+        # into an incremental one and the flag that controls if the files
+        # should be stored as is (no compression CPU cost)
+        since = self.field("since", None, cast = int)
+        stored = self.field("stored", False, cast = bool)
+        compression = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+
+        # the backup timestamp is taken before any file is collected so
+        # that it may be safely used as the since value of the next backup
+        timestamp = int(time.time())
+        self.content_type("application/zip")
+        self.content_disposition("filename=\"repo-%d.zip\"" % timestamp)
+        self.request.set_header("X-Backup-Timestamp", str(timestamp))
+        return self._compress_g(since, compression)
+
+    @appier.route("/explain", "GET", json = True)
+    @appier.ensure(token = "admin")
+    def explain(self):
+        name = self.field("name", mandatory = True)
+        return repos.Artifact.explain(name)
+
+    @appier.route("/cache", "GET", json = True)
+    @appier.ensure(token = "admin")
+    def cache(self):
+        return dict(
+            resolution = repos.get_resolution().stats(),
+            catalog = repos.get_catalog().stats()
+        )
+
+    @appier.route("/metrics", "GET")
+    @appier.ensure(token = "admin")
+    def metrics(self):
+        self.content_type("text/plain; version=0.0.4; charset=utf-8")
+        return repos.get_metrics().render()
+
+    @appier.route("/pipeline", "GET", json = True)
+    @appier.ensure(token = "admin")
+    def pipeline(self):
+        return repos.get_pipeline().stats()
+
+    @appier.route("/retention", "GET", json = True)
+    @appier.ensure(token = "admin")
+    def retention(self):
+        return repos.Policy.prune(dry = True)
+
+    def _compress_g(self, since, compression):
+        yield -1
+        for chunk in repos.Artifact.compress_g(since = since, compression = compression):
+            yield chunk
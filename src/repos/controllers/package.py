@@ -2,6 +2,8 @@
 # -*- coding: utf-8 -*-
 
 import json
+import time
+import email.utils
 
 import appier
 
@@ -11,8 +13,16 @@ class PackageController(appier.Controller):
 
     @appier.route("/packages", "GET", json = True)
     def list(self):
+        # the unfiltered (and unsorted) list is served from the snapshot of
+        # the catalog, with no data source access, using only pagination and
+        # (sparse) fields, any other parameter runs the query as usual
         self.ensure_auth()
         object = appier.get_object(alias = True, find = True)
+        if not set(object.keys()) - set(("skip", "limit", "fields")): return self._catalog(
+            skip = object.get("skip", 0),
+            limit = object.get("limit", 0),
+            fields = object.get("fields", None)
+        )
         packages = repos.Package.find(map = True, **object)
         return packages
 
@@ -23,36 +33,246 @@ class PackageController(appier.Controller):
         self.ensure_auth()
 
         # tries to retrieve the optional version and tag fields
-        # that if present will add an extra level of filtering
+        # that if present will add an extra level of filtering, the
+        # tagged field filters by the tags of the artifacts while
+        # the tag field selects the URL of the remote artifacts
         version = self.field("version")
         branch = self.field("branch")
         tag = self.field("tag")
+        tagged = self.field("tagged")
 
-        # tries to retrieve the value of the current artifact
-        # it can be either a local file tuple or remote URL
-        result = repos.Artifact.retrieve(
+        # resolves the artifact that matches the provided criteria
+        # notice that no file contents are read at this stage
+        artifact = repos.Artifact.resolve(
             name = name,
             version = version,
             branch = branch,
-            tag = tag
+            tag = tagged
         )
 
-        # in case the resulting value is a string it's assumed
-        # that it should be an URL and proper redirect is ensured
-        if appier.legacy.is_string(result): return self.redirect(result)
+        # in case the artifact is not stored locally it's assumed
+        # that an URL exists and proper redirect is ensured
+        if not artifact.is_local: return self.redirect(artifact.remote_url(tag = tag))
+
+        # otherwise streams the artifact contents from the file system
+        # honoring any byte range requested by the client
+        return self.send_artifact(artifact)
+
+    @appier.route("/packages/<str:name>/delta", "GET", json = True)
+    def delta(self, name):
+        # ensures proper authentication and then resolves both the source
+        # (currently installed) and the target artifacts of the upgrade
+        self.ensure_auth()
+        source = self.field("from", mandatory = True)
+        version = self.field("to")
+        branch = self.field("branch")
+        target = repos.Artifact.resolve(name = name, version = version, branch = branch)
+        source = repos.Artifact.resolve(name = name, version = source)
+        self.request.set_header("X-Delta-From", source.version)
+        self.request.set_header("X-Delta-To", target.version)
+
+        # tries to obtain the (possibly cached) delta between both artifacts
+        # falling back to the full download of the target in case there's
+        # no delta available or it's not smaller than the target
+        path = repos.Artifact.delta(source, target)
+        if not path:
+            self.request.set_header("X-Delta", "full")
+            if not target.is_local: return self.redirect(target.remote_url())
+            return self.send_artifact(target)
+
+        # the delta is identified by the digests of both artifacts so it's
+        # immutable and may be cached by the client indefinitely
+        size = repos.Artifact.size_p(path)
+        self.content_type("application/x-bsdiff")
+        self.content_disposition(
+            "filename=\"%s-%s-%s.bsdiff\"" % (name, source.version, target.version)
+        )
+        self.request.set_header("X-Delta", "bsdiff4")
+        self.request.set_header("X-Delta-Digest", target.digest)
+        self.request.set_header("Cache-Control", "private, max-age=31536000, immutable")
+        return self._send_chunks(path, 0, size - 1)
+
+    @appier.route("/packages/<str:name>/sign", "GET", json = True)
+    def sign(self, name):
+        # resolves the artifact (the only data source access) and generates
+        # the signed and expiring URL from which it may be downloaded
+        self.ensure_auth()
+        version = self.field("version")
+        branch = self.field("branch")
+        expires = self.field("expires", None, cast = int)
+        artifact = repos.Artifact.resolve(name = name, version = version, branch = branch)
+        signed = artifact.sign(expires = expires)
+        url = self.url_for(
+            "package.download",
+            absolute = True,
+            path = signed["path"],
+            expires = signed["expires"],
+            file_name = signed["file_name"],
+            content_type = signed["content_type"],
+            signature = signed["signature"]
+        )
+        return dict(
+            url = url,
+            version = artifact.version,
+            expires = signed["expires"]
+        )
 
-        # otherwise the result should be a tuple and we must unpack
-        # it to check for proper contents
-        data, file_name, content_type = result
+    @appier.route("/packages/resolve", "POST", json = True)
+    def resolve(self):
+        # retrieves the sequence of specs to be resolved, each one either a
+        # map with the name, version (or range), branch, tagged (artifact tag)
+        # and tag (remote URL tag) or a string in the name@version format, as
+        # in a lock file, the request may be either a JSON document or a form
+        # with a serialized field
+        self.ensure_auth()
+        object = appier.get_object()
+        packages = object.get("packages", None)
+        urls = object.get("urls", None) or "direct"
+        expires = object.get("expires", None)
+        appier.verify(packages, message = "Mandatory field 'packages' not found in request", code = 400)
+        if appier.legacy.is_string(packages):
+            try: packages = json.loads(packages)
+            except ValueError: packages = None
         appier.verify(
-            not data == None,
-            message = "No data available in the package",
+            isinstance(packages, list),
+            message = "Field 'packages' must be a list",
+            code = 400,
             exception = appier.OperationalError
         )
-        content_type = content_type or "application/octet-stream"
-        return self.send_file(
-            data,
-            name = file_name,
+        if expires: expires = self._cast_int(expires, "expires")
+        limit = appier.conf("REPO_RESOLVE_LIMIT", 1000, cast = int)
+        appier.verify(
+            len(packages) <= limit,
+            message = "Too many packages to resolve (limit is %d)" % limit,
+            code = 400
+        )
+        specs = []
+        for spec in packages:
+            if appier.legacy.is_string(spec):
+                name, _sep, version = spec.partition("@")
+                spec = dict(name = name, version = version or None)
+            appier.verify(
+                isinstance(spec, dict),
+                message = "Invalid package spec '%s', must be a map or a string" % str(spec),
+                code = 400,
+                exception = appier.OperationalError
+            )
+            appier.verify(spec.get("name"), message = "Missing package name", code = 400)
+            for name in ("name", "version", "branch", "tagged", "tag"):
+                value = spec.get(name, None)
+                appier.verify(
+                    value == None or appier.legacy.is_string(value),
+                    message = "Invalid value for '%s' in package spec, must be a string" % name,
+                    code = 400,
+                    exception = appier.OperationalError
+                )
+            specs.append(spec)
+
+        # resolves all of the specs at once, building the entry of each one
+        # of them in the same order in which they have been requested
+        results = repos.Artifact.resolve_bulk(specs)
+        entries = [self._resolved(result, urls = urls, expires = expires) for result in results]
+        return dict(
+            packages = entries,
+            resolved = len([entry for entry in entries if not "error" in entry]),
+            failed = len([entry for entry in entries if "error" in entry])
+        )
+
+    @appier.route("/changes", "GET", json = True)
+    def changes(self):
+        # retrieves the cursor from which the changes should be returned, an
+        # unset cursor starts at the current one (no previous changes), for
+        # the event streams the last event identifier takes precedence
+        self.ensure_auth()
+        since = self.field("since", None, cast = int)
+        name = self.field("name")
+        limit = min(self.field("limit", 100, cast = int), 1000)
+        last_event = self.request.get_header("Last-Event-ID", None)
+        accept = self.request.get_header("Accept", None) or ""
+        stream = self.field("stream", "text/event-stream" in accept, cast = bool)
+        if last_event and last_event.isdigit(): since = int(last_event)
+        if since == None: since = repos.Change.cursor()
+
+        # retrieves the changes after the cursor, the cursor that is returned
+        # skips the changes of other packages (if filtered) so that they are
+        # not scanned again, then in case there's a gap between the cursor and
+        # the first change and the cursor is older than the oldest retained
+        # change the client is flagged to run a full resynchronization
+        changes, cursor = self._changes(since, name, limit)
+        retry = appier.conf("REPO_CHANGES_RETRY", 10, cast = int)
+        reset = False
+        if changes and changes[0]["id"] > since + 1: reset = since < repos.Change.oldest() - 1
+
+        # for the event streams the connection is kept open (up to a maximum
+        # duration) sending each change as an event, the client reconnects
+        # with the identifier of the last event it has received
+        if stream:
+            duration = appier.conf("REPO_CHANGES_STREAM", 300, cast = int)
+            self.content_type("text/event-stream")
+            self.request.set_header("Cache-Control", "no-cache")
+            self.request.set_header("X-Accel-Buffering", "no")
+            return self._stream_g(changes, cursor, name, limit, reset, duration)
+
+        # otherwise in case there are no changes and the client asked to wait
+        # (long-polling) the waiting is done in the body of the response, that
+        # is only sent once the handling of the request is over (and the other
+        # requests are no longer blocked by this one)
+        wait = min(self.field("wait", 0.0, cast = float), appier.conf("REPO_CHANGES_WAIT", 60, cast = int))
+        if not changes and wait > 0:
+            self.content_type("application/json")
+            return self._wait_g(cursor, name, limit, wait, retry)
+
+        # answers immediately with the interval after which the client should
+        # check again (in case there are no changes)
+        if not changes: self.request.set_header("Retry-After", str(retry))
+        return dict(changes = changes, cursor = cursor, reset = reset, retry = retry)
+
+    @appier.route("/downloads/<regex(\"[\\w\\-\\.\\+@:/]+\"):path>", "GET", json = True)
+    def download(self, path):
+        # verifies the signature of the URL, that covers the path of the file
+        # in the storage and the response headers, so that the file may be
+        # sent with no authentication and no data source access at all
+        expires = self.field("expires", 0, cast = int)
+        signature = self.field("signature", mandatory = True)
+        file_name = self.field("file_name")
+        content_type = self.field("content_type")
+        repos.Artifact.verify_p(
+            path,
+            expires,
+            signature,
+            file_name = file_name,
+            content_type = content_type
+        )
+
+        # uses the metadata of the file in the storage as its validators,
+        # as the artifact that references the file is not available
+        try: size, modified = repos.Artifact.stat_p(path)
+        except (IOError, OSError): raise appier.NotFoundError(
+            message = "File not found for signed path '%s'" % path
+        )
+        etag = "\"%x-%x\"" % (size, int(modified))
+        last_modified = email.utils.formatdate(modified, usegmt = True)
+        self.request.set_header("Etag", etag)
+        self.request.set_header("Last-Modified", last_modified)
+        if self._not_modified_v(etag, modified):
+            self.request.set_code(304)
+            return ""
+
+        # redirects large files to a direct URL of the storage (if any) and
+        # otherwise sends the file letting public caches keep it only until
+        # the signature expires
+        url = self._offload_p(path, size, file_name = file_name, content_type = content_type)
+        if url:
+            self.request.set_header("Cache-Control", "private, no-store")
+            return self.redirect(url)
+        max_age = max(expires - int(time.time()), 0)
+        self.request.set_header("Cache-Control", "public, max-age=%d" % max_age)
+        return self._send_file(
+            path,
+            size,
+            etag,
+            last_modified,
+            file_name = file_name,
             content_type = content_type
         )
 
@@ -70,6 +290,7 @@ class PackageController(appier.Controller):
         info = self.field("info")
         type = self.field("type")
         content_type = self.field("content_type")
+        digest = self.field("digest")
         if info: info = json.loads(info)
         if contents: _name, _content_type, data = contents
         else: data = None
@@ -85,21 +306,53 @@ class PackageController(appier.Controller):
             identifier = identifier,
             info = info,
             type = type,
-            content_type = content_type
-        )
-        return dict(
-            key = artifact.key,
-            package = artifact.package.name,
-            version = artifact.version,
-            file_name = artifact.file_name,
-            content_type = artifact.content_type
+            content_type = content_type,
+            digest = digest
         )
+        return self._published(artifact)
+
+    @appier.route("/packages/bulk", "POST", json = True)
+    @appier.ensure(token = "admin")
+    def publish_bulk(self):
+        # retrieves the sequence of artifact descriptions, that may be sent
+        # either as JSON or as a serialized form field (multipart)
+        artifacts = self.field("artifacts", mandatory = True)
+        replace = self.field("replace", True, cast = bool)
+        if appier.legacy.is_string(artifacts): artifacts = json.loads(artifacts)
+
+        # resolves the contents of each artifact, that reference a file
+        # field of the request by its name, and the URL tags
+        for artifact in artifacts:
+            contents = artifact.pop("contents", None)
+            if contents: _name, _content_type, artifact["data"] = self.field(
+                contents,
+                mandatory = True
+            )
+            url_tags = artifact.get("url_tags", None) or []
+            artifact["url_tags"] = dict([value.split(":", 1) for value in url_tags])
+
+        artifacts = repos.Artifact.publish_bulk(artifacts, replace = replace)
+        return [self._published(artifact) for artifact in artifacts]
 
     @appier.route("/packages/<str:name>/info", "GET", json = True)
     def info(self, name):
         self.ensure_auth()
         version = self.field("version")
-        return repos.Artifact._info(name = name, version = version)
+        branch = self.field("branch")
+        tagged = self.field("tagged")
+        return repos.Artifact._info(name = name, version = version, branch = branch, tag = tagged)
+
+    @appier.route("/packages/<str:name>/status", "GET", json = True)
+    def status(self, name):
+        self.ensure_auth()
+        version = self.field("version")
+        branch = self.field("branch")
+        artifact = repos.Artifact.resolve(name = name, version = version, branch = branch)
+        return dict(
+            version = artifact.version,
+            status = artifact.status or "ready",
+            stages = artifact.stages or dict()
+        )
 
     @appier.route("/packages/<str:name>/artifacts", "GET", json=True)
     def artifacts(self, name):
@@ -110,34 +363,117 @@ class PackageController(appier.Controller):
         if "sort" not in object_:
             object_["sort"] = [("timestamp", -1)]
 
-        # Perform the find query
+        # Build the projection for the query, by default every (public)
+        # field except "info" is returned, with only the requested
+        # expand_info fields being projected from the "info" dictionary
+        # (unless the complete "info" is explicitly requested)
+        fields = self.field("fields")
+        expand_info = self.field("expand_info")
+        fields = fields.split(",") if fields else repos.Artifact.list_fields()
+        expand_info_fields = expand_info.split(",") if expand_info else []
+        if not "info" in fields:
+            fields += ["info." + field for field in expand_info_fields]
+        object_.pop("fields", None)
+
+        # Perform the find query, letting the data source do the
+        # projection so that unwanted data is never transferred
         artifacts = repos.Artifact.find(
             package=name,
             map=True,
+            fill=False,
+            fields=fields,
             **object_
         )
 
-        # Check if any "info" fields should be included in the response
-        expand_info = self.field("expand_info")
-        expand_info_fields = expand_info.split(",") if expand_info else []
-
-        # Add the requested expanded_info fields to the response
-        # (if requested, otherwise remove the info field)
-        if not expand_info_fields:
-            for artifact in artifacts:
-                artifact.pop("info", None)
-        else:
+        # Filter the artifacts in case the data source ignores the
+        # projection (eg: TinyDB), so that the unwanted fields and the
+        # non requested "info" fields are never returned, keeping
+        # the "info" sub fields either requested or expanded
+        base = getattr(repos.Artifact._collection(), "_base", None)
+        if not hasattr(base, "aggregate"):
+            names = set(field.split(".", 1)[0] for field in fields)
+            names.add("_id")
+            info_fields = set(
+                field[5:].split(".", 1)[0] for field in fields if field.startswith("info.")
+            )
             for artifact in artifacts:
-                info = artifact.get("info", {})
-                expanded_info = {}
-                for field in list(info.keys()):
-                    if field in expand_info_fields:
-                        expanded_info[field] = info[field]
-                artifact["info"] = expanded_info
-
-        # Return the processed artifacts
+                for key in list(artifact.keys()):
+                    if not key in names: del artifact[key]
+                info = artifact.get("info", None)
+                if not info or "info" in fields: continue
+                artifact["info"] = dict(
+                    (field, info[field]) for field in info_fields if field in info
+                )
+
+        # Return the projected artifacts
         return artifacts
 
+    def send_artifact(self, artifact):
+        # selects the precompressed variant of the artifact that best fits
+        # the encodings accepted by the client (if any) using only metadata,
+        # scheduling the generation of the missing variants when they are
+        # lazily created
+        encodings = self._variants(artifact)
+        encoding = encodings[0] if encodings else None
+        if artifact.variants: self.request.set_header("Vary", "Accept-Encoding")
+        if not encoding and self.request.get_header("Accept-Encoding", None):
+            repos.Artifact.precompress_lazy(artifact)
+
+        # computes the validators for the artifact using only its metadata
+        # so that conditional requests are answered without any file I/O
+        etag = artifact.variant_etag(encoding) if encoding else artifact.etag
+        last_modified = artifact.last_modified
+        self.request.set_header("Etag", etag)
+        self.request.set_header("Last-Modified", last_modified)
+        if self._not_modified(artifact):
+            self.request.set_code(304)
+            return ""
+
+        # as the body is going to be sent makes sure that the file of the
+        # selected variant exists, as it may be missing (eg: after a restore)
+        # even if the artifact still references it, falling back to the next
+        # acceptable variant or to the identity encoding otherwise
+        if encoding:
+            storage = repos.Artifact.storage()
+            encoding = None
+            for _encoding in encodings:
+                if not storage.exists(repos.Artifact.variant_path(artifact.digest, _encoding)): continue
+                encoding = _encoding
+                break
+            etag = artifact.variant_etag(encoding) if encoding else artifact.etag
+            self.request.set_header("Etag", etag)
+
+        # in case the artifact is large enough and the storage is able to
+        # provide a (short lived) direct URL the client is redirected to it
+        # so that the bytes do not have to pass through the app workers
+        url = self._offload(artifact, encoding = encoding)
+        if url:
+            self.request.set_header("Cache-Control", "private, no-store")
+            return self.redirect(url)
+
+        # in case a variant has been selected its (already compressed) file
+        # is sent as is, notice that no range is supported in this case
+        content_type = artifact.content_type or "application/octet-stream"
+        if encoding:
+            path = repos.Artifact.variant_path(artifact.digest, encoding)
+            size = artifact.variants[encoding]
+            self.content_type(content_type)
+            self.content_disposition("filename=\"%s\"" % artifact.file_name)
+            self.request.set_header("Content-Encoding", encoding)
+            return self._send_chunks(path, 0, size - 1)
+
+        # retrieves the size of the artifact file, to be used in the
+        # computation of the range and in the content length
+        size = repos.Artifact.size_p(artifact.path)
+        return self._send_file(
+            artifact.path,
+            size,
+            etag,
+            last_modified,
+            file_name = artifact.file_name,
+            content_type = content_type
+        )
+
     def ensure_auth(self):
         username = appier.conf("REPO_USERNAME", None)
         password = appier.conf("REPO_PASSWORD", None)
@@ -151,3 +487,307 @@ class PackageController(appier.Controller):
                 "WWW-Authenticate" : "Basic realm=\"default\""
             }
         )
+
+    def _changes(self, since, name, limit):
+        # when the change stream is followed the cursor of the feed is known
+        # to be up to date, so that the clients that are up to date are
+        # answered with no data source access
+        feed = repos.get_feed()
+        if feed.watching and since >= feed.cursor: return [], since
+        changes = repos.Change.since(since, name = name, limit = limit)
+        if changes: return changes, changes[-1]["id"]
+        return changes, max(since, feed.cursor)
+
+    def _changes_w(self, since, name, limit, wait):
+        # waits up to the provided time for changes after the cursor, runs
+        # out of the handling of the request so the accesses to the data
+        # source are serialized with the requests (as they may not be thread
+        # safe) while the waiting is done with no lock held
+        feed = repos.get_feed()
+        deadline = time.time() + wait
+        cursor = since
+        while True:
+            with appier.base.REQUEST_LOCK:
+                changes, cursor = self._changes(cursor, name, limit)
+            if changes: return changes, cursor
+            remaining = deadline - time.time()
+            if remaining <= 0: return changes, cursor
+            if not feed.wait(cursor, remaining, self._cursor): return changes, cursor
+
+    def _wait_g(self, since, name, limit, wait, retry):
+        yield -1
+        changes, cursor = self._changes_w(since, name, limit, wait)
+        data = json.dumps(dict(changes = changes, cursor = cursor, reset = False, retry = retry))
+        yield appier.legacy.bytes(data)
+
+    def _stream_g(self, changes, cursor, name, limit, reset, duration):
+        # sends a comment periodically (while there are no changes) so that
+        # the idle connection is kept open by the proxies and the client
+        heartbeat = appier.conf("REPO_CHANGES_HEARTBEAT", 15, cast = int)
+        deadline = time.time() + duration
+        yield -1
+        yield b"retry: 1000\n\n"
+        if reset: yield b"event: reset\ndata: {}\n\n"
+        while True:
+            for change in changes:
+                data = json.dumps(change)
+                yield appier.legacy.bytes(
+                    "id: %d\nevent: %s\ndata: %s\n\n" % (change["id"], change["kind"], data)
+                )
+            remaining = deadline - time.time()
+            if remaining <= 0: break
+            changes, cursor = self._changes_w(cursor, name, limit, min(remaining, heartbeat))
+            if not changes: yield b": heartbeat\n\n"
+
+    def _cursor(self):
+        with appier.base.REQUEST_LOCK: return repos.Change.cursor()
+
+    def _cast_int(self, value, name):
+        try: return int(value)
+        except (TypeError, ValueError):
+            raise appier.OperationalError(
+                message = "Invalid value for '%s', must be an integer" % name,
+                code = 400
+            )
+
+    def _published(self, artifact):
+        return dict(
+            key = artifact.key,
+            package = artifact.package.name,
+            version = artifact.version,
+            file_name = artifact.file_name,
+            content_type = artifact.content_type,
+            size = artifact.size,
+            digest = artifact.digest,
+            status = artifact.status
+        )
+
+    def _resolved(self, result, urls = "direct", expires = None):
+        spec = result["spec"]
+        artifact = result["artifact"]
+        entry = dict(
+            name = spec["name"],
+            spec = spec.get("version", None),
+            branch = spec.get("branch", None),
+            tagged = spec.get("tagged", None)
+        )
+        if result["error"]:
+            entry.update(error = result["error"].message, code = result["error"].code)
+            return entry
+        entry.update(
+            key = artifact.key,
+            version = artifact.version,
+            branch = artifact.branch,
+            file_name = result["file_name"],
+            content_type = artifact.content_type,
+            size = artifact.size,
+            digest = artifact.digest,
+            timestamp = artifact.timestamp
+        )
+
+        # builds the URL from which the artifact may be downloaded, either
+        # the (authenticated) retrieve URL or a signed one, using the remote
+        # URL for the artifacts that are not stored locally
+        if urls == "none": return entry
+        if not artifact.is_local: entry["url"] = artifact.remote_url(tag = spec.get("tag", None))
+        elif urls == "signed":
+            signed = artifact.sign(expires = expires, file_name = result["file_name"])
+            entry["url"] = self.url_for(
+                "package.download",
+                absolute = True,
+                path = signed["path"],
+                expires = signed["expires"],
+                file_name = signed["file_name"],
+                content_type = signed["content_type"],
+                signature = signed["signature"]
+            )
+            entry["expires"] = signed["expires"]
+        else: entry["url"] = self.url_for(
+            "package.retrieve",
+            absolute = True,
+            name = spec["name"],
+            version = artifact.version,
+            branch = artifact.branch
+        )
+        return entry
+
+    def _offload(self, artifact, encoding = None):
+        return self._offload_p(
+            repos.Artifact.variant_path(artifact.digest, encoding) if encoding else artifact.path,
+            artifact.variants[encoding] if encoding else artifact.size,
+            file_name = artifact.file_name,
+            content_type = artifact.content_type,
+            content_encoding = encoding
+        )
+
+    def _offload_p(self, path, size, file_name = None, content_type = None, content_encoding = None):
+        redirect_size = appier.conf("REPO_REDIRECT_SIZE", 1048576, cast = int)
+        if redirect_size < 0: return None
+        if size == None or size < redirect_size: return None
+        return repos.Artifact.url_p(
+            path,
+            file_name = file_name,
+            content_type = content_type,
+            content_encoding = content_encoding
+        )
+
+    def _variants(self, artifact):
+        # variants are not used for range requests, as ranges would then
+        # apply to the compressed representation of the artifact
+        variants = artifact.variants or dict()
+        if not variants: return []
+        if self.request.get_header("Range", None): return []
+        qualities = self._qualities()
+        if not qualities: return []
+
+        # sorts the variants whose encoding is acceptable according to its
+        # quality value from the smallest one, using only the metadata of
+        # the artifact (no storage access)
+        candidates = [
+            (size, encoding) for encoding, size in variants.items()
+            if size and qualities.get(encoding, qualities.get("*", 0.0)) > 0.0
+        ]
+        return [encoding for _size, encoding in sorted(candidates)]
+
+    def _qualities(self):
+        # parses the accepted encodings of the request into a map that
+        # associates each of the encodings with its quality value
+        accept_encoding = self.request.get_header("Accept-Encoding", None)
+        if not accept_encoding: return dict()
+        qualities = dict()
+        for value in accept_encoding.split(","):
+            encoding, _sep, params = value.strip().partition(";")
+            quality = 1.0
+            for param in params.split(";"):
+                name, _sep, param_v = param.strip().partition("=")
+                if not name == "q": continue
+                try: quality = float(param_v)
+                except ValueError: quality = 0.0
+            qualities[encoding.strip().lower()] = quality
+        return qualities
+
+    def _catalog(self, skip = 0, limit = 0, fields = None):
+        data, data_gz, etag, modified = repos.Package.catalog(skip = skip, limit = limit, fields = fields)
+        self.request.set_header("Etag", etag)
+        self.request.set_header("Last-Modified", email.utils.formatdate(modified, usegmt = True))
+        self.request.set_header("Vary", "Accept-Encoding")
+        self.request.set_header("Cache-Control", "private, no-cache")
+        if self._not_modified_v(etag, modified):
+            self.request.set_code(304)
+            return ""
+
+        # sends the (already) compressed document in case the client accepts
+        # the gzip encoding, avoiding any compression cost per request
+        qualities = self._qualities()
+        self.content_type("application/json")
+        if qualities.get("gzip", qualities.get("*", 0.0)) > 0.0:
+            self.request.set_header("Content-Encoding", "gzip")
+            return data_gz
+        return data
+
+    def _send_file(
+        self,
+        path,
+        size,
+        etag,
+        last_modified,
+        file_name = None,
+        content_type = None
+    ):
+        # tries to determine the byte range requested by the client
+        # defaulting to the complete file if there's none (or invalid)
+        range = self._range(size, etag, last_modified)
+        start, end = range if range else (0, size - 1)
+
+        # sets the complete set of headers for the response, notice
+        # that partial responses have a different status code
+        self.content_type(content_type or "application/octet-stream")
+        if file_name: self.content_disposition("filename=\"%s\"" % file_name)
+        self.request.set_header("Accept-Ranges", "bytes")
+        if range:
+            self.request.set_code(206)
+            self.request.set_header(
+                "Content-Range",
+                "bytes %d-%d/%d" % (start, end, size)
+            )
+
+        # returns the generator that is going to stream the file in
+        # chunks, yielding the size of the payload as its first value
+        return self._send_chunks(path, start, end)
+
+    def _send_chunks(self, path, start, end):
+        yield end - start + 1
+        if end < start: return
+        for chunk in repos.Artifact.read_g(path, start = start, end = end):
+            yield chunk
+
+    def _not_modified(self, artifact):
+        # the client's version is valid for the entity tag of the contents
+        # and for the entity tags of each of the precompressed variants
+        valid = [artifact.etag] + [
+            artifact.variant_etag(encoding) for encoding in artifact.variants or dict()
+        ]
+        return self._not_modified_v(valid, artifact.timestamp)
+
+    def _not_modified_v(self, valid, modified):
+        # in case the if none match header is set it takes precedence over
+        # the modification date, and the (weak) comparison of the entity
+        # tags determines if the client's version is still valid
+        if appier.legacy.is_string(valid): valid = [valid]
+        if_none_match = self.request.get_header("If-None-Match", None)
+        if if_none_match:
+            etags = [value.strip() for value in if_none_match.split(",")]
+            etags = [value[2:] if value.startswith("W/") else value for value in etags]
+            return "*" in etags or any(etag in etags for etag in valid)
+
+        # otherwise falls back to the modification date comparison, using
+        # the provided timestamp as the modification date
+        if_modified_since = self.request.get_header("If-Modified-Since", None)
+        if not if_modified_since: return False
+        date = email.utils.parsedate_tz(if_modified_since)
+        if not date: return False
+        return (modified or 0) <= email.utils.mktime_tz(date)
+
+    def _range(self, size, etag, last_modified):
+        # retrieves the range header and returns immediately in case
+        # it's not set, meaning that the full contents are requested
+        range_s = self.request.get_header("Range", None)
+        if not range_s: return None
+
+        # in case the if range header is set and the validator (either an
+        # entity tag or a date) does not match the current one the complete
+        # file must be sent instead, as it has changed in the meantime
+        if_range = self.request.get_header("If-Range", None)
+        if if_range and not if_range in (etag, last_modified): return None
+
+        # only single byte ranges are supported, for other units or for
+        # multiple ranges the header is ignored (as allowed by the spec)
+        unit, _sep, spec = range_s.partition("=")
+        if not unit.strip() == "bytes": return None
+        if "," in spec: return None
+
+        # parses both ends of the range taking into account the suffix
+        # based ranges (eg: -500 for the last 500 bytes)
+        start_s, _sep, end_s = spec.strip().partition("-")
+        try:
+            if start_s:
+                start = int(start_s)
+                end = int(end_s) if end_s else size - 1
+            else:
+                start = max(size - int(end_s), 0)
+                end = size - 1
+        except ValueError:
+            return None
+        end = min(end, size - 1)
+
+        # verifies that the range is satisfiable for the file, raising
+        # the proper error otherwise (as expected by specification)
+        if start > end: raise appier.OperationalError(
+            message = "Requested range not satisfiable",
+            code = 416,
+            headers = {
+                "Content-Range" : "bytes */%d" % size
+            }
+        )
+
+        return (start, end)
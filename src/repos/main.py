@@ -4,6 +4,8 @@
 import appier
 import appier_extras
 
+import repos
+
 class ReposApp(appier.WebApp):
 
     def __init__(self, *args, **kwargs):
@@ -16,6 +18,62 @@ class ReposApp(appier.WebApp):
             *args, **kwargs
         )
 
+    def start(self, *args, **kwargs):
+        # creates the metrics registry before the models are started (and
+        # the data source connected) so that its commands are monitored
+        repos.get_metrics()
+        appier.WebApp.start(self, *args, **kwargs)
+        gc_cron = appier.conf("REPO_GC_CRON", None)
+        if gc_cron: self.cron(
+            repos.Artifact.collect,
+            gc_cron,
+            id = "gc",
+            description = "Removes files not referenced by any artifact"
+        )
+        retention_cron = appier.conf("REPO_RETENTION_CRON", None)
+        if retention_cron: self.cron(
+            repos.Policy.prune,
+            retention_cron,
+            id = "retention",
+            description = "Removes the artifacts expired by the retention policies"
+        )
+        pipeline_cron = appier.conf("REPO_PIPELINE_CRON", None)
+        if pipeline_cron: self.cron(
+            repos.Artifact.resume,
+            pipeline_cron,
+            id = "pipeline",
+            description = "Resumes the interrupted post publish processing of artifacts"
+        )
+        summary_cron = appier.conf("REPO_SUMMARY_CRON", None)
+        if summary_cron: self.cron(
+            repos.Package.summarize,
+            summary_cron,
+            id = "summary",
+            description = "Rebuilds the branch and version summaries of the packages"
+        )
+        changes_cron = appier.conf("REPO_CHANGES_CRON", None)
+        if changes_cron: self.cron(
+            repos.Change.prune,
+            changes_cron,
+            id = "changes",
+            description = "Removes the changes older than the retention period"
+        )
+        changes_watch = appier.conf("REPO_CHANGES_WATCH", True, cast = bool)
+        if changes_watch: repos.get_feed().watch(repos.Change._collection())
+
+    def application_wsgi(self, environ, start_response):
+        return repos.get_metrics().request(
+            lambda environ, start_response: appier.WebApp.application_wsgi(
+                self, environ, start_response
+            ),
+            environ,
+            start_response
+        )
+
+    def after_request(self):
+        appier.WebApp.after_request(self)
+        self.request.environ["repos.route"] = repos.route_name(self.request.method_i)
+
     def _version(self):
         return "0.3.0"
 
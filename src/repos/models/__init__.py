@@ -2,7 +2,11 @@
 # -*- coding: utf-8 -*-
 
 from . import artifact
+from . import change
 from . import package
+from . import policy
 
 from .artifact import Artifact
+from .change import Change
 from .package import Package
+from .policy import Policy
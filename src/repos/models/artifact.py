@@ -2,16 +2,70 @@
 # -*- coding: utf-8 -*-
 
 import os
+import re
+import hmac
 import time
+import zlib
 import shutil
+import hashlib
+import email.utils
 import zipfile
 import tempfile
+import threading
+import multiprocessing
+import multiprocessing.pool
 
 import appier
 import appier_extras
 
+from repos import util
+
+from . import change
 from . import package
 
+CHUNK_SIZE = 65536
+""" The size in bytes of each of the chunks that are going to
+be read from the file system when streaming artifact contents,
+this value bounds the memory used per download """
+
+DIGEST_REGEX = re.compile("^[0-9a-f]{64}$")
+""" The regular expression that validates a SHA-256 hex digest
+used to address blobs in the content addressable store """
+
+VARIANTS = dict(
+    gzip = ".gz",
+    zstd = ".zst"
+)
+""" The map that associates each of the supported content encodings
+with the extension of the files of its precompressed variants """
+
+VARIANTS_PATH = ".variants"
+""" The (hidden) directory of the storage where the precompressed
+variants of the contents of the artifacts are stored """
+
+DELTAS_PATH = ".deltas"
+""" The (hidden) directory of the storage where the generated
+deltas between the contents of artifacts are cached """
+
+FORMATS = (
+    ("zip", b"PK\x03\x04", 0, "application/zip"),
+    ("gzip", b"\x1f\x8b", 0, "application/gzip"),
+    ("bzip2", b"BZh", 0, "application/x-bzip2"),
+    ("xz", b"\xfd7zXZ\x00", 0, "application/x-xz"),
+    ("zstd", b"\x28\xb5\x2f\xfd", 0, "application/zstd"),
+    ("tar", b"ustar", 257, "application/x-tar")
+)
+""" The sequence of archive formats detected when inspecting the
+artifact files, with their magic bytes, offset and content type """
+
+PENDING = set()
+""" The set with the keys of the artifacts for which the generation
+of the precompressed variants is currently scheduled """
+
+PENDING_LOCK = threading.Lock()
+""" The lock that controls the access to the set of artifacts with
+pending generation of variants """
+
 class Artifact(appier_extras.admin.Base):
     """
     The base unit for the management or a repository, should
@@ -90,6 +144,50 @@ class Artifact(appier_extras.admin.Base):
     """ The field that describes the MIME based content type of the
     artifact, to be used in data retrieval """
 
+    size = appier.field(
+        type = int,
+        observations = """The size in bytes of the artifact file, only
+        set for locally stored artifacts"""
+    )
+    """ The size in bytes of the file where the artifact is stored
+    computed when the artifact file is written to the file system """
+
+    digest = appier.field(
+        index = True,
+        observations = """The SHA-256 hex digest of the artifact file
+        contents, only set for locally stored artifacts"""
+    )
+    """ The SHA-256 hex digest of the contents of the artifact file,
+    computed while streaming the contents to the file system """
+
+    variants = appier.field(
+        type = dict,
+        safe = True,
+        observations = """The sizes (in bytes) of the precompressed
+        variants of the artifact file by content encoding"""
+    )
+    """ Map that associates each content encoding with the size of the
+    precompressed variant of the file, an unset size means that the
+    variant was not small enough to be kept """
+
+    status = appier.field(
+        index = True,
+        safe = True,
+        observations = """The state of the post publish processing of
+        the artifact (pending, processing, ready or failed)"""
+    )
+    """ The state of the post publish processing stages of the
+    artifact, an unset value is considered to be ready """
+
+    stages = appier.field(
+        type = dict,
+        safe = True,
+        observations = """The result of each of the post publish
+        processing stages of the artifact"""
+    )
+    """ Map that associates the name of each of the post publish stages
+    with its result (status, duration and error or output) """
+
     path = appier.field(
         index = True,
         private = True,
@@ -147,10 +245,91 @@ class Artifact(appier_extras.admin.Base):
     def list_names(cls):
         return ["id", "package", "version", "branch", "timestamp"]
 
+    @classmethod
+    def list_fields(cls):
+        return [name for name in cls.fields() if not name == "info"]
+
     @classmethod
     def order_name(cls):
         return ["timestamp", -1]
 
+    @classmethod
+    def setup(cls):
+        super(Artifact, cls).setup()
+        collection = cls._collection()
+        for index in cls.compound_indexes():
+            collection.ensure_index(index, direction = "simple")
+
+    @classmethod
+    def compound_indexes(cls):
+        return [
+            [("package", 1), ("timestamp", -1)],
+            [("package", 1), ("branch", 1), ("timestamp", -1)],
+            [("package", 1), ("version", 1), ("timestamp", -1)],
+            [("package", 1), ("version", 1), ("branch", 1), ("timestamp", -1)],
+            [("package", 1), ("tags", 1), ("branch", 1), ("timestamp", -1)]
+        ]
+
+    @classmethod
+    def query_shapes(cls, name, version, branch, tag = None):
+        latest = [("timestamp", -1)]
+        return [
+            ("retrieve", dict(package = name), latest),
+            ("retrieve.version", dict(package = name, version = version), latest),
+            ("retrieve.branch", dict(package = name, branch = branch), latest),
+            (
+                "retrieve.version.branch",
+                dict(package = name, version = version, branch = branch),
+                latest
+            ),
+            (
+                "retrieve.tag.branch",
+                dict(package = name, tags = tag, branch = branch),
+                latest
+            ),
+            ("publish", dict(package = name, version = version, branch = branch), None),
+            ("artifacts", dict(package = name), latest)
+        ]
+
+    @classmethod
+    def explain(cls, name):
+        # explain is a MongoDB specific feature and so the underlying
+        # (raw) collection must be available for the operation
+        collection = cls._collection()
+        appier.verify(
+            hasattr(collection, "_base"),
+            message = "Explain is only supported for MongoDB",
+            exception = appier.OperationalError
+        )
+
+        # uses the latest artifact of the package to obtain realistic
+        # values for the version, branch and tag filters of the queries
+        artifact = cls.get(package = name, rules = False, sort = [("timestamp", -1)])
+        tag = artifact.tags[0] if artifact.tags else "latest"
+
+        # runs the explain operation for each of the query shapes issued
+        # by the application, flagging the ones that scan the collection
+        # or that require the results to be sorted in memory
+        report = []
+        shapes = cls.query_shapes(name, artifact.version, artifact.branch, tag = tag)
+        for query, filter, sort in shapes:
+            cursor = collection._base.find(filter)
+            if sort: cursor = cursor.sort(sort)
+            planner = cursor.explain()["queryPlanner"]
+            plan = planner["winningPlan"]
+            plan = plan.get("queryPlan", plan)
+            stages, indexes = cls._stages(plan)
+            report.append(dict(
+                query = query,
+                filter = filter,
+                sort = sort,
+                stages = stages,
+                indexes = indexes,
+                collscan = "COLLSCAN" in stages,
+                memory_sort = "SORT" in stages
+            ))
+        return report
+
     @classmethod
     def retrieve(
         cls,
@@ -158,28 +337,139 @@ class Artifact(appier_extras.admin.Base):
         name = None,
         version = None,
         branch = None,
-        tag = None
+        tag = None,
+        tagged = None
     ):
-        # creates the dynamic set of keyword arguments taking into
-        # account the default named arguments values
-        kwargs = dict()
-        if name: kwargs["package"] = name
-        if version: kwargs["version"] = version
-        if branch: kwargs["branch"] = branch
-
         # retrieves the artifact according to the search criteria and
         # verifies that the artifact is stored locally returning immediately
         # if that's not the case (nothing to be locally retrieved)
-        artifact = Artifact.get(rules = False, sort = [("timestamp", -1)], **kwargs)
-        if not artifact.is_local: return artifact.url_tags[tag] if tag else artifact.url
+        artifact = cls.resolve(name = name, version = version, branch = branch, tag = tagged)
+        if not artifact.is_local: return artifact.remote_url(tag = tag)
 
-        # reads the complete set of data contents from the artifact path
-        # and then returns the tuple with the content type and file name
-        contents = cls.read(artifact.path)
+        # creates the generator that reads the data contents of the artifact
+        # in chunks (never loading the complete file in memory) and returns
+        # it in the tuple together with the file name and content type
+        contents = cls.read_g(artifact.path)
         file_name = artifact.file_name
         content_type = artifact.content_type
         return contents, file_name, content_type
 
+    @classmethod
+    def resolve(cls, name = None, version = None, branch = None, tag = None):
+        # creates the dynamic set of keyword arguments taking into
+        # account the default named arguments values, the tag filters
+        # the artifacts that contain it in their (multi key) tags
+        kwargs = dict()
+        if name: kwargs["package"] = name
+        if version: kwargs["version"] = version
+        if branch: kwargs["branch"] = branch
+        if tag: kwargs["tags"] = tag
+
+        # tries to find the resolution in the cache, notice that only the
+        # package scoped resolutions are cached as the invalidation of the
+        # cache entries is performed at the package level
+        cache = util.get_resolution()
+        cls._sync_resolution(cache)
+        key = cls._resolution_key(version, branch, tag = tag)
+        model = cache.get(name, key) if name else None
+
+        # retrieves the most recent artifact that matches the provided
+        # criteria, notice that no data is read from the file system, for
+        # version ranges the version is first resolved using the package
+        # version index (so that the artifacts are not scanned)
+        if model == None:
+            if version and util.is_range(version):
+                appier.verify(
+                    name,
+                    message = "Version ranges require a package name",
+                    exception = appier.OperationalError
+                )
+                kwargs["version"] = package.Package.resolve_range(
+                    name,
+                    version,
+                    branch = branch,
+                    tag = tag
+                )
+            model = cls._latest(kwargs)
+            appier.verify(
+                model,
+                message = "Artifact not found for %s" % str(kwargs),
+                exception = appier.NotFoundError
+            )
+            if name: cache.set(name, key, model)
+
+        return cls.old(model = model, safe = False)
+
+    @classmethod
+    def resolve_bulk(cls, specs):
+        # retrieves the type and the version index of every package of the
+        # specs in a single query, used to resolve the version ranges and
+        # to build the file names (avoiding one query per artifact)
+        cache = util.get_resolution()
+        cls._sync_resolution(cache)
+        names = [spec["name"] for spec in specs]
+        packages = package.Package.version_indexes(names)
+
+        # builds the criteria of each spec (resolving its version range) and
+        # tries to find its resolution in the cache, the remaining ones are
+        # resolved together, with each distinct criteria resolved only once
+        results = []
+        pending = []
+        for spec in specs:
+            name = spec["name"]
+            version = spec.get("version", None)
+            branch = spec.get("branch", None)
+            tag = spec.get("tagged", None)
+            result = dict(spec = spec, artifact = None, file_name = None, error = None)
+            results.append(result)
+            try:
+                _package = packages.get(name, None)
+                appier.verify(
+                    _package,
+                    message = "Package '%s' not found" % name,
+                    exception = appier.NotFoundError
+                )
+                model = cache.get(name, cls._resolution_key(version, branch, tag = tag))
+                if version and util.is_range(version): version = package.Package._match_range(
+                    name,
+                    _package["versions"],
+                    version,
+                    branch = branch,
+                    tag = tag
+                )
+            except appier.AppierException as exception:
+                result["error"] = exception
+                continue
+            criteria = dict(package = name)
+            if version: criteria["version"] = version
+            if branch: criteria["branch"] = branch
+            if tag: criteria["tags"] = tag
+            result["model"] = model
+            result["criteria"] = criteria
+            if model == None: pending.append(criteria)
+
+        # runs the resolution of the criteria that are not cached and then
+        # builds the artifacts of the specs from the resolved models
+        models = cls._resolve_many(pending)
+        for result in results:
+            if result["error"]: continue
+            spec = result["spec"]
+            criteria = result.pop("criteria")
+            model = result.pop("model") or models.get(cls._criteria_key(criteria), None)
+            if not model:
+                result["error"] = appier.NotFoundError(
+                    message = "No artifact found for '%s'" % spec["name"]
+                )
+                continue
+            artifact = cls.old(model = model, safe = False)
+            result["artifact"] = artifact
+            result["file_name"] = "%s-%s.%s" % (
+                spec["name"],
+                artifact.version,
+                packages[spec["name"]].get("type", None) or "artifact"
+            )
+        return results
+
     @classmethod
     def publish(
         cls,
@@ -194,6 +484,7 @@ class Artifact(appier_extras.admin.Base):
         info = None,
         type = "package",
         content_type = None,
+        digest = None,
         replace = True
     ):
         url_tags = url_tags or dict()
@@ -214,8 +505,10 @@ class Artifact(appier_extras.admin.Base):
                 type = type
             )
             _package.save()
-        if data: path = cls.store(name, version, data)
-        else: path = None
+        if not data in (None, b""): path, size, digest = cls.store(name, version, data)
+        elif digest: path, size, digest = cls.reuse(digest)
+        else: path, size, digest = None, None, None
+        previous = (artifact.size or 0) if artifact else None
         artifact = artifact or Artifact(
             version = version,
             branch = branch,
@@ -225,65 +518,766 @@ class Artifact(appier_extras.admin.Base):
         artifact.timestamp = int(time.time())
         artifact.info = info
         artifact.path = path
+        artifact.size = size
+        artifact.digest = digest
         artifact.url = url
         artifact.url_tags = url_tags
         artifact.content_type = content_type
+        artifact.variants = dict()
+        artifact.status = "pending" if cls.pipeline_stages() else "ready"
+        artifact.stages = dict()
         artifact.save()
+        cls.process(artifact)
+        if previous == None: return artifact
+        package.Package.track([(artifact, False, previous)])
+        change.Change.record_artifact("publish", artifact)
         return artifact
 
+    @classmethod
+    def publish_bulk(cls, artifacts, replace = True, workers = None):
+        workers = workers or appier.conf("REPO_PUBLISH_WORKERS", 8, cast = int)
+
+        # normalizes the provided sequence of artifact descriptions, making
+        # sure that no artifact is repeated within the same batch
+        items = []
+        for item in artifacts:
+            item = dict(item)
+            appier.verify(
+                item.get("name") and item.get("version"),
+                message = "Name and version are required for every artifact",
+                exception = appier.OperationalError
+            )
+            item["branch"] = item.get("branch") or "master"
+            item["key"] = (item["name"], item["version"], item["branch"])
+            items.append(item)
+        keys = [item["key"] for item in items]
+        if len(set(keys)) < len(keys):
+            raise appier.OperationalError(message = "Duplicated artifact in batch")
+        if not items: return []
+
+        # retrieves the already existing artifacts and packages using a
+        # single query for each of them, note that the results are filtered
+        # by key as some data sources do not support the "$or" operator
+        names = sorted(set(item["name"] for item in items))
+        existing = cls.find(rules = False, **{"$or" : [
+            dict(package = name, version = version, branch = branch)
+            for name, version, branch in keys
+        ]})
+        existing = dict(
+            ((artifact.package_name, artifact.version, artifact.branch), artifact)
+            for artifact in existing
+        )
+        existing = dict((key, existing[key]) for key in keys if key in existing)
+        if existing and not replace:
+            raise appier.OperationalError(message = "Duplicated artifact")
+        packages = package.Package.find(**{"$or" : [dict(name = name) for name in names]})
+        packages = dict((_package.name, _package) for _package in packages)
+        packages = dict((name, packages[name]) for name in names if name in packages)
+        for item in items:
+            if item["name"] in packages: continue
+            _package = package.Package(
+                name = item["name"],
+                identifier = item.get("identifier") or item["name"],
+                type = item.get("type") or "package"
+            )
+            _package.save()
+            packages[item["name"]] = _package
+
+        # stores the files of the artifacts concurrently, as this is mostly
+        # I/O bound (and hashing releases the GIL) threads are used
+        def store(item):
+            data, digest = item.get("data"), item.get("digest")
+            if not data in (None, b""): return cls.store(item["name"], item["version"], data)
+            if digest: return cls.reuse(digest)
+            return None, None, None
+        workers = max(1, min(workers, len(items)))
+        pool = multiprocessing.pool.ThreadPool(workers)
+        try: stored = pool.map(store, items)
+        finally:
+            pool.close()
+            pool.join()
+
+        # builds the models of the artifacts running the same validation and
+        # hooks as a normal save, but without persisting them one by one
+        timestamp = int(time.time())
+        stages = cls.pipeline_stages()
+        operations = []
+        tracked = []
+        for item, (path, size, digest) in zip(items, stored):
+            _package = packages[item["name"]]
+            artifact = existing.get(item["key"], None) or Artifact(
+                version = item["version"],
+                branch = item["branch"]
+            )
+            previous = artifact.size if item["key"] in existing else 0
+            info = item.get("info", None)
+            if info: info["timestamp"] = timestamp
+            artifact.package = _package
+            artifact.tags = item.get("tags", [])
+            artifact.timestamp = timestamp
+            artifact.info = info
+            artifact.path = path
+            artifact.size = size
+            artifact.digest = digest
+            artifact.url = item.get("url", None)
+            artifact.url_tags = item.get("url_tags", None) or dict()
+            artifact.content_type = item.get("content_type", None)
+            artifact.variants = dict()
+            artifact.status = "pending" if stages else "ready"
+            artifact.stages = dict()
+            is_new = artifact.is_new()
+            artifact._validate()
+            artifact.pre_save()
+            if is_new: artifact.pre_create()
+            else: artifact.pre_update()
+            model = artifact._filter(
+                increment_a = is_new,
+                immutables_a = not is_new,
+                normalize = True
+            )
+            operations.append((is_new, artifact, model))
+            tracked.append((artifact, is_new, previous))
+
+        # writes the complete set of artifacts to the data source in a
+        # single bulk operation, then updates the instances with the
+        # (possibly) generated identifiers
+        cls._bulk_write(operations)
+        for is_new, artifact, model in operations:
+            if is_new: artifact.apply(model, safe_a = False)
+
+        # updates the summaries of the affected packages with a single
+        # bulk operation and invalidates their cached resolutions
+        package.Package.track(tracked)
+        for name in names: util.get_resolution().invalidate(name)
+        for _is_new, artifact, _model in operations: cls.process(artifact)
+        for _is_new, artifact, _model in operations: change.Change.record_artifact("publish", artifact)
+
+        return [artifact for _is_new, artifact, _model in operations]
+
+    @classmethod
+    def delete_bulk(cls, name, **kwargs):
+        # removes the complete set of artifacts of the package (matching the
+        # extra filters) in a single operation, the per artifact hooks are
+        # skipped and the files are left to be reclaimed by the collector
+        cls.delete_c(package = name, **kwargs)
+        util.get_resolution().invalidate(name)
+        change.Change.record(
+            "delete",
+            name,
+            version = kwargs.get("version", None),
+            branch = kwargs.get("branch", None)
+        )
+
+    @classmethod
+    def delete_ids(cls, ids):
+        # removes the artifacts with the provided identifiers using a single
+        # operation when supported by the data source, the per artifact
+        # hooks are skipped (as in the bulk delete)
+        collection = cls._collection()
+        base = getattr(collection, "_base", None)
+        if hasattr(base, "delete_many"):
+            base.delete_many({"id" : {"$in" : list(ids)}})
+            return
+        for id in ids: cls.delete_c(id = id)
+
+    @classmethod
+    def collect(cls, grace = None, pause = None, batch = 100, dry = False):
+        grace = appier.conf("REPO_GC_GRACE", 3600, cast = int) if grace == None else grace
+        pause = appier.conf("REPO_GC_PAUSE", 0.1, cast = float) if pause == None else pause
+
+        # gathers the set of paths referenced by artifacts, this is a snapshot
+        # so each candidate is checked again before being removed, as it
+        # may have been referenced in the meantime (eg: publish by digest)
+        artifacts = cls.find(rules = False, map = True, fill = False, fields = ["path", "digest"])
+        referenced = set(artifact["path"] for artifact in artifacts if artifact.get("path"))
+        digests = set(artifact["digest"] for artifact in artifacts if artifact.get("digest"))
+
+        # walks the storage looking for files that are not referenced,
+        # hidden directories (eg: staging) and recently modified files (that
+        # may belong to an artifact being published) are ignored, and the
+        # walk is throttled so that it does not starve serving I/O
+        limit = time.time() - grace
+        examined, removed, reclaimed = 0, 0, 0
+        for path, _size, modified in cls.storage().walk():
+            examined += 1
+            if pause and examined % batch == 0: time.sleep(pause)
+            if path in referenced: continue
+            if modified > limit: continue
+            size = cls._release(path, dry = dry)
+            if size == None: continue
+            removed += 1
+            reclaimed += size
+
+        # removes the cached deltas for which either the source or the
+        # target contents are no longer referenced by any artifact
+        storage = cls.storage()
+        for path, size, _modified in storage.walk(prefix = DELTAS_PATH):
+            examined += 1
+            source, _sep, target = path.rsplit("/", 1)[-1].partition("-")
+            if source in digests and target in digests: continue
+            removed += 1
+            reclaimed += size
+            if dry: continue
+            storage.remove(path)
+
+        # removes the precompressed variants whose contents are no longer
+        # referenced by any artifact, as they can no longer be served
+        for path, size, _modified in storage.walk(prefix = VARIANTS_PATH):
+            examined += 1
+            digest = path.rsplit("/", 1)[-1].split(".", 1)[0]
+            if digest in digests: continue
+            removed += 1
+            reclaimed += size
+            if dry: continue
+            storage.remove(path)
+
+        return dict(
+            examined = examined,
+            removed = removed,
+            reclaimed = reclaimed,
+            dry = dry
+        )
+
     @classmethod
     def store(cls, name, version, data):
-        repo_path = appier.conf("REPO_PATH", "repo")
-        base_path = os.path.join(repo_path, name)
-        file_path = os.path.join(base_path, version)
-        base_path = os.path.normpath(base_path)
-        file_path = os.path.normpath(file_path)
+        if cls.is_cas(): return cls.store_blob(data)
         simple_path = "%s/%s" % (name, version)
-        if not os.path.exists(base_path): os.makedirs(base_path)
-        file = open(file_path, "wb")
-        try: file.write(data)
-        finally: file.close()
-        return simple_path
+        size, digest = cls.write(simple_path, data)
+        return simple_path, size, digest
+
+    @classmethod
+    def store_blob(cls, data):
+        # spools the data into a temporary file under the blobs directory
+        # as the digest (and so the final path) is only known at the end
+        storage = cls.storage()
+        temp_path, size, digest = cls._spool(data, storage.spool_path("blobs"))
+
+        # moves the temporary file into its content addressed location,
+        # in case a blob with the same digest already exists the file is
+        # discarded instead, so that duplicated contents are stored once
+        blob_path = cls.blob_path(digest)
+        try:
+            if not storage.exists(blob_path): storage.put(blob_path, temp_path)
+        finally:
+            if os.path.exists(temp_path): os.remove(temp_path)
+
+        return blob_path, size, digest
+
+    @classmethod
+    def reuse(cls, digest):
+        appier.verify(
+            cls.is_cas(),
+            message = "Publishing by digest requires content addressable storage",
+            exception = appier.OperationalError
+        )
+        appier.verify(
+            cls.has_blob(digest),
+            message = "No blob available for digest '%s'" % digest,
+            exception = appier.NotFoundError
+        )
+        blob_path = cls.blob_path(digest)
+        return blob_path, cls.size_p(blob_path), digest
+
+    @classmethod
+    def process(cls, artifact):
+        # schedules the post publish stages of the artifact in the bounded
+        # pool of workers, so that the publish request is not held by them
+        if not cls.pipeline_stages(): return False
+        return util.get_pipeline().submit(artifact.key, cls.process_stages, artifact.id)
+
+    @classmethod
+    def process_stages(cls, id):
+        # loads the current version of the artifact, its timestamp is used
+        # to detect a re-publish while processing, in which case the status
+        # is left untouched (pending) for the new contents to be processed
+        artifact = cls.get(id = id, rules = False, raise_e = False)
+        if not artifact: return
+        timestamp = artifact.timestamp
+        stages = dict()
+        cls._set_status(artifact, "processing", stages, timestamp)
+
+        # runs each of the configured stages in order, stopping at the first
+        # one that fails and recording the result of each of them
+        for name in cls.pipeline_stages():
+            function = util.get_stage(name)
+            start = time.time()
+            try:
+                appier.verify(
+                    function,
+                    message = "Unknown stage '%s'" % name,
+                    exception = appier.OperationalError
+                )
+                result = function(artifact)
+            except Exception as exception:
+                stages[name] = dict(
+                    status = "failed",
+                    duration = round(time.time() - start, 3),
+                    error = appier.legacy.UNICODE(exception)
+                )
+                cls._set_status(artifact, "failed", stages, timestamp)
+                raise
+            stages[name] = dict(status = "done", duration = round(time.time() - start, 3))
+            if result: stages[name]["result"] = result
+
+        cls._set_status(artifact, "ready", stages, timestamp)
+
+    @classmethod
+    def resume(cls, grace = None):
+        # re-schedules the processing of the artifacts that have been pending
+        # for longer than the grace period, as their processing may have been
+        # interrupted (eg: by a restart of the process)
+        grace = appier.conf("REPO_PIPELINE_GRACE", 600, cast = int) if grace == None else grace
+        limit = time.time() - grace
+        count = 0
+        for status in ("pending", "processing"):
+            artifacts = cls.find(
+                status = status,
+                rules = False,
+                map = True,
+                fields = ["id", "key", "timestamp"]
+            )
+            for artifact in artifacts:
+                if (artifact.get("timestamp") or 0) > limit: continue
+                pipeline = util.get_pipeline()
+                if pipeline.submit(artifact["key"], cls.process_stages, artifact["id"]): count += 1
+        return count
+
+    @classmethod
+    def pipeline_stages(cls):
+        stages = appier.conf("REPO_PIPELINE", "")
+        return [stage.strip() for stage in stages.split(",") if stage.strip()]
+
+    @classmethod
+    def stage_inspect(cls, artifact):
+        # detects the archive format of the file from its first bytes and
+        # for (locally stored) zip archives also reads their directory
+        if not artifact.is_local: return None
+        header = b"".join(cls.read_g(artifact.path, end = 511))
+        format = cls._format(header)
+        if not format: return None
+        name, _magic, _offset, content_type = format
+        result = dict(format = name)
+        storage = cls.storage()
+        if name == "zip" and storage.is_local:
+            zip_file = zipfile.ZipFile(storage.full_path(artifact.path), "r")
+            try: entries = zip_file.infolist()
+            finally: zip_file.close()
+            result["entries"] = len(entries)
+            result["size"] = sum(entry.file_size for entry in entries)
+
+        # stores the result in the info of the artifact, and uses the format
+        # as the content type in case none has been provided on publish
+        info = dict(artifact.info or dict())
+        info["archive"] = result
+        updates = dict(info = info)
+        if not artifact.content_type: updates["content_type"] = content_type
+        cls._collection().update(dict(id = artifact.id), {"$set" : updates})
+        for key, value in updates.items(): setattr(artifact, key, value)
+        util.get_resolution().invalidate(artifact.package_name)
+        return result
+
+    @classmethod
+    def stage_variants(cls, artifact):
+        if not cls.variants_mode() == "publish": return None
+        return cls.precompress(artifact)
+
+    @classmethod
+    def precompress(cls, artifact, encodings = None):
+        # variants are only possible for locally stored artifacts with a
+        # known digest, as the variant files are shared by their contents
+        encodings = cls.variants_encodings() if encodings == None else encodings
+        if not artifact.is_local or not artifact.digest: return dict()
+        storage = cls.storage()
+        ratio = appier.conf("REPO_VARIANTS_RATIO", 0.9, cast = float)
+        variants = dict(artifact.variants or dict())
+
+        # iterates over the requested encodings generating the variants
+        # that are still missing, only keeping the ones that are smaller
+        # enough than the original file to be worth being served
+        for encoding in encodings:
+            if encoding in variants: continue
+            compressor = cls._compressor(encoding)
+            if not compressor: continue
+            path = cls.variant_path(artifact.digest, encoding)
+            try: variants[encoding] = storage.size(path); continue
+            except OSError: pass
+            spool_path = storage.spool_path(os.path.dirname(path))
+            temp_path, size = cls._compress(artifact.path, compressor, spool_path)
+            try:
+                if size < (artifact.size or 0) * ratio:
+                    storage.put(path, temp_path)
+                    variants[encoding] = size
+                else:
+                    variants[encoding] = None
+            finally:
+                if os.path.exists(temp_path): os.remove(temp_path)
+
+        # updates only the variants of the artifact in the data source, so
+        # that no other (possibly concurrent) change is overwritten
+        cls._collection().update(dict(id = artifact.id), {"$set" : dict(variants = variants)})
+        artifact.variants = variants
+        util.get_resolution().invalidate(artifact.package_name)
+        return variants
+
+    @classmethod
+    def precompress_lazy(cls, artifact):
+        # schedules the generation of the missing variants in background,
+        # making sure that the same artifact is not scheduled twice
+        if not cls.variants_mode() == "lazy": return
+        if not artifact.is_local or not artifact.digest: return
+        variants = artifact.variants or dict()
+        encodings = [encoding for encoding in cls.variants_encodings() if not encoding in variants]
+        if not encodings: return
+        with PENDING_LOCK:
+            if artifact.key in PENDING: return
+            PENDING.add(artifact.key)
+        def precompress():
+            try: cls.precompress(artifact, encodings = encodings)
+            finally:
+                with PENDING_LOCK: PENDING.discard(artifact.key)
+        appier.get_app().delay(precompress)
+
+    @classmethod
+    def variants_encodings(cls):
+        encodings = appier.conf("REPO_VARIANTS", "")
+        encodings = [encoding.strip() for encoding in encodings.split(",")]
+        return [encoding for encoding in encodings if encoding in VARIANTS]
+
+    @classmethod
+    def variants_mode(cls):
+        if not cls.variants_encodings(): return None
+        return appier.conf("REPO_VARIANTS_MODE", "lazy")
+
+    @classmethod
+    def variant_path(cls, digest, encoding):
+        return "%s/%s/%s%s" % (VARIANTS_PATH, digest[:2], digest, VARIANTS[encoding])
+
+    @classmethod
+    def delta(cls, source, target):
+        # deltas are only possible between locally stored artifacts with
+        # known digests, which are used to identify the (cached) delta
+        if not source.is_local or not target.is_local: return None
+        if not source.digest or not target.digest: return None
+        storage = cls.storage()
+        path = cls.delta_path(source.digest, target.digest)
+
+        # in case the delta has already been generated it's re-used, notice
+        # that an empty delta marks one that was not smaller than the target
+        try: return path if storage.size(path) > 0 else None
+        except OSError: pass
+
+        # generates the delta between both files, as this requires both of
+        # them to be loaded in memory there's a limit on their sizes
+        try: import bsdiff4
+        except ImportError: return None
+        max_size = appier.conf("REPO_DELTA_SIZE", 67108864, cast = int)
+        if (source.size or 0) > max_size or (target.size or 0) > max_size: return None
+        patch = bsdiff4.diff(cls.read(source.path), cls.read(target.path))
+        if len(patch) >= (target.size or 0): patch = b""
+        cls.write(path, patch)
+        return path if patch else None
+
+    @classmethod
+    def delta_path(cls, source, target):
+        return "%s/%s/%s-%s" % (DELTAS_PATH, target[:2], source, target)
+
+    @classmethod
+    def has_blob(cls, digest):
+        if not DIGEST_REGEX.match(digest or ""): return False
+        return cls.storage().exists(cls.blob_path(digest))
+
+    @classmethod
+    def blob_path(cls, digest):
+        appier.verify(
+            DIGEST_REGEX.match(digest or ""),
+            message = "Invalid digest '%s'" % digest,
+            exception = appier.OperationalError
+        )
+        return "blobs/%s/%s/%s" % (digest[:2], digest[2:4], digest)
+
+    @classmethod
+    def is_cas(cls):
+        return appier.conf("REPO_CAS", False, cast = bool)
+
+    @classmethod
+    def storage(cls):
+        return util.get_storage()
+
+    @classmethod
+    def write(cls, path, data, chunk_size = CHUNK_SIZE):
+        # creates a temporary file in the spool directory of the storage
+        # (same file system for local storage) and only then puts it in
+        # place, so that readers never see a partially written file
+        storage = cls.storage()
+        spool_path = storage.spool_path(os.path.dirname(path))
+        temp_path, size, digest = cls._spool(data, spool_path, chunk_size = chunk_size)
+        try: storage.put(path, temp_path)
+        finally:
+            if os.path.exists(temp_path): os.remove(temp_path)
+        return size, digest
 
     @classmethod
     def read(cls, path):
-        repo_path = appier.conf("REPO_PATH", "repo")
-        full_path = os.path.join(repo_path, path)
-        full_path = os.path.normpath(full_path)
-        file = open(full_path, "rb")
-        try: contents = file.read()
-        finally: file.close()
-        return contents
+        return b"".join(cls.read_g(path))
+
+    @classmethod
+    def read_g(cls, path, start = 0, end = None, chunk_size = CHUNK_SIZE):
+        return cls.storage().read_g(path, start = start, end = end, chunk_size = chunk_size)
+
+    @classmethod
+    def size_p(cls, path):
+        return cls.storage().size(path)
+
+    @classmethod
+    def stat_p(cls, path):
+        return cls.storage().stat(path)
 
     @classmethod
-    def compress(cls):
-        repo_path = appier.conf("REPO_PATH", "repo")
-        _zip_handle, zip_path = tempfile.mkstemp()
+    def url_p(cls, path, file_name = None, content_type = None, content_encoding = None):
+        # returns a short lived URL from which the file may be directly
+        # downloaded, in case the storage is able to provide one
+        expires = appier.conf("REPO_REDIRECT_EXPIRES", 300, cast = int)
+        return cls.storage().url(
+            path,
+            expires = expires,
+            file_name = file_name,
+            content_type = content_type,
+            content_encoding = content_encoding
+        )
+
+    @classmethod
+    def sign_p(cls, path, file_name = None, content_type = None, expires = None):
+        # the expiration is aligned (down) to a fraction of the validity so
+        # that the links generated within the same window are equal and may
+        # be cached by the edge caches (as the URL is their cache key), the
+        # configured validity is then an upper bound of the real one
+        validity = appier.conf("REPO_SIGN_EXPIRES", 3600, cast = int)
+        validity = min(expires, validity) if expires else validity
+        step = max(validity // 4, 1)
+        expires = (int(time.time()) + validity) // step * step
+        return dict(
+            path = path,
+            expires = expires,
+            file_name = file_name,
+            content_type = content_type,
+            signature = cls.signature(
+                path,
+                expires,
+                file_name = file_name,
+                content_type = content_type
+            )
+        )
+
+    @classmethod
+    def verify_p(cls, path, expires, signature, file_name = None, content_type = None):
+        expected = cls.signature(
+            path,
+            expires,
+            file_name = file_name,
+            content_type = content_type
+        )
+        appier.verify(
+            hmac.compare_digest(expected.encode("utf-8"), (signature or "").encode("utf-8")),
+            message = "Invalid signature",
+            code = 403,
+            exception = appier.SecurityError
+        )
+        appier.verify(
+            expires >= time.time(),
+            message = "Signature has expired",
+            code = 403,
+            exception = appier.SecurityError
+        )
+
+    @classmethod
+    def signature(cls, path, expires, file_name = None, content_type = None):
+        # the signature covers every value that is used in the response so
+        # that none of them may be changed without invalidating it, the secret
+        # is global as the artifact is not loaded when verifying it
+        secret = appier.conf("REPO_SIGN_SECRET", None) or appier.get_app().crypt_secret
+        appier.verify(
+            secret,
+            message = "No secret defined for signing",
+            exception = appier.OperationalError
+        )
+        message = "\n".join((path, str(expires), file_name or "", content_type or ""))
+        return hmac.new(
+            secret.encode("utf-8"),
+            message.encode("utf-8"),
+            hashlib.sha256
+        ).hexdigest()
+
+    @classmethod
+    def full_path(cls, path):
+        cls._ensure_local()
+        return cls.storage().full_path(path)
+
+    @classmethod
+    def compress(cls, since = None, compression = zipfile.ZIP_DEFLATED):
+        zip_handle, zip_path = tempfile.mkstemp()
+        zip_file = os.fdopen(zip_handle, "wb")
+        try:
+            for chunk in cls.compress_g(since = since, compression = compression):
+                zip_file.write(chunk)
+        finally:
+            zip_file.close()
+        return zip_path
+
+    @classmethod
+    def compress_g(
+        cls,
+        since = None,
+        compression = zipfile.ZIP_DEFLATED,
+        chunk_size = CHUNK_SIZE
+    ):
+        # the interpreters with no support for writing the entries of a zip
+        # file by chunks (no zip info from file) require a seekable file, so
+        # the archive is completely built in a temporary file before sent
+        if not hasattr(zipfile.ZipInfo, "from_file"):
+            for chunk in cls._compress_file_g(
+                since = since,
+                compression = compression,
+                chunk_size = chunk_size
+            ): yield chunk
+            return
+
+        # creates the zip file on top of a non seekable buffer stream so
+        # that the archive may be sent to the client while it's being
+        # built, instead of being completely written to disk first
+        stream = util.BufferStream()
         zip_file = zipfile.ZipFile(
-            zip_path,
+            stream,
             mode = "w",
+            compression = compression,
             allowZip64 = True
         )
+
+        # iterates over the complete set of files to be included in the
+        # backup and writes them into the archive in chunks, yielding
+        # the compressed data as soon as it becomes available
         try:
-            for name, _subdirs, files in os.walk(repo_path):
-                relative_name = os.path.relpath(name, repo_path)
-                zip_file.write(name, relative_name)
-                for filename in files:
-                    file_path = os.path.join(name, filename)
-                    relative_path = os.path.relpath(file_path, repo_path)
-                    zip_file.write(file_path, relative_path)
-        finally: zip_file.close()
-        return zip_path
+            storage = cls.storage()
+            for path in cls.backup_paths(since = since):
+                if not storage.exists(path): continue
+                # the (expected) size of the file is set in the entry so that
+                # the zip64 extensions are used for the large files, otherwise
+                # the entry fails once its data goes beyond the zip limit
+                size, modified = storage.stat(path)
+                info = zipfile.ZipInfo(path, time.localtime(modified)[:6])
+                info.file_size = size
+                info.compress_type = compression
+                info.external_attr = 0o644 << 16
+                entry = zip_file.open(info, "w")
+                try:
+                    for chunk in cls.read_g(path, chunk_size = chunk_size):
+                        entry.write(chunk)
+                        data = stream.pop()
+                        if data: yield data
+                finally:
+                    entry.close()
+                data = stream.pop()
+                if data: yield data
+        finally:
+            zip_file.close()
+
+        yield stream.pop()
 
     @classmethod
-    def expand(cls, zip_path, empty = True):
-        repo_path = appier.conf("REPO_PATH", "repo")
-        exists = os.path.exists(repo_path)
-        if empty and exists: shutil.rmtree(repo_path); exists = False
-        if not exists: os.makedirs(repo_path)
-        zip_file = zipfile.ZipFile(zip_path, mode = "r")
-        try: zip_file.extractall(repo_path)
-        finally: zip_file.close()
+    def _compress_file_g(
+        cls,
+        since = None,
+        compression = zipfile.ZIP_DEFLATED,
+        chunk_size = CHUNK_SIZE
+    ):
+        zip_handle, zip_path = tempfile.mkstemp()
+        os.close(zip_handle)
+        try:
+            zip_file = zipfile.ZipFile(
+                zip_path,
+                mode = "w",
+                compression = compression,
+                allowZip64 = True
+            )
+            try:
+                storage = cls.storage()
+                for path in cls.backup_paths(since = since):
+                    if not storage.exists(path): continue
+                    zip_file.write(cls.full_path(path), path)
+            finally:
+                zip_file.close()
+
+            file = open(zip_path, "rb")
+            try:
+                while True:
+                    data = file.read(chunk_size)
+                    if not data: break
+                    yield data
+            finally:
+                file.close()
+        finally:
+            os.remove(zip_path)
+
+    @classmethod
+    def backup_paths(cls, since = None):
+        # in case no since timestamp is provided the backup is a full one
+        # and the complete repository directory is walked for files, plus
+        # the (hidden) precompressed variants that are referenced by the
+        # artifacts, so that they are still available after a restore
+        if since == None:
+            storage = cls.storage()
+            for path, _size, _modified in storage.walk(): yield path
+            for path, _size, _modified in storage.walk(prefix = VARIANTS_PATH): yield path
+            return
+
+        # otherwise the backup is incremental and only the files of the
+        # artifacts published since the provided timestamp are included,
+        # notice that shared files (eg: blobs) are only included once, in
+        # case the data source is not MongoDB (no support for operators) the
+        # timestamp filter is applied after the retrieval
+        base = getattr(cls._collection(), "_base", None)
+        kwargs = dict(timestamp = {"$gte" : since}) if hasattr(base, "aggregate") else dict()
+        artifacts = cls.find(rules = False, **kwargs)
+        paths = set()
+        for artifact in artifacts:
+            if (artifact.timestamp or 0) < since: continue
+            if not artifact.is_local: continue
+            paths.add(artifact.path)
+            if not artifact.digest: continue
+            for encoding, size in (artifact.variants or dict()).items():
+                if not size or not encoding in VARIANTS: continue
+                paths.add(cls.variant_path(artifact.digest, encoding))
+        for path in sorted(paths): yield path
+
+    @classmethod
+    def expand(cls, zip_path, empty = True, workers = None):
+        cls._ensure_local()
+        repo_path = os.path.normpath(appier.conf("REPO_PATH", "repo"))
+        workers = workers or appier.conf(
+            "REPO_RESTORE_WORKERS",
+            multiprocessing.cpu_count(),
+            cast = int
+        )
+
+        # creates the staging directory as a sibling of the repository one
+        # so that the final rename operations occur in the same file system
+        # and are atomic, the live repository is never touched until then
+        base_path = os.path.dirname(os.path.abspath(repo_path))
+        if not os.path.exists(base_path): os.makedirs(base_path)
+        staging_path = tempfile.mkdtemp(prefix = ".staging-", dir = base_path)
+        if os.path.exists(repo_path): shutil.copymode(repo_path, staging_path)
+
+        try:
+            # verifies the entries of the archive and then extracts them in
+            # parallel into the staging directory, verifying their contents
+            entries = cls._entries(zip_path)
+            cls._extract(zip_path, entries, staging_path, workers)
+
+            # for a complete restore the staging directory replaces the live
+            # one, otherwise each file is atomically moved into the live one
+            if empty: cls._swap(staging_path, repo_path)
+            else: cls._merge(staging_path, entries, repo_path)
+        finally:
+            if os.path.exists(staging_path): shutil.rmtree(staging_path)
 
     @classmethod
     @appier.link(name = "Compress")
@@ -303,11 +1297,55 @@ class Artifact(appier_extras.admin.Base):
     )
     def expand_s(cls, file, empty):
         _file_name, _mime_type, data = file
-        _handle, path = tempfile.mkstemp()
-        file = open(path, "wb")
+        handle, path = tempfile.mkstemp()
+        file = os.fdopen(handle, "wb")
         try: file.write(data)
         finally: file.close()
-        cls.expand(path, empty = empty)
+        try: cls.expand(path, empty = empty)
+        finally: os.remove(path)
+
+    @classmethod
+    @appier.operation(name = "Migrate Blobs")
+    def migrate_blobs_s(cls):
+        # iterates over the complete set of locally stored artifacts that
+        # are not yet content addressed and stores their file as a blob,
+        # which deduplicates byte identical artifacts along the way
+        cls._ensure_local()
+        paths = set()
+        artifacts = cls.find(rules = False)
+        for artifact in artifacts:
+            if not artifact.is_local: continue
+            if artifact.path.startswith("blobs/"): continue
+            file = open(cls.full_path(artifact.path), "rb")
+            try: path, size, digest = cls.store_blob(file)
+            finally: file.close()
+            paths.add(artifact.path)
+            artifact.path = path
+            artifact.size = size
+            artifact.digest = digest
+            artifact.save()
+
+        # removes the legacy files only after every artifact has been
+        # migrated, as the same file may be shared by multiple artifacts
+        storage = cls.storage()
+        for path in paths:
+            if storage.exists(path): storage.remove(path)
+
+    @classmethod
+    @appier.operation(
+        name = "Collect Garbage",
+        parameters = (("Dry run", "dry", bool, True),)
+    )
+    def collect_s(cls, dry = True):
+        result = cls.collect(dry = dry)
+        appier.get_app().logger.info(
+            "Garbage collection examined %d files and %s %d (%d bytes)" % (
+                result["examined"],
+                "would remove" if dry else "removed",
+                result["removed"],
+                result["reclaimed"]
+            )
+        )
 
     @classmethod
     @appier.operation(
@@ -325,7 +1363,7 @@ class Artifact(appier_extras.admin.Base):
         return cls.publish(
             package,
             version,
-            data = file.read(),
+            data = file,
             type = type,
             content_type = file.mime,
             replace = replace
@@ -353,15 +1391,361 @@ class Artifact(appier_extras.admin.Base):
         )
 
     @classmethod
-    def _info(cls, name, version = None):
-        kwargs = dict()
-        if version: kwargs["version"] = version
-        artifact = Artifact.get(
-            package = name,
+    def _stages(cls, plan, stages = None, indexes = None):
+        stages = [] if stages == None else stages
+        indexes = [] if indexes == None else indexes
+        stages.append(plan.get("stage"))
+        if "indexName" in plan: indexes.append(plan["indexName"])
+        children = plan.get("inputStages", [])
+        if "inputStage" in plan: children = children + [plan["inputStage"]]
+        for child in children: cls._stages(child, stages = stages, indexes = indexes)
+        return stages, indexes
+
+    @classmethod
+    def _entries(cls, zip_path):
+        # retrieves the complete set of file entries of the archive making
+        # sure that none of them is able to escape the target directory
+        zip_file = zipfile.ZipFile(zip_path, mode = "r")
+        try: infos = zip_file.infolist()
+        finally: zip_file.close()
+        entries = []
+        for info in infos:
+            if info.filename.endswith("/"): continue
+            name = info.filename.replace("\\", "/")
+            parts = name.split("/")
+            is_valid = not name.startswith("/") and not ".." in parts and not ":" in parts[0]
+            if not is_valid: raise appier.OperationalError(
+                message = "Invalid entry '%s' in archive" % info.filename
+            )
+            entries.append((info.filename, name, info.file_size))
+        return entries
+
+    @classmethod
+    def _extract(cls, zip_path, entries, target_path, workers):
+        # distributes the entries among the workers balancing the amount
+        # of bytes to be extracted by each of them (largest first)
+        workers = max(1, min(workers, len(entries)))
+        buckets = [[] for _index in range(workers)]
+        sizes = [0] * workers
+        for entry in sorted(entries, key = lambda entry: entry[2], reverse = True):
+            index = sizes.index(min(sizes))
+            buckets[index].append(entry)
+            sizes[index] += entry[2]
+
+        # runs the extraction of each bucket in a separate thread, notice
+        # that decompression and I/O release the GIL so that the extraction
+        # effectively scales with the number of cores
+        if workers == 1: cls._extract_entries(zip_path, buckets[0], target_path); return
+        pool = multiprocessing.pool.ThreadPool(workers)
+        try: pool.map(
+            lambda bucket: cls._extract_entries(zip_path, bucket, target_path),
+            buckets
+        )
+        finally:
+            pool.close()
+            pool.join()
+
+    @classmethod
+    def _extract_entries(cls, zip_path, entries, target_path, chunk_size = CHUNK_SIZE):
+        # each of the workers uses its own zip file handle as these are
+        # not safe to be shared among threads, the CRC of each entry is
+        # verified by the zip file module while it's being read
+        zip_file = zipfile.ZipFile(zip_path, mode = "r")
+        try:
+            for filename, name, size in entries:
+                file_path = os.path.join(target_path, *name.split("/"))
+                cls._ensure_path(os.path.dirname(file_path))
+                hash = hashlib.sha256()
+                written = 0
+                source = zip_file.open(filename)
+                try:
+                    target = open(file_path, "wb")
+                    try:
+                        while True:
+                            chunk = source.read(chunk_size)
+                            if not chunk: break
+                            hash.update(chunk)
+                            written += len(chunk)
+                            target.write(chunk)
+                    finally:
+                        target.close()
+                finally:
+                    source.close()
+
+                # verifies the size of the extracted file and for the content
+                # addressed blobs also verifies the digest of the contents
+                appier.verify(
+                    written == size,
+                    message = "Size mismatch for entry '%s'" % name,
+                    exception = appier.OperationalError
+                )
+                if name.startswith("blobs/"): appier.verify(
+                    hash.hexdigest() == name.rsplit("/", 1)[-1],
+                    message = "Digest mismatch for entry '%s'" % name,
+                    exception = appier.OperationalError
+                )
+        finally:
+            zip_file.close()
+
+    @classmethod
+    def _swap(cls, source, target):
+        # moves the current directory away and the new one into its place,
+        # these are two rename operations so the window in which the target
+        # does not exist is minimal, the old contents are then removed
+        if not os.path.exists(target): os.rename(source, target); return
+        old_path = tempfile.mkdtemp(prefix = ".old-", dir = os.path.dirname(source))
+        os.rmdir(old_path)
+        os.rename(target, old_path)
+        os.rename(source, target)
+        shutil.rmtree(old_path)
+
+    @classmethod
+    def _merge(cls, source, entries, target):
+        for _filename, name, _size in entries:
+            parts = name.split("/")
+            file_path = os.path.join(target, *parts)
+            cls._ensure_path(os.path.dirname(file_path))
+            cls._replace(os.path.join(source, *parts), file_path)
+
+    @classmethod
+    def _ensure_path(cls, path):
+        if os.path.isdir(path): return
+        try: os.makedirs(path)
+        except OSError:
+            if not os.path.isdir(path): raise
+
+    @classmethod
+    def _sync_resolution(cls, cache, limit = 1000):
+        # in case the cache is not shared among the processes the entries of
+        # the packages changed by other processes are invalidated through the
+        # change feed, which is only checked once per sync interval unless a
+        # change stream is followed (no data source access when up to date)
+        feed = util.get_feed()
+        if cache.is_synced(feed.cursor, watching = feed.watching): return
+        cursor = change.Change.cursor()
+
+        # in case the changes since the last sync can not be determined (too
+        # many or pruned) every local entry is dropped, otherwise only the
+        # ones of the changed packages are invalidated
+        full = cache.cursor == None or cursor < cache.cursor
+        if not full and cursor > cache.cursor:
+            changes = change.Change.since(cache.cursor, limit = limit)
+            full = len(changes) == limit or bool(changes and changes[0]["id"] > cache.cursor + 1)
+            if not full:
+                for name in set(_change["package"] for _change in changes): cache.invalidate(name)
+        if full: cache.clear()
+        cache.synced(cursor)
+
+    @classmethod
+    def _resolve_many(cls, criteria):
+        # removes the duplicated criteria, so that each one of them is only
+        # resolved once, mapping the most recent artifact of each one by key
+        unique = dict((cls._criteria_key(value), value) for value in criteria)
+        if not unique: return dict()
+
+        # in case the data source is not MongoDB each of the criteria is
+        # resolved by its own query, sorted by timestamp
+        collection = cls._collection()
+        base = getattr(collection, "_base", None)
+        if not hasattr(base, "aggregate"):
+            models = dict()
+            for key, value in unique.items():
+                model = cls._latest(value)
+                if model: models[key] = model
+            return models
+
+        # otherwise the criteria are resolved using a single aggregation that
+        # (using the package and timestamp index) selects the artifacts of the
+        # packages from the most recent, with one facet per criteria, that
+        # picks its most recent artifact, the info is never transferred
+        keys = sorted(unique.keys())
+        names = sorted(set(value["package"] for value in unique.values()))
+        pipeline = [
+            {"$match" : dict(package = {"$in" : names})},
+            {"$sort" : dict(timestamp = -1)},
+            {"$project" : dict(_id = 0, info = 0)},
+            {
+                "$facet" : dict(
+                    (str(index), [{"$match" : unique[key]}, {"$limit" : 1}])
+                    for index, key in enumerate(keys)
+                )
+            }
+        ]
+        results = list(base.aggregate(pipeline, allowDiskUse = True))
+        result = results[0] if results else dict()
+        return dict(
+            (key, result[str(index)][0]) for index, key in enumerate(keys) if result.get(str(index))
+        )
+
+    @classmethod
+    def _latest(cls, criteria):
+        # retrieves the most recent artifact that matches the criteria, in
+        # case the data source is not MongoDB (no matching of the elements
+        # of arrays) the tag is matched against the artifacts that match the
+        # remaining criteria, from the most recent one
+        base = getattr(cls._collection(), "_base", None)
+        tag = criteria.get("tags", None)
+        if not tag or hasattr(base, "aggregate"): return cls.get(
             rules = False,
+            map = True,
             sort = [("timestamp", -1)],
-            **kwargs
+            raise_e = False,
+            **criteria
+        )
+        criteria = dict((name, value) for name, value in criteria.items() if not name == "tags")
+        models = cls.find(rules = False, map = True, sort = [("timestamp", -1)], **criteria)
+        for model in models:
+            if tag in (model.get("tags") or []): return model
+        return None
+
+    @classmethod
+    def _criteria_key(cls, criteria):
+        return (
+            criteria["package"],
+            criteria.get("version", None),
+            criteria.get("branch", None),
+            criteria.get("tags", None)
+        )
+
+    @classmethod
+    def _resolution_key(cls, version, branch, tag = None):
+        key = "%s:%s" % (version or "", branch or "")
+        if tag: key += ":" + tag
+        return key
+
+    @classmethod
+    def _bulk_write(cls, operations):
+        # in case the underlying collection is a MongoDB one the bulk write
+        # operation is used, requiring a single round trip for all of the
+        # artifacts, otherwise falls back to one write per artifact
+        collection = cls._collection()
+        base = getattr(collection, "_base", None)
+        if hasattr(base, "bulk_write"):
+            import pymongo
+            requests = []
+            for is_new, _artifact, model in operations:
+                if is_new: requests.append(pymongo.InsertOne(model)); continue
+                _model = dict(model)
+                del _model["_id"]
+                requests.append(pymongo.UpdateOne({"_id" : model["_id"]}, {"$set" : _model}))
+            base.bulk_write(requests, ordered = False)
+            return
+
+        for is_new, _artifact, model in operations:
+            if is_new: collection.insert(model); continue
+            _model = dict(model)
+            del _model["_id"]
+            collection.update({"_id" : model["_id"]}, {"$set" : _model})
+
+    @classmethod
+    def _release(cls, path, dry = False):
+        # removes the file at the provided path in case it's no longer
+        # referenced by any artifact, returning its size or an invalid
+        # value in case the file has been kept (or does not exist)
+        if cls.get(path = path, rules = False, map = True, raise_e = False): return None
+        storage = cls.storage()
+        try: size = storage.size(path)
+        except OSError: return None
+        if dry: return size
+        storage.remove(path)
+        return size
+
+    @classmethod
+    def _set_status(cls, artifact, status, stages, timestamp):
+        # updates only the processing fields of the artifact and only in case
+        # it has not been re-published since (different timestamp)
+        cls._collection().update(
+            dict(id = artifact.id, timestamp = timestamp),
+            {"$set" : dict(status = status, stages = stages)}
         )
+        artifact.status = status
+        artifact.stages = stages
+        util.get_resolution().invalidate(artifact.package_name)
+
+    @classmethod
+    def _format(cls, header):
+        for format in FORMATS:
+            _name, magic, offset, _content_type = format
+            if header[offset:offset + len(magic)] == magic: return format
+        return None
+
+    @classmethod
+    def _compressor(cls, encoding):
+        if encoding == "gzip": return zlib.compressobj(9, zlib.DEFLATED, 31)
+        if encoding == "zstd":
+            try: import zstandard
+            except ImportError: return None
+            return zstandard.ZstdCompressor(level = 19).compressobj()
+        return None
+
+    @classmethod
+    def _compress(cls, path, compressor, base_path):
+        handle, temp_path = tempfile.mkstemp(dir = base_path)
+        file = os.fdopen(handle, "wb")
+        size = 0
+        try:
+            for chunk in cls.read_g(path):
+                data = compressor.compress(chunk)
+                file.write(data)
+                size += len(data)
+            data = compressor.flush()
+            file.write(data)
+            size += len(data)
+        except Exception:
+            file.close()
+            os.remove(temp_path)
+            raise
+        file.close()
+        return temp_path, size
+
+    @classmethod
+    def _ensure_local(cls):
+        appier.verify(
+            cls.storage().is_local,
+            message = "Operation only supported for local storage",
+            exception = appier.OperationalError
+        )
+
+    @classmethod
+    def _spool(cls, data, base_path, chunk_size = CHUNK_SIZE):
+        # the provided data may be either a buffer or a file like object
+        # in which case it is read in chunks, so that the memory used is
+        # bounded by the chunk size and not by the size of the artifact
+        is_bytes = appier.legacy.is_bytes(data)
+
+        # copies the contents into a temporary file computing both the
+        # size and the digest of the data along the way (single pass)
+        handle, temp_path = tempfile.mkstemp(dir = base_path)
+        file = os.fdopen(handle, "wb")
+        hash = hashlib.sha256()
+        size = 0
+        try:
+            try:
+                while True:
+                    chunk = data if is_bytes else data.read(chunk_size)
+                    if not chunk: break
+                    hash.update(chunk)
+                    size += len(chunk)
+                    file.write(chunk)
+                    if is_bytes: break
+            finally:
+                file.close()
+        except Exception:
+            if os.path.exists(temp_path): os.remove(temp_path)
+            raise
+
+        return temp_path, size, hash.hexdigest()
+
+    @classmethod
+    def _replace(cls, source, target):
+        if hasattr(os, "replace"): os.replace(source, target)
+        else:
+            if os.path.exists(target): os.remove(target)
+            os.rename(source, target)
+
+    @classmethod
+    def _info(cls, name, version = None, branch = None, tag = None):
+        artifact = cls.resolve(name = name, version = version, branch = branch, tag = tag)
         return artifact.info
 
     def pre_create(self):
@@ -375,11 +1759,19 @@ class Artifact(appier_extras.admin.Base):
 
     def post_save(self):
         appier_extras.admin.Base.post_save(self)
-        if self.is_master:
-            self.package.latest = self.version
-        if self.branch and not self.branch in self.package.branches:
-            self.package.branches.append(self.branch)
-        self.package.save()
+        util.get_resolution().invalidate(self.package_name)
+        util.get_catalog().invalidate(self.package_name)
+
+    def post_create(self):
+        appier_extras.admin.Base.post_create(self)
+        package.Package.track([(self, True, 0)])
+        change.Change.record_artifact("publish", self)
+
+    def post_delete(self):
+        appier_extras.admin.Base.post_delete(self)
+        util.get_resolution().invalidate(self.package_name)
+        package.Package.untrack(self)
+        change.Change.record_artifact("delete", self)
 
     @appier.link(name = "Retrieve")
     def retrieve_url(self, absolute = False):
@@ -407,6 +1799,7 @@ class Artifact(appier_extras.admin.Base):
     def sync_timestamp_s(self):
         self.timestamp = self.created
         self.save()
+        package.Package.summarize(names = [self.package_name])
 
     @appier.operation(
         name = "Set Branch",
@@ -415,6 +1808,7 @@ class Artifact(appier_extras.admin.Base):
     def set_branch_s(self, branch):
         self.branch = branch
         self.save()
+        package.Package.summarize(names = [self.package_name])
 
     @appier.operation(
         name = "Add Tag",
@@ -424,6 +1818,8 @@ class Artifact(appier_extras.admin.Base):
         if tag in self.tags: return
         self.tags.append(tag)
         self.save()
+        package.Package.summarize(names = [self.package_name])
+        change.Change.record_artifact("retag", self)
 
     @appier.operation(
         name = "Remove Tag",
@@ -433,6 +1829,21 @@ class Artifact(appier_extras.admin.Base):
         if not tag in self.tags: return
         self.tags.remove(tag)
         self.save()
+        package.Package.summarize(names = [self.package_name])
+        change.Change.record_artifact("retag", self)
+
+    @appier.operation(name = "Reprocess")
+    def reprocess_s(self):
+        cls = self.__class__
+        cls._set_status(self, "pending", dict(), self.timestamp)
+        cls.process(self)
+
+    @appier.operation(name = "Precompress")
+    def precompress_s(self):
+        cls = self.__class__
+        artifact = cls.get(id = self.id, rules = False)
+        encodings = cls.variants_encodings() or list(VARIANTS.keys())
+        cls.precompress(artifact, encodings = encodings)
 
     @appier.operation(
         name = "Timestampfix",
@@ -440,6 +1851,10 @@ class Artifact(appier_extras.admin.Base):
     def timestampfix_s(self):
         self.timestamp = int(self.timestamp)
         self.save()
+        package.Package.summarize(names = [self.package_name])
+
+    def remote_url(self, tag = None):
+        return self.url_tags[tag] if tag else self.url
 
     @property
     def file_name(self):
@@ -449,6 +1864,37 @@ class Artifact(appier_extras.admin.Base):
             self.package.type or "artifact"
         )
 
+    def sign(self, expires = None, file_name = None):
+        appier.verify(
+            self.is_local,
+            message = "Only stored artifacts may be signed",
+            exception = appier.OperationalError
+        )
+        return self.__class__.sign_p(
+            self.path,
+            file_name = file_name or self.file_name,
+            content_type = self.content_type,
+            expires = expires
+        )
+
+    @property
+    def etag(self):
+        return "\"%s-%d\"" % (self.digest or self.key, self.timestamp or 0)
+
+    def variant_etag(self, encoding):
+        return "\"%s-%d-%s\"" % (self.digest or self.key, self.timestamp or 0, encoding)
+
+    @property
+    def last_modified(self):
+        return email.utils.formatdate(self.timestamp or 0, usegmt = True)
+
+    @property
+    def package_name(self):
+        # uses the raw value of the reference whenever possible, avoiding
+        # a query to the data source just to obtain the package name
+        if hasattr(self.package, "ref_v"): return self.package.ref_v()
+        return self.package.name
+
     @property
     def is_local(self):
         return True if self.path else False
@@ -456,3 +1902,6 @@ class Artifact(appier_extras.admin.Base):
     @property
     def is_master(self):
         return self.branch == "master"
+
+util.register_stage("inspect", Artifact.stage_inspect)
+util.register_stage("variants", Artifact.stage_variants)
@@ -0,0 +1,142 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import time
+
+import appier
+import appier_extras
+
+from repos import util
+
+class Change(appier_extras.admin.Base):
+    """
+    Event of the change feed, recorded whenever an artifact is
+    published, retagged or deleted (or a package is deleted).
+
+    The (incremental) identifier of the change is the cursor used
+    by the clients to follow the feed from where they stopped.
+    """
+
+    kind = appier.field(
+        index = True,
+        observations = """The kind of change, one of publish, retag
+        and delete"""
+    )
+    """ The kind of the change, that may be either a publish, a
+    retag or a delete of an artifact (or package) """
+
+    package = appier.field(
+        index = True,
+        observations = """The name of the package that has been
+        changed"""
+    )
+    """ The name of the package of the changed artifact, or of the
+    deleted package """
+
+    version = appier.field(
+        observations = """The version of the changed artifact, not set
+        when every artifact of the package has been deleted"""
+    )
+    """ The version of the changed artifact, an unset value means
+    that the change applies to every artifact of the package """
+
+    branch = appier.field(
+        observations = """The branch of the changed artifact"""
+    )
+    """ The name of the branch of the changed artifact """
+
+    tags = appier.field(
+        type = list,
+        observations = """The tags of the artifact after the change"""
+    )
+    """ The sequence of tags of the artifact after the change, so
+    that the retags may be applied without extra requests """
+
+    timestamp = appier.field(
+        type = int,
+        index = "all",
+        safe = True,
+        observations = """The moment (as a timestamp) of the change"""
+    )
+    """ The timestamp of the change, used by the pruning of the
+    changes that are older than the retention period """
+
+    @classmethod
+    def validate(cls):
+        return super(Change, cls).validate() + [
+            appier.not_null("kind"),
+            appier.not_empty("kind"),
+
+            appier.not_null("package"),
+            appier.not_empty("package")
+        ]
+
+    @classmethod
+    def list_names(cls):
+        return ["id", "kind", "package", "version", "branch", "timestamp"]
+
+    @classmethod
+    def record(cls, kind, name, version = None, branch = None, tags = None):
+        # persists the change (so that it's shared by every process of the
+        # app) and then updates the cursor known by the current process
+        change = cls(
+            kind = kind,
+            package = name,
+            version = version,
+            branch = branch,
+            tags = tags or [],
+            timestamp = int(time.time())
+        )
+        change.save()
+        util.get_feed().notify(change.id)
+        return change
+
+    @classmethod
+    def record_artifact(cls, kind, artifact):
+        return cls.record(
+            kind,
+            artifact.package_name,
+            version = artifact.version,
+            branch = artifact.branch,
+            tags = artifact.tags
+        )
+
+    @classmethod
+    def since(cls, cursor, name = None, limit = 100):
+        # retrieves the changes after the cursor in order, in case the data
+        # source is not MongoDB (no support for operators) the cursor filter
+        # and the limit are applied after the retrieval
+        base = getattr(cls._collection(), "_base", None)
+        kwargs = dict()
+        if name: kwargs["package"] = name
+        if hasattr(base, "aggregate"): kwargs.update(id = {"$gt" : cursor}, limit = limit)
+        fields = ["id", "kind", "package", "version", "branch", "tags", "timestamp"]
+        changes = cls.find(map = True, fields = fields, sort = [("id", 1)], **kwargs)
+        return [
+            dict((field, change.get(field, None)) for field in fields)
+            for change in changes if change["id"] > cursor
+        ][:limit]
+
+    @classmethod
+    def cursor(cls):
+        change = cls.get(map = True, fields = ["id"], sort = [("id", -1)], raise_e = False)
+        return change["id"] if change else 0
+
+    @classmethod
+    def oldest(cls):
+        change = cls.get(map = True, fields = ["id"], sort = [("id", 1)], raise_e = False)
+        return change["id"] if change else 0
+
+    @classmethod
+    def prune(cls, retention = None):
+        # removes the changes older than the retention period, the clients
+        # with an older cursor are expected to do a full resynchronization
+        retention = retention or appier.conf("REPO_CHANGES_RETENTION", 604800, cast = int)
+        limit = int(time.time()) - retention
+        base = getattr(cls._collection(), "_base", None)
+        if hasattr(base, "delete_many"):
+            return base.delete_many(dict(timestamp = {"$lt" : limit})).deleted_count
+        changes = cls.find(map = True, fields = ["id", "timestamp"])
+        ids = [change["id"] for change in changes if change["timestamp"] < limit]
+        for id in ids: cls.get(id = id).delete()
+        return len(ids)
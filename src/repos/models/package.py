@@ -4,6 +4,8 @@
 import appier
 import appier_extras
 
+from repos import util
+
 class Package(appier_extras.admin.Base):
     """
     Top level entity that identifies a unique object
@@ -56,6 +58,36 @@ class Package(appier_extras.admin.Base):
     """ The list that contains the names of the complete set of branches
     associated with this package """
 
+    heads = appier.field(
+        type = dict,
+        safe = True
+    )
+    """ Map that associates each (escaped) branch name with the version
+    and timestamp of the latest artifact published for it """
+
+    version_count = appier.field(
+        type = int,
+        safe = True
+    )
+    """ The number of artifacts (versions) currently available for the
+    package, considering all of its branches """
+
+    total_size = appier.field(
+        type = int,
+        safe = True
+    )
+    """ The sum of the sizes (in bytes) of the files of the complete
+    set of artifacts of the package """
+
+    versions = appier.field(
+        type = list,
+        safe = True,
+        private = True
+    )
+    """ The index of the versions of the package sorted by their semantic
+    version (sort key), with the branch, tags and timestamp of each of
+    them, used to resolve version ranges without scanning the artifacts """
+
     @classmethod
     def validate(cls):
         return super(Package, cls).validate() + [
@@ -72,16 +104,376 @@ class Package(appier_extras.admin.Base):
     def list_names(cls):
         return ["name", "identifier", "type", "latest", "description"]
 
+    @classmethod
+    def track(cls, items):
+        # in case the data source is not able to run atomic updates the
+        # summaries of the affected packages are rebuilt instead
+        collection = cls._collection()
+        base = getattr(collection, "_base", None)
+        if not hasattr(base, "bulk_write"):
+            cls.summarize(names = set(artifact.package_name for artifact, _created, _previous in items))
+            return
+
+        # builds the atomic updates for each of the artifacts, where the
+        # head of the branch is only changed if the artifact is the most
+        # recent one, so that concurrent publishes do not overwrite it
+        import pymongo
+        requests = []
+        for artifact, created, previous in items:
+            name = artifact.package_name
+            update = {
+                "$inc" : dict(
+                    version_count = 1 if created else 0,
+                    total_size = (artifact.size or 0) - (previous or 0)
+                )
+            }
+            if artifact.branch: update["$addToSet"] = dict(branches = artifact.branch)
+            requests.append(pymongo.UpdateOne(dict(name = name), update))
+
+            # replaces the entry of the artifact in the version index, where
+            # the push keeps the index sorted by the semantic version
+            entry = cls._version_entry(artifact.version, artifact.branch, artifact.tags, artifact.timestamp)
+            if not created: requests.append(pymongo.UpdateOne(
+                dict(name = name),
+                {"$pull" : dict(versions = dict(version = artifact.version, branch = artifact.branch))}
+            ))
+            requests.append(pymongo.UpdateOne(
+                dict(name = name),
+                {
+                    "$push" : dict(
+                        versions = {
+                            "$each" : [entry],
+                            "$sort" : dict(key = 1, timestamp = 1)
+                        }
+                    )
+                }
+            ))
+            if not artifact.branch: continue
+            key = "heads." + cls._head_key(artifact.branch)
+            head = {key : dict(version = artifact.version, timestamp = artifact.timestamp)}
+            if artifact.is_master:
+                head.update(latest = artifact.version, latest_timestamp = artifact.timestamp)
+            requests.append(pymongo.UpdateOne(
+                {
+                    "name" : name,
+                    "$or" : [
+                        {key + ".timestamp" : {"$lte" : artifact.timestamp}},
+                        {key : None}
+                    ]
+                },
+                {"$set" : head}
+            ))
+        base.bulk_write(requests, ordered = True)
+
+    @classmethod
+    def untrack(cls, artifact):
+        name = artifact.package_name
+        collection = cls._collection()
+        base = getattr(collection, "_base", None)
+        if not hasattr(base, "bulk_write"):
+            cls.summarize(names = [name])
+            return
+
+        # decrements the counters of the package and, only if the artifact
+        # was the head of its branch, rebuilds the package summary
+        base.update_one(
+            dict(name = name),
+            {
+                "$inc" : dict(version_count = -1, total_size = -(artifact.size or 0)),
+                "$pull" : dict(versions = dict(version = artifact.version, branch = artifact.branch))
+            }
+        )
+        if not artifact.branch: return
+        _package = cls.get(name = name, map = True, fields = ["heads"], raise_e = False)
+        heads = _package and _package.get("heads") or dict()
+        head = heads.get(cls._head_key(artifact.branch), None) or dict()
+        if not head.get("version") == artifact.version: return
+        cls.summarize(names = [name])
+
+    @classmethod
+    def summarize(cls, names = None):
+        from . import artifact
+        collection = cls._collection()
+        base = getattr(collection, "_base", None)
+        artifacts = getattr(artifact.Artifact._collection(), "_base", None)
+        names = None if names == None else sorted(set(names))
+        empty = cls._summary([], 0, 0)
+
+        # in case the data source is not MongoDB the summaries are computed
+        # from a single scan of the artifacts, ordered by timestamp
+        if not hasattr(base, "bulk_write") or not hasattr(artifacts, "aggregate"):
+            summaries = cls._summaries(names)
+            if names == None: names = [_package["name"] for _package in cls.find(map = True, fields = ["name"])]
+            for name in names:
+                summary = summaries.get(name, empty)
+                collection.update(dict(name = name), {"$set" : summary})
+            return len(summaries)
+
+        # computes the summaries of the packages using a single aggregation
+        # pipeline, that (using the package, branch and timestamp index)
+        # groups the artifacts first by branch and then by package
+        pipeline = [
+            {"$sort" : dict(package = 1, branch = 1, timestamp = -1)},
+            {
+                "$group" : {
+                    "_id" : dict(package = "$package", branch = "$branch"),
+                    "version" : {"$first" : "$version"},
+                    "timestamp" : {"$first" : "$timestamp"},
+                    "first" : {"$min" : "$timestamp"},
+                    "count" : {"$sum" : 1},
+                    "size" : {"$sum" : {"$ifNull" : ["$size", 0]}},
+                    "versions" : {
+                        "$push" : dict(
+                            version = "$version",
+                            tags = "$tags",
+                            timestamp = "$timestamp"
+                        )
+                    }
+                }
+            },
+            {
+                "$group" : {
+                    "_id" : "$_id.package",
+                    "heads" : {
+                        "$push" : dict(
+                            branch = "$_id.branch",
+                            version = "$version",
+                            timestamp = "$timestamp",
+                            first = "$first",
+                            versions = "$versions"
+                        )
+                    },
+                    "count" : {"$sum" : "$count"},
+                    "size" : {"$sum" : "$size"}
+                }
+            }
+        ]
+        if not names == None: pipeline.insert(0, {"$match" : dict(package = {"$in" : names})})
+        results = artifacts.aggregate(pipeline, allowDiskUse = True)
+
+        # writes the complete set of summaries in a single bulk operation,
+        # resetting the summaries of the packages without artifacts
+        import pymongo
+        requests = []
+        found = []
+        for result in results:
+            summary = cls._summary(result["heads"], result["count"], result["size"])
+            requests.append(pymongo.UpdateOne(dict(name = result["_id"]), {"$set" : summary}))
+            found.append(result["_id"])
+        if names == None: requests.append(pymongo.UpdateMany(dict(name = {"$nin" : found}), {"$set" : empty}))
+        else: requests.extend(
+            pymongo.UpdateOne(dict(name = name), {"$set" : empty}) for name in names if not name in found
+        )
+        base.bulk_write(requests, ordered = False)
+        return len(found)
+
+    @classmethod
+    @appier.operation(name = "Repair Summaries")
+    def summarize_s(cls):
+        count = cls.summarize()
+        appier.get_app().logger.info("Repaired the summaries of %d packages" % count)
+
+    @classmethod
+    def _summaries(cls, names):
+        from . import artifact
+        fields = ["package", "branch", "version", "timestamp", "size", "tags"]
+        kwargs = dict(rules = False, map = True, fill = False, fields = fields, sort = [("timestamp", 1)])
+        if names == None: artifacts = artifact.Artifact.find(**kwargs)
+        else: artifacts = [
+            _artifact for name in names for _artifact in artifact.Artifact.find(package = name, **kwargs)
+        ]
+        groups = dict()
+        for _artifact in artifacts:
+            name = _artifact["package"]
+            heads, count, size = groups.get(name, None) or (dict(), 0, 0)
+            branch = _artifact.get("branch")
+            head = heads.get(branch, None) or dict(
+                branch = branch,
+                first = _artifact.get("timestamp"),
+                versions = []
+            )
+            head.update(version = _artifact.get("version"), timestamp = _artifact.get("timestamp"))
+            head["versions"].append(dict(
+                version = _artifact.get("version"),
+                tags = _artifact.get("tags"),
+                timestamp = _artifact.get("timestamp")
+            ))
+            heads[branch] = head
+            groups[name] = (heads, count + 1, size + (_artifact.get("size") or 0))
+        return dict(
+            (name, cls._summary(list(heads.values()), count, size))
+            for name, (heads, count, size) in groups.items()
+        )
+
+    @classmethod
+    def _summary(cls, heads, count, size):
+        versions = [
+            cls._version_entry(value.get("version"), head.get("branch"), value.get("tags"), value.get("timestamp"))
+            for head in heads for value in head.get("versions", None) or []
+        ]
+        versions.sort(key = lambda entry: (entry["key"] or "", entry["timestamp"] or 0))
+        heads = [head for head in heads if head.get("branch")]
+        heads.sort(key = lambda head: head.get("first") or 0)
+        master = [head for head in heads if head["branch"] == "master"]
+        master = master[0] if master else dict()
+        return dict(
+            branches = [head["branch"] for head in heads],
+            heads = dict(
+                (
+                    cls._head_key(head["branch"]),
+                    dict(version = head["version"], timestamp = head["timestamp"])
+                ) for head in heads
+            ),
+            latest = master.get("version"),
+            latest_timestamp = master.get("timestamp"),
+            version_count = count,
+            total_size = size,
+            versions = versions
+        )
+
+    @classmethod
+    def resolve_range(cls, name, spec, branch = None, tag = None):
+        # walks the version index of the package (sorted by semantic version)
+        # from the highest version down, returning the first that satisfies
+        # the range and that matches the (optional) branch and tag
+        _package = cls.get(
+            name = name,
+            rules = False,
+            map = True,
+            fill = False,
+            fields = ["versions"],
+            raise_e = False
+        )
+        appier.verify(
+            _package,
+            message = "Package '%s' not found" % name,
+            exception = appier.NotFoundError
+        )
+        versions = _package.get("versions", None)
+        if versions == None: versions = cls._versions(name)
+        return cls._match_range(name, versions, spec, branch = branch, tag = tag)
+
+    @classmethod
+    def version_indexes(cls, names):
+        # retrieves the type and the version index of the complete set of
+        # packages in a single query, mapping each of them by its name, in
+        # case the data source is not MongoDB one query per package is used
+        names = sorted(set(names))
+        base = getattr(cls._collection(), "_base", None)
+        kwargs = dict(rules = False, map = True, fill = False, fields = ["name", "type", "versions"])
+        if hasattr(base, "aggregate"): packages = cls.find(name = {"$in" : names}, **kwargs)
+        else: packages = [_package for name in names for _package in cls.find(name = name, **kwargs)]
+        packages = dict((_package["name"], _package) for _package in packages)
+        for name, _package in packages.items():
+            if _package.get("versions", None) == None: _package["versions"] = cls._versions(name)
+        return packages
+
+    @classmethod
+    def catalog(cls, skip = 0, limit = 0, fields = None):
+        # serves the snapshot of the package list with no data source access
+        # while it's known to be fresh, otherwise the snapshot is refreshed
+        # (incrementally) before the requested variant is rendered
+        catalog = util.get_catalog()
+        feed = util.get_feed()
+        if not catalog.is_fresh(feed.cursor, watching = feed.watching): cls._refresh_catalog(catalog)
+        return catalog.document(skip = skip, limit = limit, fields = fields)
+
+    @classmethod
+    def _refresh_catalog(cls, catalog, limit = 1000):
+        from . import change
+
+        # determines the packages changed since the cursor of the snapshot,
+        # either locally or in the changes feed, in case the changes can not
+        # be determined (too many or pruned) the snapshot is fully rebuilt
+        cursor = change.Change.cursor()
+        names = catalog.dirty()
+        full = catalog.cursor == None or cursor < catalog.cursor
+        if not full and cursor > catalog.cursor:
+            changes = change.Change.since(catalog.cursor, limit = limit)
+            full = len(changes) == limit or bool(changes and changes[0]["id"] > catalog.cursor + 1)
+            names.update(_change["package"] for _change in changes)
+        if full:
+            catalog.load(cls.find(map = True), cursor)
+            return
+        if not names:
+            catalog.check(cursor)
+            return
+
+        # reloads only the changed packages, the ones that no longer exist
+        # are removed from the snapshot
+        names = sorted(names)
+        base = getattr(cls._collection(), "_base", None)
+        if hasattr(base, "aggregate"): packages = cls.find(name = {"$in" : names}, map = True)
+        else: packages = [_package for name in names for _package in cls.find(name = name, map = True)]
+        catalog.update(names, packages, cursor)
+
+    @classmethod
+    def _match_range(cls, name, versions, spec, branch = None, tag = None):
+        # an exact version (eg: 1.0~rc1) takes precedence over the range, as
+        # non semantic versions may contain the characters of a range, so the
+        # value is only parsed as a range when there's no such version
+        for entry in versions:
+            if not entry.get("version") == spec: continue
+            if branch and not entry.get("branch") == branch: continue
+            if tag and not tag in (entry.get("tags") or []): continue
+            return spec
+
+        range = util.Range(spec)
+        for entry in reversed(versions):
+            if branch and not entry.get("branch") == branch: continue
+            if tag and not tag in (entry.get("tags") or []): continue
+            if not entry.get("key"): continue
+            if not range.match(entry["version"]): continue
+            return entry["version"]
+        raise appier.NotFoundError(
+            message = "No version of '%s' satisfies '%s'" % (name, spec)
+        )
+
+    @classmethod
+    def _versions(cls, name):
+        # builds the version index of the package from its artifacts, used
+        # for the packages whose summary has not been rebuilt with the index
+        return cls._summaries([name]).get(name, dict()).get("versions", [])
+
+    @classmethod
+    def _version_entry(cls, version, branch, tags, timestamp):
+        return dict(
+            key = util.sort_key(version),
+            version = version,
+            branch = branch,
+            tags = tags or [],
+            timestamp = timestamp
+        )
+
+    @classmethod
+    def _head_key(cls, branch):
+        # escapes the characters that are not allowed (or have a special
+        # meaning) in the keys of a document, so that the branch name may
+        # be used directly as a key of the heads map
+        branch = branch.replace(".", u"\uff0e")
+        if branch.startswith("$"): branch = u"\uff04" + branch[1:]
+        return branch
+
     def pre_save(self):
         appier_extras.admin.Base.pre_save(self)
+        if not getattr(self, "heads", None): self.heads = dict()
         latest_artifact = self.latest_artifact
         if latest_artifact: self.latest_timestamp = latest_artifact.timestamp
 
+    def post_save(self):
+        appier_extras.admin.Base.post_save(self)
+        util.get_catalog().invalidate(self.name)
+
     def pre_delete(self):
         appier_extras.admin.Base.pre_delete(self)
+        util.get_resolution().invalidate(self.name)
+        util.get_catalog().invalidate(self.name)
         from . import artifact
-        artifacts = artifact.Artifact.find(package = self.name, limit = -1)
-        for artifact in artifacts: artifact.delete()
+        artifact.Artifact.delete_bulk(self.name)
+
+    def post_delete(self):
+        appier_extras.admin.Base.post_delete(self)
+        util.get_catalog().invalidate(self.name)
 
     @appier.link(name = "Retrieve")
     def retrieve_url(self, absolute = False):
@@ -93,13 +485,13 @@ class Package(appier_extras.admin.Base):
 
     @appier.operation(name = "Set Branches")
     def set_branches_s(self):
-        branches = []
-        for artifact in self.artifacts:
-            if not artifact.branch: continue
-            if artifact.branch in branches: continue
-            branches.append(artifact.branch)
-        self.branches = branches
-        self.save()
+        self.summarize(names = [self.name])
+
+    @appier.operation(name = "Delete Artifacts")
+    def delete_artifacts_s(self):
+        from . import artifact
+        artifact.Artifact.delete_bulk(self.name)
+        self.summarize(names = [self.name])
 
     @appier.operation(
         name = "Upload Artifact",
@@ -112,13 +504,11 @@ class Package(appier_extras.admin.Base):
     )
     def upload_artifact_s(self, version, branch = "master", file = None):
         from . import artifact
-        if file: data = file.read()
-        else: data = None
         artifact = artifact.Artifact.publish(
             self.name,
             version,
             branch = branch,
-            data = data,
+            data = file,
         )
         return artifact
 
@@ -144,6 +534,11 @@ class Package(appier_extras.admin.Base):
             raise_e = False
         )
 
+    def head(self, branch = "master"):
+        heads = self.heads or dict()
+        head = heads.get(self._head_key(branch), None)
+        return head["version"] if head else None
+
     @property
     def latest_artifact(self):
         from . import artifact
@@ -0,0 +1,249 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import time
+import fnmatch
+
+import appier
+import appier_extras
+
+from repos import util
+
+from . import change
+from . import package
+from . import artifact
+
+class Policy(appier_extras.admin.Base):
+    """
+    Retention rule that bounds the number and the age of the
+    artifacts kept for a package and/or branch, each artifact
+    is governed by the most specific enabled policy.
+    """
+
+    name = appier.field(
+        index = True,
+        default = True,
+        observations = """The human readable name of the policy"""
+    )
+    """ The human readable name of the policy, used to identify
+    it in the reports """
+
+    package = appier.field(
+        index = True,
+        observations = """The name of the package the policy applies to,
+        if not set the policy applies to every package"""
+    )
+    """ The name of the package to which the policy is applied,
+    an unset value applies the policy to every package """
+
+    branch = appier.field(
+        index = True,
+        observations = """The branch (or pattern, eg: feature/*) the policy
+        applies to, if not set the policy applies to every branch"""
+    )
+    """ The name of the branch, or a shell like pattern, for which
+    the policy is applied, an unset value matches every branch """
+
+    keep_last = appier.field(
+        type = int,
+        observations = """The number of most recent artifacts of each
+        branch that are always kept"""
+    )
+    """ The maximum number of artifacts kept for each branch, the
+    most recent ones are the ones kept """
+
+    keep_tags = appier.field(
+        type = list,
+        observations = """The artifacts containing any of these tags
+        (eg: stable) are never removed by the policy"""
+    )
+    """ The list of tags that protect the artifacts that contain
+    them from being removed by the policy """
+
+    max_age = appier.field(
+        type = int,
+        observations = """The age (in days) after which the artifacts
+        are removed"""
+    )
+    """ The maximum age in days of the artifacts, older ones are
+    removed unless protected by one of the tags """
+
+    @classmethod
+    def validate(cls):
+        return super(Policy, cls).validate() + [
+            appier.not_null("name"),
+            appier.not_empty("name"),
+
+            appier.gte("keep_last", 0),
+            appier.gte("max_age", 0)
+        ]
+
+    @classmethod
+    def list_names(cls):
+        return ["name", "package", "branch", "keep_last", "max_age", "enabled"]
+
+    @classmethod
+    def prune(cls, dry = False, batch = None, pause = None):
+        batch = batch or appier.conf("REPO_RETENTION_BATCH", 100, cast = int)
+        pause = appier.conf("REPO_RETENTION_PAUSE", 0.1, cast = float) if pause == None else pause
+
+        # retrieves the complete set of enabled policies and the packages
+        # they apply to, the packages are only filtered in case every
+        # policy is bound to a specific package
+        policies = cls.find_e(sort = [("id", 1)])
+        reports = dict((policy.id, policy._report()) for policy in policies)
+        if not policies: return cls._result(dry, reports, policies)
+        names = [policy.package for policy in policies]
+        if all(names): packages = [
+            package.Package.get(name = name, map = True, fields = ["name", "latest"], raise_e = False)
+            for name in sorted(set(names))
+        ]
+        else: packages = package.Package.find(map = True, fields = ["name", "latest"])
+
+        # iterates over each of the packages determining the artifacts that
+        # are expired and removing them in batches, the files are released
+        # only after the artifacts that reference them are removed
+        pruned = []
+        for _package in packages:
+            if not _package: continue
+            artifacts = artifact.Artifact.find(
+                package = _package["name"],
+                rules = False,
+                map = True,
+                fill = False,
+                fields = ["id", "branch", "version", "timestamp", "tags", "size", "path"],
+                sort = [("timestamp", -1), ("id", -1)]
+            )
+            expired = cls._expired(policies, _package, artifacts)
+            if not expired: continue
+
+            # updates the report of each policy with the expired artifacts,
+            # where the size only considers the files not shared with the
+            # artifacts that are going to be kept
+            kept = set(_artifact.get("path") for _artifact in artifacts)
+            kept -= set(_artifact.get("path") for _policy, _artifact in expired)
+            released = set()
+            for policy, _artifact in expired:
+                report = reports[policy.id]
+                path = _artifact.get("path")
+                report["count"] += 1
+                report["artifacts"].append(dict(
+                    package = _package["name"],
+                    version = _artifact.get("version"),
+                    branch = _artifact.get("branch"),
+                    timestamp = _artifact.get("timestamp"),
+                    size = _artifact.get("size")
+                ))
+                if not path or path in kept or path in released: continue
+                report["size"] += _artifact.get("size") or 0
+                released.add(path)
+            if dry: continue
+
+            for index in range(0, len(expired), batch):
+                _expired = [_artifact for _policy, _artifact in expired[index:index + batch]]
+                artifact.Artifact.delete_ids([_artifact["id"] for _artifact in _expired])
+                for _artifact in _expired: change.Change.record(
+                    "delete",
+                    _package["name"],
+                    version = _artifact.get("version"),
+                    branch = _artifact.get("branch"),
+                    tags = _artifact.get("tags")
+                )
+                for path in set(_artifact.get("path") for _artifact in _expired):
+                    if path: artifact.Artifact._release(path)
+                if pause: time.sleep(pause)
+            util.get_resolution().invalidate(_package["name"])
+            pruned.append(_package["name"])
+
+        # rebuilds the summaries of the pruned packages at once, as their
+        # branch heads and counters may have been changed
+        if pruned: package.Package.summarize(names = pruned)
+        return cls._result(dry, reports, policies)
+
+    @classmethod
+    @appier.operation(name = "Dry Run")
+    def dry_run_s(cls):
+        result = cls.prune(dry = True)
+        cls._log(result)
+
+    @classmethod
+    @appier.operation(name = "Apply Retention")
+    def prune_s(cls):
+        result = cls.prune()
+        cls._log(result)
+
+    @classmethod
+    def _expired(cls, policies, _package, artifacts):
+        # iterates over the artifacts (most recent first) determining the
+        # policy that governs each branch and checking the artifact against
+        # its limits, the latest artifact of the package is never expired
+        limit = time.time()
+        governing = dict()
+        indexes = dict()
+        expired = []
+        for _artifact in artifacts:
+            branch = _artifact.get("branch")
+            if not branch in governing:
+                governing[branch] = cls._governing(policies, _package["name"], branch)
+            policy = governing[branch]
+            index = indexes.get(branch, 0)
+            indexes[branch] = index + 1
+            if not policy: continue
+            if branch == "master" and _artifact.get("version") == _package.get("latest"): continue
+            tags = _artifact.get("tags") or []
+            if any(tag in tags for tag in policy.keep_tags or []): continue
+            is_last = not policy.keep_last == None and index >= policy.keep_last
+            is_age = not policy.max_age == None and\
+                (_artifact.get("timestamp") or 0) < limit - policy.max_age * 86400
+            if not is_last and not is_age: continue
+            expired.append((policy, _artifact))
+        return expired
+
+    @classmethod
+    def _governing(cls, policies, name, branch):
+        # selects the most specific of the policies that match the package
+        # and branch, a policy for the package is more specific than one
+        # for the branch and an exact branch more specific than a pattern
+        candidates = []
+        for index, policy in enumerate(policies):
+            if policy.package and not policy.package == name: continue
+            if policy.branch and not fnmatch.fnmatchcase(branch or "", policy.branch): continue
+            is_exact = bool(policy.branch) and policy.branch == branch
+            specificity = (bool(policy.package), is_exact, bool(policy.branch))
+            candidates.append((specificity, -index, policy))
+        if not candidates: return None
+        candidates.sort(key = lambda candidate: candidate[:2])
+        return candidates[-1][2]
+
+    @classmethod
+    def _result(cls, dry, reports, policies):
+        reports = [reports[policy.id] for policy in policies]
+        return dict(
+            dry = dry,
+            count = sum(report["count"] for report in reports),
+            size = sum(report["size"] for report in reports),
+            policies = reports
+        )
+
+    @classmethod
+    def _log(cls, result):
+        logger = appier.get_app().logger
+        for report in result["policies"]:
+            logger.info(
+                "Policy '%s' %s %d artifacts (%d bytes)" % (
+                    report["name"],
+                    "would remove" if result["dry"] else "removed",
+                    report["count"],
+                    report["size"]
+                )
+            )
+
+    def _report(self):
+        return dict(
+            name = self.name,
+            package = self.package,
+            branch = self.branch,
+            count = 0,
+            size = 0,
+            artifacts = []
+        )
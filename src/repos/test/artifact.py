@@ -0,0 +1,398 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import gzip
+import time
+import shutil
+import tempfile
+import unittest
+
+import appier
+
+import repos
+
+class ArtifactTest(unittest.TestCase):
+
+    def setUp(self):
+        self.repo_path = tempfile.mkdtemp()
+        appier.conf_s("REPO_PATH", self.repo_path)
+        appier.conf_s("REPO_SIGN_SECRET", "secret")
+        self.app = repos.ReposApp()
+        repos.get_resolution().clear()
+
+    def tearDown(self):
+        self.app.unload()
+        adapter = appier.get_adapter()
+        adapter.drop_db()
+        shutil.rmtree(self.repo_path, ignore_errors = True)
+
+    def test_retrieve(self):
+        repos.Artifact.publish("package", "1.0.0", data = b"hello world")
+
+        response = self.app.get("/packages/package")
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.data, b"hello world")
+        self.assertEqual(response.headers["Accept-Ranges"], "bytes")
+
+        contents, file_name, _content_type = repos.Artifact.retrieve(name = "package")
+        self.assertEqual(b"".join(contents), b"hello world")
+        self.assertEqual(file_name, "package-1.0.0.package")
+
+    def test_range(self):
+        repos.Artifact.publish("package", "1.0.0", data = b"hello world")
+
+        response = self.app.get("/packages/package", headers = [("Range", "bytes=0-4")])
+        self.assertEqual(response.code, 206)
+        self.assertEqual(response.data, b"hello")
+        self.assertEqual(response.headers["Content-Range"], "bytes 0-4/11")
+
+        response = self.app.get("/packages/package", headers = [("Range", "bytes=-5")])
+        self.assertEqual(response.code, 206)
+        self.assertEqual(response.data, b"world")
+
+        response = self.app.get("/packages/package", headers = [("Range", "bytes=20-")])
+        self.assertEqual(response.code, 416)
+        self.assertEqual(response.headers["Content-Range"], "bytes */11")
+
+    def test_if_range(self):
+        repos.Artifact.publish("package", "1.0.0", data = b"hello world")
+        etag = self.app.get("/packages/package").headers["Etag"]
+
+        response = self.app.get(
+            "/packages/package",
+            headers = [("Range", "bytes=6-"), ("If_Range", etag)]
+        )
+        self.assertEqual(response.code, 206)
+        self.assertEqual(response.data, b"world")
+
+        response = self.app.get(
+            "/packages/package",
+            headers = [("Range", "bytes=6-"), ("If_Range", "\"invalid\"")]
+        )
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.data, b"hello world")
+
+    def test_dedupe(self):
+        appier.conf_s("REPO_CAS", True)
+        try:
+            first = repos.Artifact.publish("package", "1.0.0", data = b"hello world")
+            second = repos.Artifact.publish("other", "1.0.0", data = b"hello world")
+            third = repos.Artifact.publish("package", "1.1.0", digest = first.digest)
+        finally:
+            appier.conf_s("REPO_CAS", False)
+
+        self.assertEqual(first.path.startswith("blobs/"), True)
+        self.assertEqual(second.path, first.path)
+        self.assertEqual(third.path, first.path)
+        self.assertEqual(third.size, 11)
+
+        blobs_path = os.path.join(self.repo_path, "blobs")
+        files = [name for _path, _names, names in os.walk(blobs_path) for name in names]
+        self.assertEqual(files, [first.digest])
+        self.assertEqual(self.app.get("/packages/other").data, b"hello world")
+
+    def test_not_modified(self):
+        repos.Artifact.publish("package", "1.0.0", data = b"hello world")
+        response = self.app.get("/packages/package")
+        etag = response.headers["Etag"]
+        last_modified = response.headers["Last-Modified"]
+
+        response = self.app.get("/packages/package", headers = [("If_None_Match", etag)])
+        self.assertEqual(response.code, 304)
+        self.assertEqual(response.data, b"")
+
+        response = self.app.get("/packages/package", headers = [("If_None_Match", "W/" + etag)])
+        self.assertEqual(response.code, 304)
+
+        response = self.app.get("/packages/package", headers = [("If_None_Match", "\"invalid\"")])
+        self.assertEqual(response.code, 200)
+
+        response = self.app.get(
+            "/packages/package",
+            headers = [("If_Modified_Since", last_modified)]
+        )
+        self.assertEqual(response.code, 304)
+
+    def test_artifacts_fields(self):
+        info = dict(name = "package", size = 11, details = dict(author = "author"))
+        repos.Artifact.publish("package", "1.0.0", info = info, data = b"hello world")
+
+        response = self.app.get("/packages/package/artifacts")
+        artifacts = json.loads(response.data)
+        self.assertEqual(len(artifacts), 1)
+        self.assertEqual(artifacts[0]["version"], "1.0.0")
+        self.assertEqual(artifacts[0].get("info", {}), {})
+
+        response = self.app.get("/packages/package/artifacts", query = "expand_info=size")
+        artifacts = json.loads(response.data)
+        self.assertEqual(artifacts[0]["version"], "1.0.0")
+        self.assertEqual(artifacts[0]["info"], dict(size = 11))
+
+        response = self.app.get("/packages/package/artifacts", query = "fields=version,info.details")
+        artifacts = json.loads(response.data)
+        self.assertEqual(artifacts[0]["version"], "1.0.0")
+        self.assertEqual(artifacts[0]["info"], dict(details = dict(author = "author")))
+        self.assertEqual("branch" in artifacts[0], False)
+
+    def test_publish_bulk(self):
+        repos.Artifact.publish("package", "1.0.0", data = b"previous")
+
+        artifacts = repos.Artifact.publish_bulk([
+            dict(name = "package", version = "1.0.0", data = b"1.0.0"),
+            dict(name = "package", version = "1.1.0", data = b"1.1.0", tags = ["stable"]),
+            dict(name = "other", version = "2.0.0", data = b"2.0.0")
+        ], workers = 2)
+
+        self.assertEqual([artifact.version for artifact in artifacts], ["1.0.0", "1.1.0", "2.0.0"])
+        self.assertEqual(all(artifact.id for artifact in artifacts), True)
+        self.assertEqual(len(repos.Artifact.find(package = "package")), 2)
+        self.assertEqual(repos.Package.get(name = "other").name, "other")
+
+        contents, _file_name, _content_type = repos.Artifact.retrieve(name = "package", version = "1.0.0")
+        self.assertEqual(b"".join(contents), b"1.0.0")
+        contents, _file_name, _content_type = repos.Artifact.retrieve(name = "other")
+        self.assertEqual(b"".join(contents), b"2.0.0")
+
+        self.assertRaises(
+            appier.OperationalError,
+            lambda: repos.Artifact.publish_bulk([
+                dict(name = "package", version = "1.2.0", data = b"1.2.0"),
+                dict(name = "package", version = "1.2.0", data = b"1.2.0")
+            ])
+        )
+        self.assertRaises(
+            appier.OperationalError,
+            lambda: repos.Artifact.publish_bulk(
+                [dict(name = "package", version = "1.1.0", data = b"1.1.0")],
+                replace = False
+            )
+        )
+        self.assertEqual(repos.Artifact.get(version = "1.2.0", raise_e = False), None)
+
+    def test_collect(self):
+        repos.Artifact.publish("package", "1.0.0", data = b"hello world")
+        orphan_path = os.path.join(self.repo_path, "orphan", "file")
+        os.makedirs(os.path.dirname(orphan_path))
+        with open(orphan_path, "wb") as file: file.write(b"orphan")
+
+        result = repos.Artifact.collect(grace = 0, pause = 0, dry = True)
+        self.assertEqual(result["dry"], True)
+        self.assertEqual(result["removed"], 1)
+        self.assertEqual(result["reclaimed"], 6)
+        self.assertEqual(os.path.exists(orphan_path), True)
+
+        result = repos.Artifact.collect(grace = 0, pause = 0)
+        self.assertEqual(result["removed"], 1)
+        self.assertEqual(os.path.exists(orphan_path), False)
+        self.assertEqual(self.app.get("/packages/package").data, b"hello world")
+
+    def test_delete_bulk(self):
+        repos.Artifact.publish("package", "1.0.0", data = b"1.0.0")
+        repos.Artifact.publish("package", "1.1.0", data = b"1.1.0")
+        repos.Artifact.publish("other", "1.0.0", data = b"other")
+
+        repos.Artifact.delete_bulk("package")
+        self.assertEqual(len(repos.Artifact.find(package = "package")), 0)
+        self.assertEqual(len(repos.Artifact.find(package = "other")), 1)
+        self.assertEqual(self.app.get("/packages/package").code, 404)
+
+        result = repos.Artifact.collect(grace = 0, pause = 0)
+        self.assertEqual(result["removed"], 2)
+        self.assertEqual(os.path.exists(os.path.join(self.repo_path, "package", "1.0.0")), False)
+        self.assertEqual(self.app.get("/packages/other").data, b"other")
+
+    def test_delta(self):
+        try: import bsdiff4
+        except ImportError: self.skipTest("bsdiff4 not available")
+
+        source = b"".join(appier.legacy.bytes(str(index)) for index in range(4096))
+        target = source.replace(b"1234", b"4321")
+        repos.Artifact.publish("package", "1.0.0", data = source)
+        repos.Artifact.publish("package", "1.1.0", data = target)
+
+        response = self.app.get("/packages/package/delta", query = "from=1.0.0&to=1.1.0")
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers["X-Delta"], "bsdiff4")
+        self.assertEqual(response.headers["X-Delta-From"], "1.0.0")
+        self.assertEqual(response.headers["X-Delta-To"], "1.1.0")
+        self.assertEqual(len(response.data) < len(target), True)
+        self.assertEqual(bsdiff4.patch(source, response.data), target)
+
+    def test_delta_full(self):
+        repos.Artifact.publish("package", "1.0.0", data = b"1.0.0")
+        repos.Artifact.publish("package", "1.1.0", data = b"1.1.0")
+
+        response = self.app.get("/packages/package/delta", query = "from=1.0.0&to=1.1.0")
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers["X-Delta"], "full")
+        self.assertEqual(response.data, b"1.1.0")
+
+    def test_variants(self):
+        data = b"hello world " * 100
+        artifact = repos.Artifact.publish("package", "1.0.0", data = data)
+        variants = repos.Artifact.precompress(artifact, encodings = ["gzip"])
+        self.assertEqual(variants["gzip"] < len(data), True)
+
+        response = self.app.get("/packages/package", headers = [("Accept_Encoding", "gzip")])
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(response.headers["Vary"], "Accept-Encoding")
+        self.assertEqual(gzip.decompress(response.data), data)
+        etag = response.headers["Etag"]
+
+        response = self.app.get("/packages/package")
+        self.assertEqual(response.headers.get("Content-Encoding", None), None)
+        self.assertEqual(response.data, data)
+        self.assertNotEqual(response.headers["Etag"], etag)
+
+        variant_path = os.path.join(self.repo_path, repos.Artifact.variant_path(artifact.digest, "gzip"))
+        os.remove(variant_path)
+
+        response = self.app.get(
+            "/packages/package",
+            headers = [("Accept_Encoding", "gzip"), ("If_None_Match", etag)]
+        )
+        self.assertEqual(response.code, 304)
+
+        response = self.app.get("/packages/package", headers = [("Accept_Encoding", "gzip")])
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers.get("Content-Encoding", None), None)
+        self.assertEqual(response.data, data)
+
+    def test_signature(self):
+        signed = repos.Artifact.sign_p("package/1.0.0", file_name = "package.zip")
+        self.assertEqual(signed["expires"] <= time.time() + 3600, True)
+
+        repos.Artifact.verify_p(
+            signed["path"],
+            signed["expires"],
+            signed["signature"],
+            file_name = "package.zip"
+        )
+
+        self.assertRaises(
+            appier.SecurityError,
+            lambda: repos.Artifact.verify_p(
+                "package/2.0.0",
+                signed["expires"],
+                signed["signature"],
+                file_name = "package.zip"
+            )
+        )
+        self.assertRaises(
+            appier.SecurityError,
+            lambda: repos.Artifact.verify_p(
+                signed["path"],
+                signed["expires"] + 3600,
+                signed["signature"],
+                file_name = "package.zip"
+            )
+        )
+        self.assertRaises(
+            appier.SecurityError,
+            lambda: repos.Artifact.verify_p(
+                signed["path"],
+                signed["expires"],
+                signed["signature"],
+                file_name = "other.zip"
+            )
+        )
+        self.assertRaises(
+            appier.SecurityError,
+            lambda: repos.Artifact.verify_p(
+                signed["path"],
+                signed["expires"],
+                signed["signature"][:-1] + "0",
+                file_name = "package.zip"
+            )
+        )
+
+    def test_signature_expired(self):
+        expires = int(time.time()) - 1
+        signature = repos.Artifact.signature("package/1.0.0", expires)
+
+        self.assertRaises(
+            appier.SecurityError,
+            lambda: repos.Artifact.verify_p("package/1.0.0", expires, signature)
+        )
+
+    def test_download(self):
+        artifact = repos.Artifact.publish("package", "1.0.0", data = b"hello world")
+        signed = artifact.sign()
+        query = "expires=%d&signature=%s&file_name=%s" % (
+            signed["expires"],
+            signed["signature"],
+            signed["file_name"]
+        )
+
+        response = self.app.get("/downloads/" + signed["path"], query = query)
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.data, b"hello world")
+
+        response = self.app.get("/downloads/" + signed["path"], query = query.replace("file_name=", "file_name=x"))
+        self.assertEqual(response.code, 403)
+
+    def test_resolve_bulk(self):
+        repos.Artifact.publish("package", "1.0.0", data = b"1.0.0")
+        repos.Artifact.publish("package", "1.1.0", data = b"1.1.0")
+        repos.Artifact.publish("package", "2.0.0", data = b"2.0.0")
+        repos.Artifact.get(version = "1.0.0").add_tag_s("stable")
+
+        results = repos.Artifact.resolve_bulk([
+            dict(name = "package", version = "^1.0"),
+            dict(name = "package", version = "2.0.0"),
+            dict(name = "package", tagged = "stable"),
+            dict(name = "package", version = "^3.0"),
+            dict(name = "package", version = "^1.x.y"),
+            dict(name = "unknown")
+        ])
+
+        self.assertEqual(results[0]["artifact"].version, "1.1.0")
+        self.assertEqual(results[1]["artifact"].version, "2.0.0")
+        self.assertEqual(results[2]["artifact"].version, "1.0.0")
+        self.assertEqual(results[3]["error"].code, 404)
+        self.assertEqual(results[4]["error"].code, 400)
+        self.assertEqual(results[5]["error"].code, 404)
+
+    def test_resolve_route(self):
+        repos.Artifact.publish("package", "1.0.0", data = b"1.0.0")
+        repos.Artifact.publish("package", "1.1.0", data = b"1.1.0")
+
+        data = json.dumps(dict(packages = ["package@^1.0", dict(name = "unknown")], urls = "none"))
+        response = self.app.post(
+            "/packages/resolve",
+            data = appier.legacy.bytes(data),
+            headers = [("Content_Type", "application/json")]
+        )
+        result = json.loads(response.data)
+        self.assertEqual(response.code, 200)
+        self.assertEqual(result["resolved"], 1)
+        self.assertEqual(result["failed"], 1)
+        self.assertEqual(result["packages"][0]["version"], "1.1.0")
+        self.assertEqual(result["packages"][1]["code"], 404)
+
+        for packages in ("package", [1], [dict(name = "package", version = 1)]):
+            data = json.dumps(dict(packages = packages))
+            response = self.app.post(
+                "/packages/resolve",
+                data = appier.legacy.bytes(data),
+                headers = [("Content_Type", "application/json")]
+            )
+            self.assertEqual(response.code, 400)
+
+    def test_tagged(self):
+        repos.Artifact.publish("package", "1.0.0", tags = ["stable"], data = b"1.0.0")
+        repos.Artifact.publish("package", "1.1.0", tags = ["beta"], data = b"1.1.0")
+
+        response = self.app.get("/packages/package", query = "tagged=stable")
+        self.assertEqual(response.data, b"1.0.0")
+
+        repos.Artifact.get(version = "1.1.0").add_tag_s("stable")
+        repos.Artifact.get(version = "1.0.0").remove_tag_s("stable")
+        response = self.app.get("/packages/package", query = "tagged=stable")
+        self.assertEqual(response.data, b"1.1.0")
+
+        response = self.app.get("/packages/package", query = "tagged=unknown")
+        self.assertEqual(response.code, 404)
@@ -0,0 +1,100 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import zipfile
+import tempfile
+import unittest
+
+import appier
+
+import repos
+
+class BackupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.repo_path = tempfile.mkdtemp()
+        appier.conf_s("REPO_PATH", self.repo_path)
+        self.app = repos.ReposApp()
+        repos.get_resolution().clear()
+
+    def tearDown(self):
+        self.app.unload()
+        adapter = appier.get_adapter()
+        adapter.drop_db()
+        shutil.rmtree(self.repo_path, ignore_errors = True)
+
+    def test_compress(self):
+        repos.Artifact.publish("package", "1.0.0", data = b"1.0.0")
+        repos.Artifact.publish("package", "1.1.0", data = b"1.1.0")
+
+        zip_path = repos.Artifact.compress()
+        try:
+            with zipfile.ZipFile(zip_path) as zip_file:
+                self.assertEqual(sorted(zip_file.namelist()), ["package/1.0.0", "package/1.1.0"])
+                self.assertEqual(zip_file.read("package/1.1.0"), b"1.1.0")
+        finally:
+            os.remove(zip_path)
+
+    def test_compress_since(self):
+        artifact = repos.Artifact.publish("package", "1.0.0", data = b"1.0.0")
+        artifact.timestamp -= 60
+        artifact.save()
+        repos.Artifact.publish("package", "1.1.0", data = b"1.1.0")
+
+        paths = list(repos.Artifact.backup_paths(since = artifact.timestamp + 30))
+        self.assertEqual(paths, ["package/1.1.0"])
+
+        paths = list(repos.Artifact.backup_paths(since = artifact.timestamp))
+        self.assertEqual(paths, ["package/1.0.0", "package/1.1.0"])
+
+        zip_path = repos.Artifact.compress(since = artifact.timestamp + 30)
+        try:
+            with zipfile.ZipFile(zip_path) as zip_file:
+                self.assertEqual(zip_file.namelist(), ["package/1.1.0"])
+        finally:
+            os.remove(zip_path)
+
+    def test_expand(self):
+        repos.Artifact.publish("package", "1.0.0", data = b"1.0.0")
+        zip_path = repos.Artifact.compress()
+        try:
+            repos.Artifact.publish("package", "1.1.0", data = b"1.1.0")
+            repos.Artifact.expand(zip_path, workers = 2)
+        finally:
+            os.remove(zip_path)
+
+        self.assertEqual(os.listdir(os.path.join(self.repo_path, "package")), ["1.0.0"])
+        with open(os.path.join(self.repo_path, "package", "1.0.0"), "rb") as file:
+            self.assertEqual(file.read(), b"1.0.0")
+
+    def test_expand_merge(self):
+        repos.Artifact.publish("package", "1.0.0", data = b"1.0.0")
+        zip_path = repos.Artifact.compress()
+        try:
+            repos.Artifact.publish("package", "1.1.0", data = b"1.1.0")
+            repos.Artifact.expand(zip_path, empty = False, workers = 2)
+        finally:
+            os.remove(zip_path)
+
+        self.assertEqual(sorted(os.listdir(os.path.join(self.repo_path, "package"))), ["1.0.0", "1.1.0"])
+
+    def test_expand_invalid(self):
+        handle, zip_path = tempfile.mkstemp()
+        os.close(handle)
+        try:
+            with zipfile.ZipFile(zip_path, "w") as zip_file:
+                zip_file.writestr("package/1.0.0", b"1.0.0")
+                zip_file.writestr("../escape", b"escape")
+            self.assertRaises(appier.OperationalError, lambda: repos.Artifact.expand(zip_path))
+        finally:
+            os.remove(zip_path)
+
+        parent_path = os.path.dirname(self.repo_path)
+        self.assertEqual(os.path.exists(os.path.join(parent_path, "escape")), False)
+        self.assertEqual(os.path.exists(os.path.join(self.repo_path, "package")), False)
+        self.assertEqual(
+            [name for name in os.listdir(parent_path) if name.startswith(".staging-")],
+            []
+        )
@@ -0,0 +1,78 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import time
+import shutil
+import tempfile
+import unittest
+
+import appier
+
+import repos
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.repo_path = tempfile.mkdtemp()
+        appier.conf_s("REPO_PATH", self.repo_path)
+        self.app = repos.ReposApp()
+        repos.util.cache.resolution = None
+        repos.util.feed.feed = None
+
+    def tearDown(self):
+        self.app.unload()
+        adapter = appier.get_adapter()
+        adapter.drop_db()
+        shutil.rmtree(self.repo_path, ignore_errors = True)
+
+    def test_resolve(self):
+        cache = repos.get_resolution()
+        artifact = repos.Artifact.publish("package", "1.0.0", data = b"1.0.0")
+        artifact.timestamp -= 60
+        artifact.save()
+
+        hits, misses = cache.hits, cache.misses
+        self.assertEqual(repos.Artifact.resolve(name = "package").version, "1.0.0")
+        self.assertEqual(cache.misses, misses + 1)
+        self.assertEqual(repos.Artifact.resolve(name = "package").version, "1.0.0")
+        self.assertEqual(cache.hits, hits + 1)
+
+        invalidations = cache.invalidations
+        repos.Artifact.publish("package", "1.1.0", data = b"1.1.0")
+        self.assertEqual(cache.invalidations > invalidations, True)
+        self.assertEqual(repos.Artifact.resolve(name = "package").version, "1.1.0")
+
+    def test_sync(self):
+        cache = repos.get_resolution()
+        repos.Artifact.publish("package", "1.0.0", data = b"1.0.0")
+        repos.Artifact.resolve(name = "package")
+
+        key = repos.Artifact._resolution_key(None, None)
+        stale = dict(cache.get("package", key), version = "0.1.0")
+        cache.set("package", key, stale)
+        self.assertEqual(repos.Artifact.resolve(name = "package").version, "0.1.0")
+
+        repos.Change.record("publish", "package", version = "1.1.0")
+        self.assertEqual(repos.Artifact.resolve(name = "package").version, "1.0.0")
+
+    def test_lru(self):
+        cache = repos.util.ResolutionCache(size = 2, ttl = 60.0)
+        cache.set("a", "key", dict(value = 1))
+        cache.set("b", "key", dict(value = 2))
+        cache.get("a", "key")
+        cache.set("c", "key", dict(value = 3))
+
+        self.assertEqual(cache.get("a", "key"), dict(value = 1))
+        self.assertEqual(cache.get("b", "key"), None)
+        self.assertEqual(cache.get("c", "key"), dict(value = 3))
+
+        cache.invalidate("a")
+        self.assertEqual(cache.get("a", "key"), None)
+
+    def test_expire(self):
+        cache = repos.util.ResolutionCache(ttl = 0.01)
+        cache.set("a", "key", dict(value = 1))
+        time.sleep(0.02)
+
+        self.assertEqual(cache.get("a", "key"), None)
+        self.assertEqual(cache.stats()["size"], 0)
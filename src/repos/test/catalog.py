@@ -0,0 +1,67 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import gzip
+import json
+import shutil
+import tempfile
+import unittest
+
+import appier
+
+import repos
+
+class CatalogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.repo_path = tempfile.mkdtemp()
+        appier.conf_s("REPO_PATH", self.repo_path)
+        self.app = repos.ReposApp()
+        repos.util.catalog.catalog = None
+        repos.util.feed.feed = None
+
+    def tearDown(self):
+        self.app.unload()
+        adapter = appier.get_adapter()
+        adapter.drop_db()
+        shutil.rmtree(self.repo_path, ignore_errors = True)
+
+    def test_list(self):
+        repos.Artifact.publish("package", "1.0.0", data = b"1.0.0")
+        repos.Artifact.publish("other", "1.0.0", data = b"1.0.0")
+
+        response = self.app.get("/packages")
+        packages = json.loads(response.data)
+        self.assertEqual(response.code, 200)
+        self.assertEqual(sorted(_package["name"] for _package in packages), ["other", "package"])
+        etag = response.headers["Etag"]
+
+        response = self.app.get("/packages", headers = [("If_None_Match", etag)])
+        self.assertEqual(response.code, 304)
+
+        repos.Artifact.publish("third", "1.0.0", data = b"1.0.0")
+        response = self.app.get("/packages", headers = [("If_None_Match", etag)])
+        packages = json.loads(response.data)
+        self.assertEqual(response.code, 200)
+        self.assertEqual(len(packages), 3)
+        self.assertNotEqual(response.headers["Etag"], etag)
+
+    def test_list_gzip(self):
+        repos.Artifact.publish("package", "1.0.0", data = b"1.0.0")
+
+        data = self.app.get("/packages").data
+        response = self.app.get("/packages", headers = [("Accept_Encoding", "gzip")])
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(response.data), data)
+
+    def test_list_fields(self):
+        repos.Artifact.publish("package", "1.0.0", data = b"1.0.0")
+        repos.Artifact.publish("other", "1.0.0", data = b"1.0.0")
+
+        response = self.app.get("/packages", query = "fields=name&fields=type&limit=1")
+        packages = json.loads(response.data)
+        self.assertEqual(packages, [dict(name = "package", type = "package")])
+
+        response = self.app.get("/packages", query = "fields=name&fields=type&skip=1")
+        packages = json.loads(response.data)
+        self.assertEqual(packages, [dict(name = "other", type = "package")])
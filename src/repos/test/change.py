@@ -0,0 +1,107 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import json
+import time
+import shutil
+import tempfile
+import unittest
+import threading
+
+import appier
+
+import repos
+
+class ChangeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.repo_path = tempfile.mkdtemp()
+        appier.conf_s("REPO_PATH", self.repo_path)
+        self.app = repos.ReposApp()
+        repos.util.cache.resolution = None
+        repos.util.feed.feed = None
+
+    def tearDown(self):
+        self.app.unload()
+        adapter = appier.get_adapter()
+        adapter.drop_db()
+        shutil.rmtree(self.repo_path, ignore_errors = True)
+
+    def test_changes(self):
+        repos.Artifact.publish("package", "1.0.0", data = b"1.0.0")
+        repos.Artifact.publish("other", "1.0.0", data = b"1.0.0")
+
+        response = self.app.get("/changes", query = "since=0")
+        result = json.loads(response.data)
+        self.assertEqual(response.code, 200)
+        self.assertEqual([change["package"] for change in result["changes"]], ["package", "other"])
+        self.assertEqual(result["changes"][0]["kind"], "publish")
+        self.assertEqual(result["cursor"], 2)
+        self.assertEqual(result["reset"], False)
+
+        response = self.app.get("/changes", query = "since=0&name=other")
+        result = json.loads(response.data)
+        self.assertEqual([change["id"] for change in result["changes"]], [2])
+
+        response = self.app.get("/changes", query = "since=2")
+        result = json.loads(response.data)
+        self.assertEqual(result["changes"], [])
+        self.assertEqual(result["cursor"], 2)
+        self.assertEqual(response.headers["Retry-After"], str(result["retry"]))
+
+    def test_changes_reset(self):
+        repos.Artifact.publish("package", "1.0.0", data = b"1.0.0")
+        repos.Artifact.publish("package", "1.1.0", data = b"1.1.0")
+        repos.Artifact.publish("package", "1.2.0", data = b"1.2.0")
+        repos.Change.get(id = 1).delete()
+
+        result = json.loads(self.app.get("/changes", query = "since=0").data)
+        self.assertEqual(result["reset"], True)
+        self.assertEqual([change["id"] for change in result["changes"]], [2, 3])
+
+        result = json.loads(self.app.get("/changes", query = "since=1").data)
+        self.assertEqual(result["reset"], False)
+
+    def test_changes_wait(self):
+        repos.Artifact.publish("package", "1.0.0", data = b"1.0.0")
+
+        # the waiting request is made by another thread, while the change is
+        # published holding the request lock, as a (concurrent) request would
+        responses = []
+        thread = threading.Thread(
+            target = lambda: responses.append(self.app.get("/changes", query = "since=1&wait=10"))
+        )
+        thread.start()
+        try:
+            time.sleep(0.2)
+            with appier.base.REQUEST_LOCK:
+                repos.Artifact.publish("package", "1.1.0", data = b"1.1.0")
+        finally:
+            thread.join()
+        response = responses[0]
+        result = json.loads(response.data)
+        self.assertEqual(response.headers["Content-Type"], "application/json")
+        self.assertEqual([change["version"] for change in result["changes"]], ["1.1.0"])
+        self.assertEqual(result["cursor"], 2)
+
+        start = time.time()
+        result = json.loads(self.app.get("/changes", query = "since=2&wait=0.1").data)
+        self.assertEqual(result["changes"], [])
+        self.assertEqual(result["cursor"], 2)
+        self.assertEqual(time.time() - start >= 0.1, True)
+
+    def test_changes_stream(self):
+        repos.Artifact.publish("package", "1.0.0", data = b"1.0.0")
+        repos.Artifact.publish("package", "1.1.0", data = b"1.1.0")
+
+        appier.conf_s("REPO_CHANGES_STREAM", 0)
+        try:
+            response = self.app.get(
+                "/changes",
+                headers = [("Accept", "text/event-stream"), ("Last_Event_Id", "1")]
+            )
+        finally:
+            appier.conf_s("REPO_CHANGES_STREAM", 300)
+        self.assertEqual(response.headers["Content-Type"], "text/event-stream")
+        self.assertEqual(response.data.startswith(b"retry: 1000\n\nid: 2\nevent: publish\n"), True)
+        self.assertEqual(b"id: 1\n" in response.data, False)
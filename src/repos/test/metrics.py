@@ -0,0 +1,94 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import repos
+
+class MetricsTest(unittest.TestCase):
+
+    def test_build(self):
+        metrics = MockMetrics.build()
+
+        self.assertEqual(metrics.enabled, True)
+        self.assertEqual(metrics.listened, True)
+
+    def test_listener(self):
+        try: import pymongo.monitoring
+        except ImportError: self.skipTest("pymongo not available")
+
+        metrics = repos.Metrics()
+        listener = repos.util.metrics.CommandListener(metrics)
+        listener.started(MockEvent("find"))
+        listener.started(MockEvent("find"))
+        listener.started(MockEvent("insert"))
+
+        self.assertEqual(isinstance(listener, pymongo.monitoring.CommandListener), True)
+        self.assertEqual(metrics.commands, 3)
+        self.assertEqual(
+            "repos_mongo_commands_total{command=\"find\"} 2" in metrics.render(),
+            True
+        )
+
+    def test_render(self):
+        metrics = repos.Metrics()
+        metrics.inc("repos_requests_total", route = "package.retrieve", method = "GET", code = "200")
+        metrics.observe("repos_request_duration_seconds", 0.02, route = "package.retrieve")
+        metrics.observe("repos_request_duration_seconds", 2.0, route = "package.retrieve")
+        result = metrics.render()
+
+        self.assertEqual("# TYPE repos_requests_total counter" in result, True)
+        self.assertEqual(
+            "repos_requests_total{code=\"200\",method=\"GET\",route=\"package.retrieve\"} 1" in result,
+            True
+        )
+        self.assertEqual(
+            "repos_request_duration_seconds_bucket{route=\"package.retrieve\",le=\"0.025\"} 1" in result,
+            True
+        )
+        self.assertEqual(
+            "repos_request_duration_seconds_bucket{route=\"package.retrieve\",le=\"+Inf\"} 2" in result,
+            True
+        )
+        self.assertEqual(
+            "repos_request_duration_seconds_count{route=\"package.retrieve\"} 2" in result,
+            True
+        )
+
+    def test_request(self):
+        def handler(environ, start_response):
+            start_response("200 OK", [("Content-Type", "text/plain")])
+            return [b"hello"]
+
+        metrics = repos.Metrics()
+        environ = dict(REQUEST_METHOD = "POST", CONTENT_LENGTH = 11)
+        environ["repos.route"] = "package.publish"
+        result = metrics.request(handler, environ, lambda status, headers: None)
+        self.assertEqual(b"".join(result), b"hello")
+        result.close()
+        result = metrics.render()
+
+        self.assertEqual(
+            "repos_request_bytes_total{route=\"package.publish\"} 11" in result,
+            True
+        )
+        self.assertEqual(
+            "repos_response_bytes_total{route=\"package.publish\"} 5" in result,
+            True
+        )
+
+    def test_disabled(self):
+        metrics = repos.Metrics(enabled = False)
+        metrics.inc("repos_requests_total", route = "none")
+
+        self.assertEqual(metrics.render(), "\n")
+
+class MockMetrics(repos.Metrics):
+
+    def listen(self):
+        self.listened = True
+
+class MockEvent(object):
+
+    def __init__(self, command_name):
+        self.command_name = command_name
@@ -0,0 +1,50 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import shutil
+import tempfile
+import unittest
+
+import appier
+
+import repos
+
+class PackageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.repo_path = tempfile.mkdtemp()
+        appier.conf_s("REPO_PATH", self.repo_path)
+        self.app = repos.ReposApp()
+        repos.get_resolution().clear()
+
+    def tearDown(self):
+        self.app.unload()
+        adapter = appier.get_adapter()
+        adapter.drop_db()
+        shutil.rmtree(self.repo_path, ignore_errors = True)
+
+    def test_resolve_range(self):
+        repos.Artifact.publish("package", "1.0.0", data = b"1.0.0")
+        repos.Artifact.publish("package", "1.2.0", data = b"1.2.0")
+        repos.Artifact.publish("package", "2.0.0", data = b"2.0.0")
+        repos.Artifact.publish("package", "1.3.0", branch = "feature", data = b"1.3.0")
+
+        self.assertEqual(repos.Package.resolve_range("package", "^1.0"), "1.3.0")
+        self.assertEqual(repos.Package.resolve_range("package", "^1.0", branch = "master"), "1.2.0")
+        self.assertEqual(repos.Package.resolve_range("package", ">=1.0 <3"), "2.0.0")
+        self.assertEqual(repos.Artifact.resolve(name = "package", version = "~1.0").version, "1.0.0")
+        self.assertRaises(
+            appier.NotFoundError,
+            lambda: repos.Artifact.resolve(name = "package", version = "^3.0")
+        )
+
+    def test_resolve_exact(self):
+        repos.Artifact.publish("package", "1.0~rc1", data = b"1.0~rc1")
+        repos.Artifact.publish("package", "1.0.0", data = b"1.0.0")
+
+        self.assertEqual(repos.Package.resolve_range("package", "1.0~rc1"), "1.0~rc1")
+        self.assertEqual(repos.Artifact.resolve(name = "package", version = "1.0~rc1").version, "1.0~rc1")
+        self.assertEqual(repos.Artifact.resolve(name = "package", version = "~1.0").version, "1.0.0")
+
+        results = repos.Artifact.resolve_bulk([dict(name = "package", version = "1.0~rc1")])
+        self.assertEqual(results[0]["artifact"].version, "1.0~rc1")
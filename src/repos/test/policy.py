@@ -0,0 +1,66 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import shutil
+import tempfile
+import unittest
+
+import appier
+
+import repos
+
+class PolicyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.repo_path = tempfile.mkdtemp()
+        appier.conf_s("REPO_PATH", self.repo_path)
+        self.app = repos.ReposApp()
+        repos.get_resolution().clear()
+
+    def tearDown(self):
+        self.app.unload()
+        adapter = appier.get_adapter()
+        adapter.drop_db()
+        shutil.rmtree(self.repo_path, ignore_errors = True)
+
+    def test_prune_dry(self):
+        repos.Artifact.publish("package", "1.0.0", data = b"1.0.0")
+        repos.Artifact.publish("package", "1.1.0", data = b"1.1.0")
+        repos.Artifact.publish("package", "1.2.0", data = b"1.2.0")
+        repos.Artifact.publish("package", "1.3.0", data = b"1.3.0")
+        repos.Artifact.publish("package", "0.1.0", branch = "feature", data = b"0.1.0")
+        repos.Artifact.get(version = "1.0.0").add_tag_s("stable")
+
+        policy = repos.Policy(name = "default", package = "package", branch = "master", keep_last = 2)
+        policy.keep_tags = ["stable"]
+        policy.save()
+
+        result = repos.Policy.prune(dry = True, pause = 0)
+        self.assertEqual(result["dry"], True)
+        self.assertEqual(result["count"], 1)
+        self.assertEqual(result["size"], 5)
+        self.assertEqual(
+            [artifact["version"] for artifact in result["policies"][0]["artifacts"]],
+            ["1.1.0"]
+        )
+        self.assertEqual(len(repos.Artifact.find(package = "package")), 5)
+
+        result = repos.Policy.prune(pause = 0)
+        self.assertEqual(result["dry"], False)
+        self.assertEqual(result["count"], 1)
+        self.assertEqual(len(repos.Artifact.find(package = "package")), 4)
+        self.assertEqual(repos.Artifact.get(version = "1.1.0", raise_e = False), None)
+
+    def test_prune_age(self):
+        repos.Artifact.publish("package", "1.0.0", data = b"1.0.0")
+        repos.Artifact.publish("package", "1.1.0", data = b"1.1.0")
+        artifact = repos.Artifact.get(version = "1.0.0")
+        artifact.timestamp = artifact.timestamp - 10 * 86400
+        artifact.save()
+
+        repos.Policy(name = "age", max_age = 7).save()
+
+        result = repos.Policy.prune(dry = True, pause = 0)
+        self.assertEqual(result["count"], 1)
+        self.assertEqual(result["policies"][0]["artifacts"][0]["version"], "1.0.0")
+        self.assertEqual(len(repos.Artifact.find(package = "package")), 2)
@@ -0,0 +1,64 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import appier
+
+import repos
+
+class SemverTest(unittest.TestCase):
+
+    def test_is_range(self):
+        self.assertEqual(repos.util.is_range("1.2.3"), False)
+        self.assertEqual(repos.util.is_range("1.2.3-beta.1"), False)
+        self.assertEqual(repos.util.is_range("^1.2"), True)
+        self.assertEqual(repos.util.is_range("~2.0"), True)
+        self.assertEqual(repos.util.is_range(">=1.2 <2"), True)
+        self.assertEqual(repos.util.is_range("1.x"), True)
+        self.assertEqual(repos.util.is_range(None), False)
+
+    def test_match(self):
+        range = repos.util.Range("^1.4")
+        self.assertEqual(range.match("1.4.0"), True)
+        self.assertEqual(range.match("1.9.2"), True)
+        self.assertEqual(range.match("1.3.9"), False)
+        self.assertEqual(range.match("2.0.0"), False)
+
+        range = repos.util.Range("~2.0")
+        self.assertEqual(range.match("2.0.5"), True)
+        self.assertEqual(range.match("2.1.0"), False)
+
+        range = repos.util.Range(">=1.2 <2 || 3.x")
+        self.assertEqual(range.match("1.2.0"), True)
+        self.assertEqual(range.match("2.0.0"), False)
+        self.assertEqual(range.match("3.7.1"), True)
+
+        range = repos.util.Range("1.2 - 2.3")
+        self.assertEqual(range.match("2.3.0"), True)
+        self.assertEqual(range.match("2.4.0"), False)
+
+    def test_match_pre(self):
+        range = repos.util.Range("^1.2")
+        self.assertEqual(range.match("1.3.0-beta.1"), False)
+
+        range = repos.util.Range(">=1.3.0-beta.1")
+        self.assertEqual(range.match("1.3.0-beta.2"), True)
+        self.assertEqual(range.match("1.4.0-beta.1"), False)
+        self.assertEqual(range.match("1.4.0"), True)
+
+    def test_invalid(self):
+        with self.assertRaises(appier.OperationalError) as context:
+            repos.util.Range("^1.x.y")
+
+        self.assertEqual(context.exception.code, 400)
+
+    def test_sort_key(self):
+        versions = ["1.10.0", "1.2.0", "1.2.0-beta.10", "1.2.0-beta.2", "1.2.0-alpha", "0.9.1"]
+        result = sorted(versions, key = repos.util.sort_key)
+
+        self.assertEqual(
+            result,
+            ["0.9.1", "1.2.0-alpha", "1.2.0-beta.2", "1.2.0-beta.10", "1.2.0", "1.10.0"]
+        )
+        self.assertEqual(repos.util.sort_key("invalid"), None)
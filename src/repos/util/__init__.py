@@ -0,0 +1,20 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+from . import cache
+from . import catalog
+from . import feed
+from . import metrics
+from . import pipeline
+from . import semver
+from . import storage
+from . import stream
+
+from .cache import ResolutionCache, get_resolution
+from .catalog import Catalog, get_catalog
+from .feed import Feed, get_feed
+from .metrics import Metrics, MeteredStorage, get_metrics, route_name
+from .pipeline import Pipeline, register_stage, get_stage, get_pipeline
+from .semver import Range, sort_key, is_range
+from .storage import Storage, LocalStorage, S3Storage, get_storage
+from .stream import BufferStream
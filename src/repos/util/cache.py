@@ -0,0 +1,169 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import json
+import time
+import threading
+import collections
+
+import appier
+
+SIZE = 1024
+""" The default maximum number of entries that are kept in
+the in-process (local) layer of the resolution cache """
+
+TTL = 60.0
+""" The default time to live in seconds for each of the cache
+entries, a zero value disables the cache completely """
+
+SYNC = 1.0
+""" The default number of seconds between the checks of the change
+feed for changes of other processes, when the cache is not shared
+and no change stream is being followed """
+
+PREFIX = "repos:resolution:"
+""" The prefix to be used in the keys of the shared (redis)
+layer of the cache, avoiding collisions with other apps """
+
+class ResolutionCache(object):
+    """
+    Two layered cache for the resolution of artifacts, mapping
+    a (package, version, branch) like key to the serialized
+    artifact that is going to be returned for it.
+
+    The first layer is an in-process LRU with expiration and the
+    second (optional) one is shared among workers using redis,
+    invalidation is done per package by bumping a generation
+    counter that is part of every key.
+
+    With no shared layer the changes of the other processes are
+    only known through the change feed, so the local entries may
+    be served stale for up to the sync interval (or until the
+    change stream notifies the change, when followed).
+    """
+
+    def __init__(self, size = SIZE, ttl = TTL, sync = SYNC, redis = None, prefix = PREFIX):
+        self.size = size
+        self.ttl = ttl
+        self.sync = sync
+        self.redis = redis
+        self.prefix = prefix
+        self.cursor = None
+        self.checked = 0.0
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._items = collections.OrderedDict()
+        self._lock = threading.RLock()
+
+    @classmethod
+    def build(cls):
+        size = appier.conf("REPO_CACHE_SIZE", SIZE, cast = int)
+        ttl = appier.conf("REPO_CACHE_TTL", TTL, cast = float)
+        sync = appier.conf("REPO_CACHE_SYNC", SYNC, cast = float)
+        shared = appier.conf("REPO_CACHE_REDIS", False, cast = bool)
+        redis = appier.get_redis() if shared else None
+        return cls(size = size, ttl = ttl, sync = sync, redis = redis)
+
+    def get(self, name, key):
+        if not self.enabled: return None
+
+        # builds the complete key for the entry taking into account the
+        # current generation of the package, so that entries created before
+        # the last invalidation (in any worker) are never returned
+        generation = self._generation(name)
+        full_key = "%s:%d:%s" % (name, generation, key)
+
+        # tries to find the entry in the local layer, refreshing its
+        # position in the LRU structure in case it's still valid
+        with self._lock:
+            entry = self._items.get(full_key, None)
+            if entry and entry[0] > time.time():
+                self._items[full_key] = self._items.pop(full_key)
+                self.hits += 1
+                return json.loads(entry[1])
+            if entry: del self._items[full_key]
+
+        # falls back to the shared layer (if available) populating the
+        # local layer with the value in case it's found there
+        value = self.redis.get(self.prefix + full_key) if self.redis else None
+        if value:
+            value = appier.legacy.str(value) if appier.legacy.is_bytes(value) else value
+            self._set_local(full_key, value)
+            self.shared_hits += 1
+            return json.loads(value)
+
+        self.misses += 1
+        return None
+
+    def set(self, name, key, value):
+        if not self.enabled: return
+        generation = self._generation(name)
+        full_key = "%s:%d:%s" % (name, generation, key)
+        value = json.dumps(value, cls = appier.MongoEncoder)
+        self._set_local(full_key, value)
+        if self.redis: self.redis.setex(self.prefix + full_key, int(self.ttl) or 1, value)
+
+    def invalidate(self, name):
+        if not self.enabled: return
+        prefix = "%s:" % name
+        with self._lock:
+            for full_key in list(self._items.keys()):
+                if full_key.startswith(prefix): del self._items[full_key]
+        if self.redis: self.redis.incr(self.prefix + "generation:" + name)
+        self.invalidations += 1
+
+    def clear(self):
+        with self._lock: self._items.clear()
+
+    def is_synced(self, cursor, watching = False):
+        # the local entries are in sync with the change feed in case every
+        # known change has been applied and either the change stream is being
+        # followed or the feed has been checked within the sync interval
+        if not self.enabled or self.redis: return True
+        with self._lock:
+            if self.cursor == None or cursor > self.cursor: return False
+            return watching or time.time() - self.checked < self.sync
+
+    def synced(self, cursor):
+        with self._lock:
+            self.cursor = cursor
+            self.checked = time.time()
+
+    def stats(self):
+        return dict(
+            enabled = self.enabled,
+            shared = True if self.redis else False,
+            cursor = self.cursor,
+            size = len(self._items),
+            hits = self.hits,
+            shared_hits = self.shared_hits,
+            misses = self.misses,
+            invalidations = self.invalidations
+        )
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.size > 0
+
+    def _set_local(self, full_key, value):
+        with self._lock:
+            self._items.pop(full_key, None)
+            self._items[full_key] = (time.time() + self.ttl, value)
+            while len(self._items) > self.size: self._items.popitem(last = False)
+
+    def _generation(self, name):
+        if not self.redis: return 0
+        value = self.redis.get(self.prefix + "generation:" + name)
+        return int(value) if value else 0
+
+resolution = None
+""" The global resolution cache instance, lazily created from
+the current configuration on its first usage """
+
+def get_resolution():
+    global resolution
+    if resolution: return resolution
+    resolution = ResolutionCache.build()
+    return resolution
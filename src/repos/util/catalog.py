@@ -0,0 +1,130 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import json
+import time
+import zlib
+import hashlib
+import threading
+import collections
+
+import appier
+
+TTL = 5.0
+""" The default number of seconds during which the snapshot is served
+with no data source access, when the changes of other processes can
+not be followed by a change stream """
+
+VARIANTS = 16
+""" The default maximum number of rendered variants (pagination and
+sparse fieldsets) of the snapshot that are kept at the same time """
+
+class Catalog(object):
+    """
+    Materialized snapshot of the (unfiltered) list of packages kept
+    as the maps of the packages and rendered into JSON documents,
+    stored both as is and gzip compressed, with their entity tag.
+
+    The snapshot is updated incrementally (only the changed packages
+    are reloaded) and each variant is rendered once per update.
+    """
+
+    def __init__(self, ttl = TTL, variants = VARIANTS):
+        self.ttl = ttl
+        self.variants = variants
+        self.cursor = None
+        self.checked = 0.0
+        self.modified = 0
+        self._entries = dict()
+        self._dirty = set()
+        self._documents = collections.OrderedDict()
+        self._lock = threading.RLock()
+
+    @classmethod
+    def build(cls):
+        ttl = appier.conf("REPO_CATALOG_TTL", TTL, cast = float)
+        variants = appier.conf("REPO_CATALOG_VARIANTS", VARIANTS, cast = int)
+        return cls(ttl = ttl, variants = variants)
+
+    def is_fresh(self, cursor, watching = False):
+        # the snapshot is fresh in case it reflects every known change and
+        # there's no local invalidation, the changes of the other processes
+        # are only known immediately when a change stream is being followed
+        with self._lock:
+            if self.cursor == None or self._dirty: return False
+            if cursor > self.cursor: return False
+            return watching or time.time() - self.checked < self.ttl
+
+    def invalidate(self, name = None):
+        with self._lock:
+            if name: self._dirty.add(name)
+            else: self.cursor = None
+
+    def dirty(self):
+        with self._lock: return set(self._dirty)
+
+    def load(self, models, cursor):
+        with self._lock:
+            self._entries = dict((model["name"], model) for model in models)
+            self._dirty.clear()
+            self._touch(cursor)
+
+    def update(self, names, models, cursor):
+        with self._lock:
+            for name in names: self._entries.pop(name, None)
+            for model in models: self._entries[model["name"]] = model
+            self._dirty.difference_update(names)
+            self._touch(cursor)
+
+    def check(self, cursor):
+        with self._lock:
+            self.cursor = cursor
+            self.checked = time.time()
+
+    def document(self, skip = 0, limit = 0, fields = None):
+        # retrieves the (already) rendered variant of the snapshot, rendering
+        # it in case it does not exist, notice that the entries are sorted by
+        # identifier (creation order) as in the unsorted package list
+        key = (skip, limit, tuple(fields) if fields else None)
+        with self._lock:
+            document = self._documents.get(key, None)
+            if document: return document
+            entries = sorted(self._entries.values(), key = lambda entry: entry.get("id") or 0)
+            entries = entries[skip:skip + limit] if limit else entries[skip:]
+            if fields: entries = [
+                dict((field, entry[field]) for field in fields if field in entry) for entry in entries
+            ]
+            data = appier.legacy.bytes(json.dumps(entries), encoding = "utf-8")
+            compressor = zlib.compressobj(9, zlib.DEFLATED, 31)
+            data_gz = compressor.compress(data) + compressor.flush()
+            etag = "\"%s\"" % hashlib.sha1(data).hexdigest()
+            document = (data, data_gz, etag, self.modified)
+            self._documents[key] = document
+            while len(self._documents) > self.variants: self._documents.popitem(last = False)
+            return document
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                cursor = self.cursor,
+                packages = len(self._entries),
+                dirty = len(self._dirty),
+                variants = len(self._documents),
+                modified = self.modified
+            )
+
+    def _touch(self, cursor):
+        self._documents.clear()
+        self.cursor = cursor
+        self.checked = time.time()
+        self.modified = int(time.time())
+
+catalog = None
+""" The global catalog snapshot instance, lazily created from
+the current configuration on its first usage """
+
+def get_catalog():
+    global catalog
+    if catalog: return catalog
+    catalog = Catalog.build()
+    return catalog
@@ -0,0 +1,101 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+
+import appier
+
+POLL = 1.0
+""" The default interval (in seconds) between the checks of the data
+source for changes recorded by other processes, when no change stream
+is available, notice that a single check is shared by every waiter """
+
+class Feed(object):
+    """
+    Process wide notifier of the change feed, that keeps the most
+    recent known cursor, used to answer the clients (and to check
+    the freshness of the snapshots) with no data source access and
+    to wake up the (long-polling or streaming) clients.
+
+    The changes recorded by other processes are known through a
+    MongoDB change stream (when available), otherwise the waiting
+    clients rely on a poll that is shared by every waiter.
+    """
+
+    def __init__(self, poll = POLL):
+        self.poll = poll
+        self.cursor = 0
+        self.watching = False
+        self._refreshed = 0.0
+        self._lock = threading.Lock()
+        self._condition = threading.Condition()
+
+    @classmethod
+    def build(cls):
+        poll = appier.conf("REPO_CHANGES_POLL", POLL, cast = float)
+        return cls(poll = poll)
+
+    def notify(self, cursor):
+        with self._condition:
+            if cursor <= self.cursor: return
+            self.cursor = cursor
+            self._condition.notify_all()
+
+    def wait(self, cursor, timeout, latest):
+        # blocks until a change after the provided cursor is known or the
+        # timeout is reached, the latest callable returns the most recent
+        # cursor of the data source and is used in case there's no stream,
+        # must only be called out of the handling of a request (eg: in the
+        # body of a response) as otherwise every other request is stalled
+        deadline = time.time() + timeout
+        while True:
+            self.refresh(latest)
+            with self._condition:
+                if self.cursor > cursor: return True
+                remaining = deadline - time.time()
+                if remaining <= 0: return False
+                self._condition.wait(min(remaining, self.poll))
+
+    def refresh(self, latest):
+        # only one of the waiters of the process checks the data source per
+        # poll interval, the remaining ones are woken up by its notification
+        with self._lock:
+            if self.watching: return
+            if time.time() - self._refreshed < self.poll: return
+            self._refreshed = time.time()
+        self.notify(latest())
+
+    def watch(self, collection):
+        # starts following the MongoDB change stream of the changes collection
+        # in a background thread, so that the changes recorded by other processes
+        # are notified as soon as they are inserted (requires a replica set)
+        base = getattr(collection, "_base", None)
+        if not hasattr(base, "watch"): return False
+        thread = threading.Thread(target = self._watch, args = (base,))
+        thread.daemon = True
+        thread.start()
+        return True
+
+    def _watch(self, base):
+        try:
+            with base.watch([{"$match" : {"operationType" : "insert"}}]) as stream:
+                self.watching = True
+                for event in stream:
+                    self.notify(event["fullDocument"].get("id", 0))
+        except Exception as exception:
+            appier.get_app().logger.info(
+                "Change stream not available: %s" % appier.legacy.UNICODE(exception)
+            )
+        finally:
+            self.watching = False
+
+feed = None
+""" The global change feed notifier instance, lazily created from
+the current configuration on its first usage """
+
+def get_feed():
+    global feed
+    if feed: return feed
+    feed = Feed.build()
+    return feed
@@ -0,0 +1,334 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import bisect
+import threading
+
+import appier
+
+try: import pymongo.monitoring
+except ImportError: pymongo = None
+
+LISTENER = pymongo.monitoring.CommandListener if pymongo else object
+""" The base class of the MongoDB command listener, the driver only
+accepts listeners that inherit from its own listener classes """
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+""" The upper bounds (in seconds) of the buckets of the latency
+histograms, covering both metadata and large file requests """
+
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+""" The upper bounds of the buckets of the histograms that count
+operations per request (eg: MongoDB commands) """
+
+METRICS = dict(
+    repos_requests_total = ("counter", "Number of handled requests per route, method and status code"),
+    repos_requests_in_flight = ("gauge", "Number of requests currently being handled"),
+    repos_request_duration_seconds = ("histogram", "Time taken to handle (and stream) the response of each route"),
+    repos_request_bytes_total = ("counter", "Number of bytes received in the request bodies per route"),
+    repos_response_bytes_total = ("counter", "Number of bytes sent in the response bodies per route"),
+    repos_request_mongo_commands = ("histogram", "Number of MongoDB commands issued while handling each route"),
+    repos_mongo_commands_total = ("counter", "Number of MongoDB commands issued per command name"),
+    repos_storage_duration_seconds = ("histogram", "Time taken by the storage operations per backend and operation"),
+    repos_storage_errors_total = ("counter", "Number of failed storage operations per backend and operation"),
+    repos_storage_read_bytes_total = ("counter", "Number of bytes read from the storage per backend"),
+    repos_storage_written_bytes_total = ("counter", "Number of bytes written into the storage per backend")
+)
+""" The map associating the name of each of the exposed metrics
+with its (Prometheus) type and its description """
+
+class Metrics(object):
+    """
+    In-process registry of counters, gauges and histograms that is
+    rendered in the Prometheus text exposition format.
+
+    Every update is a dictionary operation under a single lock so
+    that the instrumentation is cheap enough to be always enabled,
+    values are kept per process (each worker exposes its own).
+    """
+
+    def __init__(self, enabled = True, buckets = BUCKETS):
+        self.enabled = enabled
+        self.buckets = buckets
+        self._values = dict()
+        self._histograms = dict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @classmethod
+    def build(cls):
+        enabled = appier.conf("REPO_METRICS", True, cast = bool)
+        metrics = cls(enabled = enabled)
+        if enabled: metrics.listen()
+        return metrics
+
+    def listen(self):
+        # registers the command listener in the MongoDB driver (if available)
+        # note that only the clients created after this call are monitored
+        if not pymongo: return
+        pymongo.monitoring.register(CommandListener(self))
+
+    def inc(self, name, value = 1, **labels):
+        if not self.enabled: return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock: self._values[key] = self._values.get(key, 0) + value
+
+    def observe(self, name, value, buckets = None, **labels):
+        if not self.enabled: return
+        buckets = buckets or self.buckets
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect.bisect_left(buckets, value)
+        with self._lock:
+            histogram = self._histograms.get(key, None)
+            if not histogram:
+                histogram = [buckets, [0] * (len(buckets) + 1), 0.0, 0]
+                self._histograms[key] = histogram
+            histogram[1][index] += 1
+            histogram[2] += value
+            histogram[3] += 1
+
+    def request(self, handler, environ, start_response):
+        # wraps the handling of a WSGI request so that its latency, its
+        # size and the number of MongoDB commands issued are recorded once
+        # the response (possibly a streamed one) is completely sent
+        if not self.enabled: return handler(environ, start_response)
+        state = dict(
+            method = environ.get("REQUEST_METHOD", "GET"),
+            code = "500",
+            start = time.time(),
+            commands = self.commands
+        )
+        def _start_response(status, headers, *args):
+            state["code"] = status.split(" ", 1)[0]
+            return start_response(status, headers, *args)
+        self.inc("repos_requests_in_flight")
+        try: result = handler(environ, _start_response)
+        except Exception:
+            self._finish(environ, state, 0)
+            raise
+        return MeteredResult(self, result, environ, state)
+
+    def render(self):
+        with self._lock:
+            values = list(self._values.items())
+            histograms = [
+                (key, (buckets, list(counts), total, count))
+                for key, (buckets, counts, total, count) in self._histograms.items()
+            ]
+
+        # groups the samples per metric name so that each of the metrics
+        # is preceded by its help and type lines (as the format requires)
+        # note that the samples are sorted by their labels and not by the
+        # lines so that the buckets of the histograms remain in order
+        samples = dict()
+        for (name, labels), value in values:
+            samples.setdefault(name, []).append((labels, [
+                "%s%s %s" % (name, self._labels(labels), self._number(value))
+            ]))
+        for (name, labels), (buckets, counts, total, count) in histograms:
+            lines = []
+            samples.setdefault(name, []).append((labels, lines))
+            cumulative = 0
+            for bound, bucket in zip(list(buckets) + ["+Inf"], counts):
+                cumulative += bucket
+                bound_s = bound if bound == "+Inf" else self._number(bound)
+                lines.append("%s_bucket%s %d" % (
+                    name, self._labels(labels + (("le", bound_s),)), cumulative
+                ))
+            lines.append("%s_sum%s %s" % (name, self._labels(labels), self._number(total)))
+            lines.append("%s_count%s %d" % (name, self._labels(labels), count))
+
+        buffer = []
+        for name in sorted(samples.keys()):
+            kind, description = METRICS.get(name, ("untyped", name))
+            buffer.append("# HELP %s %s" % (name, description))
+            buffer.append("# TYPE %s %s" % (name, kind))
+            for _labels, lines in sorted(samples[name], key = lambda sample: sample[0]):
+                buffer.extend(lines)
+        return "\n".join(buffer) + "\n"
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+            self._histograms.clear()
+
+    @property
+    def commands(self):
+        return getattr(self._local, "commands", 0)
+
+    def _command(self, name):
+        self._local.commands = self.commands + 1
+        self.inc("repos_mongo_commands_total", command = name)
+
+    def _finish(self, environ, state, size):
+        route = environ.get("repos.route", None) or "none"
+        duration = time.time() - state["start"]
+        self.inc("repos_requests_in_flight", -1)
+        self.inc("repos_requests_total", route = route, method = state["method"], code = state["code"])
+        self.observe("repos_request_duration_seconds", duration, route = route)
+        self.observe(
+            "repos_request_mongo_commands",
+            self.commands - state["commands"],
+            buckets = COUNT_BUCKETS,
+            route = route
+        )
+        try: length = int(environ.get("CONTENT_LENGTH", None) or 0)
+        except (TypeError, ValueError): length = 0
+        if length > 0: self.inc("repos_request_bytes_total", length, route = route)
+        if size: self.inc("repos_response_bytes_total", size, route = route)
+
+    def _labels(self, labels):
+        if not labels: return ""
+        return "{%s}" % ",".join(
+            "%s=\"%s\"" % (name, self._escape(value)) for name, value in labels
+        )
+
+    def _escape(self, value):
+        value = appier.legacy.UNICODE(value)
+        return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+    def _number(self, value):
+        if isinstance(value, float) and value.is_integer(): value = int(value)
+        return repr(value)
+
+class MeteredResult(object):
+    """
+    Iterable that wraps the (WSGI) result of a request counting
+    the bytes that are sent and finishing its measurement once
+    the response is exhausted or closed.
+    """
+
+    def __init__(self, metrics, result, environ, state):
+        self.metrics = metrics
+        self.result = result
+        self.environ = environ
+        self.state = state
+        self.size = 0
+        self._finished = False
+
+    def __iter__(self):
+        for chunk in self.result:
+            self.size += len(chunk)
+            yield chunk
+        self._finish()
+
+    def close(self):
+        try:
+            if hasattr(self.result, "close"): self.result.close()
+        finally:
+            self._finish()
+
+    def _finish(self):
+        if self._finished: return
+        self._finished = True
+        self.metrics._finish(self.environ, self.state, self.size)
+
+class MeteredStorage(object):
+    """
+    Proxy for a storage backend that records the duration, the
+    failures and the bytes transferred by each of its operations,
+    any other attribute is delegated to the backend as is.
+    """
+
+    def __init__(self, storage, name, metrics):
+        self.storage = storage
+        self.name = name
+        self.metrics = metrics
+
+    def __getattr__(self, name):
+        return getattr(self.storage, name)
+
+    def put(self, path, temp_path):
+        size = os.path.getsize(temp_path)
+        result = self._call("put", self.storage.put, path, temp_path)
+        self.metrics.inc("repos_storage_written_bytes_total", size, backend = self.name)
+        return result
+
+    def exists(self, path):
+        return self._call("exists", self.storage.exists, path)
+
+    def stat(self, path):
+        return self._call("stat", self.storage.stat, path)
+
+    def size(self, path):
+        return self.stat(path)[0]
+
+    def remove(self, path):
+        return self._call("remove", self.storage.remove, path)
+
+    def url(self, path, *args, **kwargs):
+        return self._call("url", self.storage.url, path, *args, **kwargs)
+
+    def read_g(self, *args, **kwargs):
+        # only the time spent inside the backend generator is measured, so
+        # that a slow consumer (eg: the client) does not inflate the value
+        generator = self.storage.read_g(*args, **kwargs)
+        duration = 0.0
+        size = 0
+        try:
+            while True:
+                start = time.time()
+                try: chunk = next(generator)
+                except StopIteration: break
+                finally: duration += time.time() - start
+                size += len(chunk)
+                yield chunk
+        except Exception:
+            self.metrics.inc("repos_storage_errors_total", backend = self.name, operation = "read")
+            raise
+        finally:
+            generator.close()
+            self.metrics.observe("repos_storage_duration_seconds", duration, backend = self.name, operation = "read")
+            self.metrics.inc("repos_storage_read_bytes_total", size, backend = self.name)
+
+    def _call(self, operation, method, *args, **kwargs):
+        start = time.time()
+        try: return method(*args, **kwargs)
+        except Exception:
+            self.metrics.inc("repos_storage_errors_total", backend = self.name, operation = operation)
+            raise
+        finally:
+            duration = time.time() - start
+            self.metrics.observe("repos_storage_duration_seconds", duration, backend = self.name, operation = operation)
+
+class CommandListener(LISTENER):
+    """
+    MongoDB command listener that counts the commands issued by
+    the driver, both globally and for the current thread (request).
+    """
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def started(self, event):
+        self.metrics._command(event.command_name)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+def route_name(method):
+    # builds a stable name for the route from the controller (or part)
+    # and the name of its action method (eg: package.retrieve)
+    owner = getattr(method, "__self__", None)
+    if not owner: return None
+    owner_name = owner.__class__.__name__
+    for suffix in ("Controller", "Part", "App"):
+        if not owner_name.endswith(suffix) or owner_name == suffix: continue
+        owner_name = owner_name[:-len(suffix)]
+        break
+    return "%s.%s" % (owner_name.lower(), method.__name__)
+
+metrics = None
+""" The global metrics registry instance, lazily created from
+the current configuration on its first usage """
+
+def get_metrics():
+    global metrics
+    if metrics: return metrics
+    metrics = Metrics.build()
+    return metrics
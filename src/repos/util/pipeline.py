@@ -0,0 +1,108 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import threading
+import collections
+import multiprocessing.pool
+
+import appier
+
+WORKERS = 2
+""" The default number of workers of the pool that runs the
+post publish stages, bounding the resources they may use """
+
+STAGES = collections.OrderedDict()
+""" The ordered map that associates the name of each of the
+registered post publish stages with the function that runs it """
+
+class Pipeline(object):
+    """
+    Bounded pool of workers that runs the post publish stages of
+    the artifacts outside of the request that published them.
+
+    The same artifact is never run twice at the same time, as a
+    re-submission while pending is queued to run once the current
+    run is finished, and with no workers the stages are run inline
+    (synchronously).
+    """
+
+    def __init__(self, workers = WORKERS):
+        self.workers = workers
+        self.processed = 0
+        self.failed = 0
+        self._pool = None
+        self._pending = set()
+        self._queued = dict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls):
+        workers = appier.conf("REPO_PIPELINE_WORKERS", WORKERS, cast = int)
+        return cls(workers = workers)
+
+    def submit(self, key, function, *args, **kwargs):
+        # in case the key is already pending the (latest) re-submission is
+        # queued instead of dropped, as the pending run may have already read
+        # the state that the re-submission is meant to process
+        with self._lock:
+            if key in self._pending:
+                self._queued[key] = (function, args, kwargs)
+                return False
+            self._pending.add(key)
+        self._schedule(key, function, args, kwargs)
+        return True
+
+    def is_pending(self, key):
+        with self._lock: return key in self._pending
+
+    def stats(self):
+        with self._lock: pending, queued = len(self._pending), len(self._queued)
+        return dict(
+            workers = self.workers,
+            pending = pending,
+            queued = queued,
+            processed = self.processed,
+            failed = self.failed
+        )
+
+    @property
+    def pool(self):
+        if self._pool: return self._pool
+        with self._lock:
+            if not self._pool: self._pool = multiprocessing.pool.ThreadPool(self.workers)
+        return self._pool
+
+    def _schedule(self, key, function, args, kwargs):
+        if self.workers > 0: self.pool.apply_async(self._run, (key, function, args, kwargs))
+        else: self._run(key, function, args, kwargs)
+
+    def _run(self, key, function, args, kwargs):
+        try:
+            function(*args, **kwargs)
+            self.processed += 1
+        except Exception as exception:
+            self.failed += 1
+            appier.get_app().logger.warning(
+                "Problem processing '%s': %s" % (key, appier.legacy.UNICODE(exception))
+            )
+        finally:
+            with self._lock:
+                queued = self._queued.pop(key, None)
+                if not queued: self._pending.discard(key)
+            if queued: self._schedule(key, *queued)
+
+def register_stage(name, function):
+    STAGES[name] = function
+
+def get_stage(name):
+    return STAGES.get(name, None)
+
+pipeline = None
+""" The global pipeline instance, lazily created from the
+current configuration on its first usage """
+
+def get_pipeline():
+    global pipeline
+    if pipeline: return pipeline
+    pipeline = Pipeline.build()
+    return pipeline
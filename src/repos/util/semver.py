@@ -0,0 +1,168 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import re
+
+import appier
+
+VERSION_REGEX = re.compile(
+    r"^\s*[v=]?\s*(\d+)(?:\.(\d+))?(?:\.(\d+))?(?:-([0-9A-Za-z\-\.]+))?(?:\+[0-9A-Za-z\-\.]+)?\s*$"
+)
+""" The regular expression that parses a (lenient) semantic version,
+where both the minor and the patch components are optional """
+
+PARTIAL_REGEX = re.compile(
+    r"^\s*[v=]?\s*(\*|[xX]|\d+)(?:\.(\*|[xX]|\d+))?(?:\.(\*|[xX]|\d+))?(?:-([0-9A-Za-z\-\.]+))?(?:\+[0-9A-Za-z\-\.]+)?\s*$"
+)
+""" The regular expression that parses the (possibly partial or
+wildcard based) versions that are used in the range expressions """
+
+COMPARATOR_REGEX = re.compile(r"^(<=|>=|<|>|=|\^|~>?)?\s*(.*)$")
+""" The regular expression that splits a comparator of a range into
+its operator and its (partial) version """
+
+RANGE_CHARS = "^~<>=*|, "
+""" The characters that identify a version specification as a range
+rather than an exact version (eg: ^1.4, >=1.2 <2, 1.x) """
+
+PADDING = 10
+""" The number of digits used for the numeric components in the sort
+keys, so that they may be compared as strings """
+
+class Range(object):
+    """
+    Semantic version range, made of alternative sets (||) of
+    comparators that must all be satisfied, following the rules
+    of the npm ranges (eg: ^1.4, ~2.0, 1.x, >=1.2 <2).
+
+    Pre-release versions only satisfy a range that explicitly
+    contains a pre-release version in one of its comparators.
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.sets = [self._parse_set(value) for value in spec.split("||")]
+
+    def match(self, version):
+        parsed = parse(version) if appier.legacy.is_string(version) else version
+        if not parsed: return False
+        for comparators in self.sets:
+            if not all(self._compare(parsed, operator, bound) for operator, bound, _explicit in comparators): continue
+            if parsed[3] and not any(
+                explicit and bound[:3] == parsed[:3] for _operator, bound, explicit in comparators
+            ): continue
+            return True
+        return False
+
+    def _parse_set(self, value):
+        # normalizes the hyphen ranges (eg: 1.2 - 2.3) into a pair of
+        # comparators and then expands each of the comparators
+        value = re.sub(r"\s+-\s+", " - ", value.replace(",", " ").strip())
+        tokens = value.split()
+        if len(tokens) == 3 and tokens[1] == "-": tokens = [">=" + tokens[0], "<=" + tokens[2]]
+        comparators = []
+        pending = ""
+        for token in tokens:
+            if token in ("<", "<=", ">", ">=", "=", "^", "~"):
+                pending = token
+                continue
+            comparators.extend(self._expand(pending + token))
+            pending = ""
+        return comparators
+
+    def _expand(self, value):
+        operator, version = COMPARATOR_REGEX.match(value.strip()).groups()
+        operator = "~" if operator == "~>" else operator or "="
+        match = PARTIAL_REGEX.match(version)
+        appier.verify(
+            match,
+            message = "Invalid version range '%s'" % self.spec,
+            code = 400,
+            exception = appier.OperationalError
+        )
+        major, minor, patch, pre = match.groups()
+        parts = [None if part in (None, "*", "x", "X") else int(part) for part in (major, minor, patch)]
+        pre = tuple(pre.split(".")) if pre else ()
+        if parts[0] == None: parts = [None, None, None]
+        if parts[1] == None: parts[2] = None
+
+        # marks the bounds that contain the pre-release of the comparator (and
+        # not the one added to the exclusive upper bounds) as explicit, as only
+        # those allow pre-release versions to satisfy the range
+        bounds = self._bounds(operator, parts, pre)
+        return [(operator, bound, bool(pre) and bound[3] == pre) for operator, bound in bounds]
+
+    def _bounds(self, operator, parts, pre):
+        major, minor, patch = parts
+        lower = (major or 0, minor or 0, patch or 0, pre)
+
+        # translates the caret, tilde and partial (wildcard) versions into
+        # a pair of comparators with an inclusive lower bound and an exclusive
+        # upper one, the upper bound excludes the pre-releases of its version
+        if operator == "^":
+            if major == None: return []
+            if major > 0 or minor == None: upper = (major + 1, 0, 0, ("0",))
+            elif minor > 0 or patch == None: upper = (0, minor + 1, 0, ("0",))
+            else: upper = (0, 0, patch + 1, ("0",))
+            return [(">=", lower), ("<", upper)]
+        if operator == "~":
+            if major == None: return []
+            if minor == None: upper = (major + 1, 0, 0, ("0",))
+            else: upper = (major, minor + 1, 0, ("0",))
+            return [(">=", lower), ("<", upper)]
+        if major == None: return [] if operator in ("=", ">=", "<=") else [("<", (0, 0, 0, ("0",)))]
+        if minor == None: upper = (major + 1, 0, 0, ("0",))
+        elif patch == None: upper = (major, minor + 1, 0, ("0",))
+        else: upper = None
+        if operator == "=": return [(">=", lower), ("<", upper)] if upper else [("=", lower)]
+        if operator == ">": return [(">=", upper)] if upper else [(">", lower)]
+        if operator == "<=": return [("<", upper)] if upper else [("<=", lower)]
+        return [(operator, lower)]
+
+    def _compare(self, version, operator, bound):
+        result = compare(version, bound)
+        if operator == "=": return result == 0
+        if operator == ">": return result > 0
+        if operator == ">=": return result >= 0
+        if operator == "<": return result < 0
+        if operator == "<=": return result <= 0
+        return False
+
+def parse(version):
+    # parses the version into a (major, minor, patch, pre-release) tuple
+    # returning an invalid value for the versions that are not semantic
+    if not version: return None
+    match = VERSION_REGEX.match(version)
+    if not match: return None
+    major, minor, patch, pre = match.groups()
+    return (int(major), int(minor or 0), int(patch or 0), tuple(pre.split(".")) if pre else ())
+
+def compare(first, second):
+    if not first[:3] == second[:3]: return -1 if first[:3] < second[:3] else 1
+    first_pre, second_pre = first[3], second[3]
+    if first_pre == second_pre: return 0
+    if not first_pre: return 1
+    if not second_pre: return -1
+    first_key = [_identifier(value) for value in first_pre]
+    second_key = [_identifier(value) for value in second_pre]
+    return -1 if first_key < second_key else 1
+
+def sort_key(version):
+    # builds a string that sorts (lexicographically) in the same order as
+    # the semantic versions, so that a data source is able to sort them
+    parsed = parse(version)
+    if not parsed: return None
+    major, minor, patch, pre = parsed
+    key = ".".join(str(value).zfill(PADDING) for value in (major, minor, patch))
+    if not pre: return key + "~"
+    return key + "-" + ".".join(
+        "0" + value.zfill(PADDING) if value.isdigit() else "1" + value for value in pre
+    )
+
+def is_range(spec):
+    if not spec: return False
+    if any(char in spec for char in RANGE_CHARS): return True
+    return any(part in ("x", "X") for part in spec.split("."))
+
+def _identifier(value):
+    return (0, int(value), "") if value.isdigit() else (1, 0, value)
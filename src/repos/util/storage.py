@@ -0,0 +1,310 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+import os
+import calendar
+import tempfile
+
+import appier
+
+from . import metrics
+
+CHUNK_SIZE = 65536
+""" The default size in bytes of the chunks that are read
+from the storage when streaming the contents of a file """
+
+EXPIRES = 300
+""" The default number of seconds for which the presigned
+URLs of the remote storage are going to be valid """
+
+class Storage(object):
+    """
+    Abstract interface for the backends where the files of the
+    artifacts are kept, every file is identified by a relative
+    and slash separated path (eg: name/version).
+
+    Files are first spooled into a local temporary file and only
+    then put into the storage, so that partial files are never
+    visible to the readers of the storage.
+    """
+
+    is_local = False
+
+    def put(self, path, temp_path):
+        raise appier.NotImplementedError()
+
+    def exists(self, path):
+        raise appier.NotImplementedError()
+
+    def stat(self, path):
+        raise appier.NotImplementedError()
+
+    def read_g(self, path, start = 0, end = None, chunk_size = CHUNK_SIZE):
+        raise appier.NotImplementedError()
+
+    def remove(self, path):
+        raise appier.NotImplementedError()
+
+    def walk(self, prefix = ""):
+        raise appier.NotImplementedError()
+
+    def spool_path(self, directory):
+        return tempfile.gettempdir()
+
+    def url(
+        self,
+        path,
+        expires = EXPIRES,
+        file_name = None,
+        content_type = None,
+        content_encoding = None
+    ):
+        return None
+
+    def size(self, path):
+        return self.stat(path)[0]
+
+class LocalStorage(Storage):
+    """
+    Storage backend that keeps the files under a directory of
+    the local file system, by default the one defined by the
+    `REPO_PATH` configuration value.
+    """
+
+    is_local = True
+
+    def __init__(self, base_path = None):
+        Storage.__init__(self)
+        self._base_path = base_path
+
+    @classmethod
+    def build(cls):
+        return cls()
+
+    @property
+    def base_path(self):
+        return self._base_path or appier.conf("REPO_PATH", "repo")
+
+    def full_path(self, path):
+        full_path = os.path.join(self.base_path, path)
+        return os.path.normpath(full_path)
+
+    def put(self, path, temp_path):
+        # the temporary file is expected to be in the same file system
+        # (see the spool path) so that the final rename is atomic
+        file_path = self.full_path(path)
+        self._ensure_path(os.path.dirname(file_path))
+        if hasattr(os, "replace"): os.replace(temp_path, file_path)
+        else:
+            if os.path.exists(file_path): os.remove(file_path)
+            os.rename(temp_path, file_path)
+
+    def exists(self, path):
+        return os.path.exists(self.full_path(path))
+
+    def stat(self, path):
+        stat = os.stat(self.full_path(path))
+        return stat.st_size, stat.st_mtime
+
+    def read_g(self, path, start = 0, end = None, chunk_size = CHUNK_SIZE):
+        # opens the file and seeks to the requested start offset then
+        # yields chunks until the (inclusive) end offset is reached or
+        # the end of file is found, bounding memory by the chunk size
+        file = open(self.full_path(path), "rb")
+        try:
+            file.seek(start)
+            pending = None if end == None else end - start + 1
+            while True:
+                if pending == 0: break
+                size = chunk_size if pending == None else min(chunk_size, pending)
+                data = file.read(size)
+                if not data: break
+                if not pending == None: pending -= len(data)
+                yield data
+        finally:
+            file.close()
+
+    def remove(self, path):
+        # removes the file and then the directories that became empty
+        # (up to the base one) so that the tree does not keep growing
+        file_path = self.full_path(path)
+        os.remove(file_path)
+        base_path = os.path.normpath(self.base_path)
+        path = os.path.dirname(file_path)
+        while not path == base_path and path.startswith(base_path):
+            if os.listdir(path): break
+            os.rmdir(path)
+            path = os.path.dirname(path)
+
+    def walk(self, prefix = ""):
+        # walks the base directory (or the prefix one) yielding the path, size
+        # and modification time of every file, skipping hidden directories
+        # (eg: staging) unless they are explicitly requested as the prefix
+        base_path = self.base_path
+        root_path = self.full_path(prefix) if prefix else base_path
+        for name, subdirs, files in os.walk(root_path, topdown = True):
+            subdirs[:] = sorted(subdir for subdir in subdirs if not subdir.startswith("."))
+            for filename in sorted(files):
+                file_path = os.path.join(name, filename)
+                try: stat = os.stat(file_path)
+                except OSError: continue
+                path = os.path.relpath(file_path, base_path)
+                yield path.replace(os.path.sep, "/"), stat.st_size, stat.st_mtime
+
+    def spool_path(self, directory):
+        spool_path = self.full_path(directory)
+        self._ensure_path(spool_path)
+        return spool_path
+
+    def _ensure_path(self, path):
+        try: os.makedirs(path)
+        except OSError:
+            if not os.path.isdir(path): raise
+
+class S3Storage(Storage):
+    """
+    Storage backend for S3 compatible services (eg: AWS S3 or
+    MinIO), able to generate short lived presigned URLs so that
+    downloads do not have to pass through the application.
+
+    Requires the `boto3` package, which is only imported when
+    the backend is first used.
+    """
+
+    def __init__(
+        self,
+        bucket,
+        prefix = "",
+        endpoint = None,
+        region = None,
+        access_key = None,
+        secret_key = None
+    ):
+        Storage.__init__(self)
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix else ""
+        self.endpoint = endpoint
+        self.region = region
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self._client = None
+
+    @classmethod
+    def build(cls):
+        return cls(
+            appier.conf("REPO_S3_BUCKET", None),
+            prefix = appier.conf("REPO_S3_PREFIX", ""),
+            endpoint = appier.conf("REPO_S3_ENDPOINT", None),
+            region = appier.conf("REPO_S3_REGION", None),
+            access_key = appier.conf("REPO_S3_ACCESS_KEY", None),
+            secret_key = appier.conf("REPO_S3_SECRET_KEY", None)
+        )
+
+    @property
+    def client(self):
+        if self._client: return self._client
+        import boto3
+        self._client = boto3.client(
+            "s3",
+            endpoint_url = self.endpoint,
+            region_name = self.region,
+            aws_access_key_id = self.access_key,
+            aws_secret_access_key = self.secret_key
+        )
+        return self._client
+
+    def key(self, path):
+        return self.prefix + path
+
+    def put(self, path, temp_path):
+        try: self.client.upload_file(temp_path, self.bucket, self.key(path))
+        finally: os.remove(temp_path)
+
+    def exists(self, path):
+        return True if self._head(path) else False
+
+    def stat(self, path):
+        head = self._head(path)
+        if not head: raise OSError("No such file '%s'" % path)
+        modified = calendar.timegm(head["LastModified"].utctimetuple())
+        return head["ContentLength"], modified
+
+    def read_g(self, path, start = 0, end = None, chunk_size = CHUNK_SIZE):
+        # only the requested range of bytes is retrieved from the storage
+        # and then read in chunks, so that memory usage is bounded
+        range = "bytes=%d-%s" % (start, "" if end == None else str(end))
+        kwargs = dict(Range = range) if start or not end == None else dict()
+        response = self.client.get_object(Bucket = self.bucket, Key = self.key(path), **kwargs)
+        body = response["Body"]
+        try:
+            while True:
+                data = body.read(chunk_size)
+                if not data: break
+                yield data
+        finally:
+            body.close()
+
+    def remove(self, path):
+        self.client.delete_object(Bucket = self.bucket, Key = self.key(path))
+
+    def walk(self, prefix = ""):
+        paginator = self.client.get_paginator("list_objects_v2")
+        pages = paginator.paginate(Bucket = self.bucket, Prefix = self.key(prefix))
+        for page in pages:
+            for item in page.get("Contents", []):
+                path = item["Key"][len(self.prefix):]
+                parts = path[len(prefix):].split("/")[:-1]
+                if any(part.startswith(".") for part in parts): continue
+                modified = calendar.timegm(item["LastModified"].utctimetuple())
+                yield path, item["Size"], modified
+
+    def url(
+        self,
+        path,
+        expires = EXPIRES,
+        file_name = None,
+        content_type = None,
+        content_encoding = None
+    ):
+        params = dict(Bucket = self.bucket, Key = self.key(path))
+        if file_name: params["ResponseContentDisposition"] = "filename=\"%s\"" % file_name
+        if content_type: params["ResponseContentType"] = content_type
+        if content_encoding: params["ResponseContentEncoding"] = content_encoding
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params = params,
+            ExpiresIn = expires
+        )
+
+    def _head(self, path):
+        import botocore.exceptions
+        try: return self.client.head_object(Bucket = self.bucket, Key = self.key(path))
+        except botocore.exceptions.ClientError as exception:
+            code = exception.response.get("Error", {}).get("Code")
+            if code in ("404", "NoSuchKey", "NotFound"): return None
+            raise
+
+BACKENDS = dict(
+    local = LocalStorage,
+    s3 = S3Storage
+)
+""" The map that associates the name of each of the storage
+backends with the class that implements it """
+
+storage = None
+""" The global storage instance, lazily created from the
+current configuration on its first usage """
+
+def get_storage():
+    global storage
+    if storage: return storage
+    name = appier.conf("REPO_STORAGE", "local")
+    appier.verify(
+        name in BACKENDS,
+        message = "Invalid storage backend '%s'" % name,
+        exception = appier.OperationalError
+    )
+    storage = BACKENDS[name].build()
+    _metrics = metrics.get_metrics()
+    if _metrics.enabled: storage = metrics.MeteredStorage(storage, name, _metrics)
+    return storage
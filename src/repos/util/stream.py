@@ -0,0 +1,26 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+class BufferStream(object):
+    """
+    Minimal write only (and non seekable) stream that buffers
+    the written data until it's popped by the consumer.
+
+    Allows APIs that write into file objects (eg: zipfile) to
+    be used as producers for generator based HTTP responses.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data